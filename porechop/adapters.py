@@ -25,6 +25,12 @@ class Adapter(object):
             self.start_sequence = both_ends_sequence
             self.end_sequence = both_ends_sequence
         self.best_start_score, self.best_end_score = 0.0, 0.0
+        self.kmer_screen_count = None
+        self.kmer_screen_partial_start, self.kmer_screen_partial_end = False, False
+
+        # For full barcode adapters: the sequences before and after the barcode in the start and
+        # end sequences.
+        self.start_barcode_flanks, self.end_barcode_flanks = None, None
 
     def best_start_or_end_score(self):
         return max(self.best_start_score, self.best_end_score)
@@ -468,31 +474,41 @@ def make_full_native_barcode_adapter(barcode_num):
     start_barcode_seq = barcode.start_sequence[1]
     end_barcode_seq = barcode.end_sequence[1]
 
-    start_full_seq = 'AATGTACTTCGTTCAGTTACGTATTGCTAAGGTTAA' + start_barcode_seq + 'CAGCACCT'
-    end_full_seq = 'AGGTGCTG' + end_barcode_seq + 'TTAACCTTAGCAATACGTAACTGAACGAAGT'
+    start_flanks = ('AATGTACTTCGTTCAGTTACGTATTGCTAAGGTTAA', 'CAGCACCT')
+    end_flanks = ('AGGTGCTG', 'TTAACCTTAGCAATACGTAACTGAACGAAGT')
+    start_full_seq = start_flanks[0] + start_barcode_seq + start_flanks[1]
+    end_full_seq = end_flanks[0] + end_barcode_seq + end_flanks[1]
 
-    return Adapter('Native barcoding ' + str(barcode_num) + ' (full sequence)',
-                   start_sequence=('NB' + '%02d' % barcode_num + '_start', start_full_seq),
-                   end_sequence=('NB' + '%02d' % barcode_num + '_end', end_full_seq))
+    adapter = Adapter('Native barcoding ' + str(barcode_num) + ' (full sequence)',
+                      start_sequence=('NB' + '%02d' % barcode_num + '_start', start_full_seq),
+                      end_sequence=('NB' + '%02d' % barcode_num + '_end', end_full_seq))
+    adapter.start_barcode_flanks, adapter.end_barcode_flanks = start_flanks, end_flanks
+    return adapter
 
 
 def make_old_full_rapid_barcode_adapter(barcode_num):  # applies to SQK-RBK001
     barcode = [x for x in ADAPTERS if x.name == 'Barcode ' + str(barcode_num) + ' (forward)'][0]
     start_barcode_seq = barcode.start_sequence[1]
 
-    start_full_seq = 'AATGTACTTCGTTCAGTTACG' + 'TATTGCT' + start_barcode_seq + \
-                     'GTTTTCGCATTTATCGTGAAACGCTTTCGCGTTTTTCGTGCGCCGCTTCA'
+    start_flanks = ('AATGTACTTCGTTCAGTTACG' + 'TATTGCT',
+                    'GTTTTCGCATTTATCGTGAAACGCTTTCGCGTTTTTCGTGCGCCGCTTCA')
+    start_full_seq = start_flanks[0] + start_barcode_seq + start_flanks[1]
 
-    return Adapter('Rapid barcoding ' + str(barcode_num) + ' (full sequence, old)',
-                   start_sequence=('RB' + '%02d' % barcode_num + '_full', start_full_seq))
+    adapter = Adapter('Rapid barcoding ' + str(barcode_num) + ' (full sequence, old)',
+                      start_sequence=('RB' + '%02d' % barcode_num + '_full', start_full_seq))
+    adapter.start_barcode_flanks = start_flanks
+    return adapter
 
 
 def make_new_full_rapid_barcode_adapter(barcode_num):  # applies to SQK-RBK004
     barcode = [x for x in ADAPTERS if x.name == 'Barcode ' + str(barcode_num) + ' (forward)'][0]
     start_barcode_seq = barcode.start_sequence[1]
 
-    start_full_seq = 'AATGTACTTCGTTCAGTTACG' + 'GCTTGGGTGTTTAACC' + start_barcode_seq + \
-                     'GTTTTCGCATTTATCGTGAAACGCTTTCGCGTTTTTCGTGCGCCGCTTCA'
+    start_flanks = ('AATGTACTTCGTTCAGTTACG' + 'GCTTGGGTGTTTAACC',
+                    'GTTTTCGCATTTATCGTGAAACGCTTTCGCGTTTTTCGTGCGCCGCTTCA')
+    start_full_seq = start_flanks[0] + start_barcode_seq + start_flanks[1]
 
-    return Adapter('Rapid barcoding ' + str(barcode_num) + ' (full sequence, new)',
-                   start_sequence=('RB' + '%02d' % barcode_num + '_full', start_full_seq))
+    adapter = Adapter('Rapid barcoding ' + str(barcode_num) + ' (full sequence, new)',
+                      start_sequence=('RB' + '%02d' % barcode_num + '_full', start_full_seq))
+    adapter.start_barcode_flanks = start_flanks
+    return adapter
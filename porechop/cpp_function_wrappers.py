@@ -16,7 +16,9 @@ not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-from ctypes import CDLL, cast, c_char_p, c_int, c_void_p
+import functools
+import itertools
+from ctypes import CDLL, cast, c_char_p, c_int, c_int64, c_void_p, c_double, POINTER, Structure
 
 SO_FILE = 'cpp_functions.so'
 SO_FILE_FULL = os.path.join(os.path.dirname(os.path.realpath(__file__)), SO_FILE)
@@ -33,6 +35,113 @@ C_LIB.adapterAlignment.argtypes = [c_char_p,  # Read sequence
 C_LIB.adapterAlignment.restype = c_void_p     # String describing alignment
 
 
+class AlignmentResult(Structure):
+    """
+    Matches the AlignmentResult struct in alignment.h. trimReadEnds fills in arrays of these
+    directly, so no result strings need to be made or parsed.
+    """
+    _fields_ = [('read_start', c_int),
+                ('read_end', c_int),
+                ('adapter_start', c_int),
+                ('adapter_end', c_int),
+                ('raw_score', c_int),
+                ('aligned_region_percent_identity', c_double),
+                ('full_adapter_percent_identity', c_double)]
+
+
+C_LIB.adapterIdentityBatch.argtypes = [c_char_p,           # Read sequence
+                                       POINTER(c_char_p),  # Adapter sequences
+                                       c_int,              # Adapter count
+                                       c_int,              # Match score
+                                       c_int,              # Mismatch score
+                                       c_int,              # Gap open score
+                                       c_int,              # Gap extension score
+                                       POINTER(c_double)]  # Identities (one per adapter)
+C_LIB.adapterIdentityBatch.restype = None
+
+
+class MiddleAdapterHit(Structure):
+    """
+    Matches the MiddleAdapterHit struct in path_alignment.h.
+    """
+    _fields_ = [('read_start', c_int),
+                ('read_end', c_int),
+                ('full_adapter_percent_identity', c_double)]
+
+
+C_LIB.middleAdapterHits.argtypes = [c_char_p,                   # Read sequence
+                                    c_char_p,                   # Adapter sequence
+                                    c_int,                      # Match score
+                                    c_int,                      # Mismatch score
+                                    c_int,                      # Gap open score
+                                    c_int,                      # Gap extension score
+                                    c_double,                   # Identity threshold
+                                    c_int,                      # Max hits
+                                    POINTER(MiddleAdapterHit)]  # Hits
+C_LIB.middleAdapterHits.restype = c_int                         # Hit count
+
+
+C_LIB.kmerScreenPasses.argtypes = [POINTER(c_char_p),  # Read sequences
+                                   c_int,              # Read count
+                                   POINTER(c_char_p),  # Adapter sequences
+                                   c_int,              # Adapter count
+                                   c_double,           # Identity threshold
+                                   POINTER(c_int)]     # Passes (per read/adapter)
+C_LIB.kmerScreenPasses.restype = None
+
+
+C_LIB.createAdapterProfileSet.argtypes = [POINTER(c_char_p),  # Adapter sequences
+                                          POINTER(c_int),     # Always align (one per adapter)
+                                          c_int,              # Adapter count
+                                          c_int,              # Match score
+                                          c_int,              # Mismatch score
+                                          c_int,              # Gap open score
+                                          c_int,              # Gap extension score
+                                          c_double,           # Identity threshold
+                                          c_int,              # Minimum read bases
+                                          c_char_p,           # Barcode anchor flank
+                                          c_int,              # Flank before barcode
+                                          c_int,              # Barcode length
+                                          POINTER(c_int),     # Full adapter barcodes
+                                          c_double,           # Anchor barcode threshold
+                                          c_double,           # Anchor barcode diff
+                                          c_int,              # Barcode early exit
+                                          c_double]           # Barcode diff
+C_LIB.createAdapterProfileSet.restype = c_void_p              # Pointer to the profile set
+
+C_LIB.deleteAdapterProfileSet.argtypes = [c_void_p]
+C_LIB.deleteAdapterProfileSet.restype = None
+
+
+class ReadEndTrims(Structure):
+    """
+    Matches the ReadEndTrims struct in read_end_trimming.h.
+    """
+    _fields_ = [('start_trim_amount', c_int),
+                ('end_trim_amount', c_int)]
+
+
+# The values of the EndAlignmentCall enum in read_end_trimming.h: what happened with each adapter
+# at a read end.
+NOT_ALIGNED, ALIGNED, TRIMMED = 0, 1, 2
+
+C_LIB.trimReadEnds.argtypes = [c_void_p,                  # Start adapter profile set
+                               c_void_p,                  # End adapter profile set
+                               c_char_p,                  # Read ends (concatenated)
+                               POINTER(c_int64),          # Read sequence offsets
+                               c_int,                     # Read count
+                               c_int,                     # End size
+                               c_int,                     # Extra trim size
+                               c_double,                  # End threshold
+                               c_int,                     # Min trim size
+                               POINTER(ReadEndTrims),     # Trims (one per read)
+                               POINTER(c_int),            # Start calls (per read/adapter)
+                               POINTER(AlignmentResult),  # Start results (per read/adapter)
+                               POINTER(c_int),            # End calls (per read/adapter)
+                               POINTER(AlignmentResult)]  # End results (per read/adapter)
+C_LIB.trimReadEnds.restype = None
+
+
 # This function cleans up the heap memory for the C strings returned by the other C functions. It
 # must be called after them.
 C_LIB.freeCString.argtypes = [c_void_p]
@@ -53,6 +162,141 @@ def adapter_alignment(read_sequence, adapter_sequence, scoring_scheme_vals):
     return result_string
 
 
+def adapter_identity_batch(read_sequence, adapter_sequences, scoring_scheme_vals):
+    """
+    Python wrapper for adapterIdentityBatch C++ function. Aligns one read sequence to each of the
+    adapter sequences and returns a ctypes array of full adapter percent identities (one per
+    adapter). This is faster than adapter_alignment because no traceback is done.
+    """
+    adapter_count = len(adapter_sequences)
+    identities = (c_double * adapter_count)()
+    if adapter_count:
+        C_LIB.adapterIdentityBatch(read_sequence.encode('utf-8'),
+                                   get_c_string_array(tuple(adapter_sequences)), adapter_count,
+                                   scoring_scheme_vals[0], scoring_scheme_vals[1],
+                                   scoring_scheme_vals[2], scoring_scheme_vals[3], identities)
+    return identities
+
+
+def kmer_screen_passes(read_sequences, adapter_sequences, threshold):
+    """
+    Python wrapper for kmerScreenPasses C++ function. Returns a ctypes array with an entry for each
+    read and adapter (read index * adapter count + adapter index): 1 if the read shares enough
+    k-mers with the adapter that they could align with a full adapter identity of at least the
+    threshold, 0 if not.
+    """
+    adapter_count = len(adapter_sequences)
+    passes = (c_int * (len(read_sequences) * adapter_count))()
+    if adapter_count and read_sequences:
+        read_array = (c_char_p * len(read_sequences))(*[x.encode('utf-8')
+                                                        for x in read_sequences])
+        C_LIB.kmerScreenPasses(read_array, len(read_sequences),
+                               get_c_string_array(tuple(adapter_sequences)), adapter_count,
+                               threshold, passes)
+    return passes
+
+
+def middle_adapter_hits(read_sequence, adapter_sequence, scoring_scheme_vals, threshold):
+    """
+    Python wrapper for middleAdapterHits C++ function. Returns a list of MiddleAdapterHit for all
+    of the adapter's hits in the read at or above the identity threshold, best first.
+    """
+    # Every hit needs some matching read bases, and masked bases can't match again, so this many
+    # hits is always enough.
+    min_hit_matches = max(int(len(adapter_sequence) * threshold / 100.0), 1)
+    max_hits = len(read_sequence) // min_hit_matches + 1
+    hits = (MiddleAdapterHit * max_hits)()
+    hit_count = C_LIB.middleAdapterHits(read_sequence.encode('utf-8'),
+                                        adapter_sequence.encode('utf-8'),
+                                        scoring_scheme_vals[0], scoring_scheme_vals[1],
+                                        scoring_scheme_vals[2], scoring_scheme_vals[3],
+                                        threshold, max_hits, hits)
+    return hits[:hit_count]
+
+
+class AdapterProfileSet(object):
+    """
+    Python wrapper for the AdapterProfileSet C++ class: the adapter sequences for one end of the
+    reads, along with the settings for aligning them, prepared once in C++ and then used for every
+    read. The C++ object is deleted along with this one.
+    """
+
+    def __init__(self, adapter_sequences, always_align, scoring_scheme_vals, threshold,
+                 min_read_bases, barcode_anchor=None, barcode_diff=None):
+        """
+        barcode_anchor is None or (flank sequence, whether the flank is before the barcodes,
+        barcode length, index of each full barcode adapter's barcode adapter or -1 for others,
+        barcode threshold, barcode diff).
+        If barcode_diff (the --barcode_diff setting) is given, the always-aligned barcodes are
+        aligned with an early exit.
+        """
+        self.adapter_count = len(adapter_sequences)
+        self.pointer = None
+        adapter_array = (c_char_p * self.adapter_count)(*[x.encode('utf-8')
+                                                          for x in adapter_sequences])
+        always_align_array = (c_int * self.adapter_count)(*always_align)
+        if barcode_anchor is None:
+            barcode_anchor = ('', True, 0, [-1] * self.adapter_count, 0.0, 0.0)
+        flank, flank_before_barcode, barcode_length, full_adapter_barcodes, \
+            anchor_barcode_threshold, anchor_barcode_diff = barcode_anchor
+        full_adapter_barcodes_array = (c_int * self.adapter_count)(*full_adapter_barcodes)
+        barcode_early_exit = barcode_diff is not None
+        self.pointer = C_LIB.createAdapterProfileSet(adapter_array, always_align_array,
+                                                     self.adapter_count, scoring_scheme_vals[0],
+                                                     scoring_scheme_vals[1],
+                                                     scoring_scheme_vals[2],
+                                                     scoring_scheme_vals[3], threshold,
+                                                     min_read_bases, flank.encode('utf-8'),
+                                                     int(flank_before_barcode), barcode_length,
+                                                     full_adapter_barcodes_array,
+                                                     anchor_barcode_threshold, anchor_barcode_diff,
+                                                     int(barcode_early_exit),
+                                                     barcode_diff or 0.0)
+
+    def __del__(self):
+        if self.pointer is not None:
+            C_LIB.deleteAdapterProfileSet(self.pointer)
+
+
+def trim_read_ends(start_profiles, end_profiles, read_sequences, end_size, extra_trim_size,
+                   end_threshold, min_trim_size):
+    """
+    Python wrapper for trimReadEnds C++ function: finds the adapters at both ends of all the reads
+    in one call. Returns ctypes arrays of the reads' trim amounts (one ReadEndTrims per read) and,
+    for each end, the call (NOT_ALIGNED, ALIGNED or TRIMMED) and AlignmentResult for each read and
+    adapter (read index * adapter count + adapter index).
+    """
+    # Only the read ends are needed, so long reads are cut down to their start and end before
+    # being given to C++ (which then takes the same start and end from them).
+    read_count = len(read_sequences)
+    seq_bytes = [(x if len(x) <= 2 * end_size else x[:end_size] + x[-end_size:]).encode('utf-8')
+                 for x in read_sequences]
+    seqs = b''.join(seq_bytes)
+    seq_offsets = (c_int64 * (read_count + 1))(0, *itertools.accumulate(len(x)
+                                                                        for x in seq_bytes))
+    trims = (ReadEndTrims * read_count)()
+    start_count = read_count * start_profiles.adapter_count
+    end_count = read_count * end_profiles.adapter_count
+    start_calls, start_results = (c_int * start_count)(), (AlignmentResult * start_count)()
+    end_calls, end_results = (c_int * end_count)(), (AlignmentResult * end_count)()
+    if read_count:
+        C_LIB.trimReadEnds(start_profiles.pointer, end_profiles.pointer, seqs, seq_offsets,
+                           read_count, end_size, extra_trim_size, end_threshold, min_trim_size,
+                           trims, start_calls, start_results, end_calls, end_results)
+    return trims, start_calls, start_results, end_calls, end_results
+
+
+@functools.lru_cache(maxsize=1024)
+def get_c_string_array(sequences):
+    """
+    Returns a ctypes array of C strings for a tuple of Python strings. The same adapter sequences
+    are used for many reads, so the arrays are cached instead of being rebuilt for each call. The
+    cache is limited, as adapter set discovery aligns varying subsets of the adapters (whichever
+    pass the k-mer screen for each read).
+    """
+    return (c_char_p * len(sequences))(*[x.encode('utf-8') for x in sequences])
+
+
 def c_string_to_python_string(c_string):
     """
     This function casts a C string to a Python string and then calls a function to delete the C
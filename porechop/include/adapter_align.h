@@ -8,13 +8,18 @@
 
 using namespace seqan;
 
+
 // Functions that are called by the Python script must have C linkage, not C++ linkage.
 extern "C" {
     char * adapterAlignment(char * readSeq, char * adapterSeq,
                             int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore);
+
     void freeCString(char * p);
 }
 
+ScoredAlignment alignAdapter(Dna5String & sequenceH, Dna5String & sequenceV,
+                             Score<int, Simple> & scoringScheme);
+
 char * cppStringToCString(std::string cpp_string);
 
 
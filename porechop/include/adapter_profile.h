@@ -0,0 +1,117 @@
+#ifndef ADAPTER_PROFILE_H
+#define ADAPTER_PROFILE_H
+
+#include <string>
+#include <utility>
+#include <vector>
+#include "alignment.h"
+#include "myers_filter.h"
+
+
+// The adapters for one end of the reads (all start sequences or all end sequences), prepared once
+// per run so aligning them to reads doesn't need to convert them again. Python gets a pointer to
+// one of these from createAdapterProfileSet and passes it back for each batch of reads (see
+// trimReadEnds). It isn't changed after it's made, so threads can share it (each thread has its
+// own DP workspace, see alignReadsInLanes).
+//
+// Different adapter sets can share a sequence, so each distinct sequence gets only one profile and
+// is aligned only once to each read, with the result copied to every adapter that uses it.
+//
+// The set can also have a barcode anchor, for full barcode adapters (e.g. the native barcoding
+// adapters, see add_full_barcode_adapter_sets), which are all the same apart from their barcode.
+// The constant flank on the outside of the barcodes is aligned to each read once. Where it's
+// found, the barcodes are only aligned to the window of the read next to it, and only the full
+// adapter for the best barcode is aligned to the read. Reads without the flank, or without a
+// barcode in the window good enough to call, are aligned as usual.
+//
+// Barcodes which must be scored (to call the reads' barcodes) can also be aligned with an early
+// exit. Then a barcode is only aligned to a read end if it could trim it or change its barcode
+// call. They're tried in order of an upper bound on their identity, so most of them can be ruled
+// out after aligning just the best.
+
+
+// One distinct adapter sequence, encoded, with its prefilter bit masks.
+struct AdapterProfile {
+    std::string adapter;
+    MyersFilter filter;
+};
+
+
+// The constant sequence next to the barcodes of the full barcode adapters. The flank is on the
+// outside of the barcode: before it at read starts and after it at read ends.
+struct BarcodeAnchor {
+    std::string flank;  // encoded, or empty if the set has no anchor
+    bool flankBeforeBarcode;
+    int barcodeLength;
+    double barcodeThreshold;  // the --barcode_threshold and --barcode_diff settings
+    double barcodeDiff;
+};
+
+
+class AdapterProfileSet {
+public:
+    AdapterProfileSet(char ** adapterSeqs, int * alwaysAlign, int adapterCount,
+                      int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                      double minIdentity, int minReadBases, const char * anchorFlank,
+                      bool flankBeforeBarcode, int barcodeLength, int * fullAdapterBarcodes,
+                      double anchorBarcodeThreshold, double anchorBarcodeDiff,
+                      bool barcodeEarlyExit, double barcodeDiff);
+    int adapterCount() const {return int(m_profileIndices.size());}
+    void alignReadEnds(const std::string * reads, int readCount, int * aligned,
+                       AlignmentResult * results) const;
+
+private:
+    std::vector<AdapterProfile> m_profiles;
+    std::vector<int> m_profileIndices;  // for each adapter, its sequence's index in m_profiles
+    std::vector<bool> m_alwaysAlign;    // for each adapter, e.g. a barcode which needs a score
+    BarcodeAnchor m_anchor;
+    std::vector<int> m_fullAdapterBarcodes;  // for each adapter, its barcode's adapter (or -1)
+    std::vector<int> m_barcodeAdapters;      // the adapters which are barcodes of full adapters
+    std::vector<bool> m_barcodeProfiles;     // for each profile, whether it's one of their barcodes
+    bool m_barcodeEarlyExit;
+    double m_barcodeDiff;  // see barcodeCouldChangeCall
+    int m_matchScore;
+    int m_mismatchScore;
+    int m_gapOpenScore;
+    int m_gapExtensionScore;
+    double m_minIdentity;
+    int m_minReadBases;
+
+    bool profileAligns(int adapter, const std::string & read, const std::string & reverseRead,
+                       std::vector<int> & filterCalls) const;
+    bool filterPasses(int profile, const std::string & read, const std::string & reverseRead,
+                      std::vector<int> & filterCalls) const;
+    void findBarcodeWindows(const std::string * reads, int readCount,
+                            std::vector<std::string> & windows,
+                            std::vector<int> & windowStarts) const;
+    void alignBarcodeWindows(const std::vector<std::string> & windows,
+                             std::vector<int> & windowStarts, int * aligned,
+                             AlignmentResult * results) const;
+    bool windowBarcodeCalled(int read, const AlignmentResult * results) const;
+    int getBestBarcode(int read, const AlignmentResult * results) const;
+    void alignBarcodeCandidates(const std::string * reads, int readCount,
+                                std::vector<std::vector<std::pair<double, int>>> & candidates,
+                                int * aligned, AlignmentResult * results) const;
+    double getBestBarcodeIdentity(int read, const int * aligned,
+                                  const AlignmentResult * results) const;
+    bool barcodeCouldChangeCall(double maxIdentity, double bestIdentity) const;
+};
+
+
+extern "C" {
+    AdapterProfileSet * createAdapterProfileSet(char ** adapterSeqs, int * alwaysAlign,
+                                                int adapterCount, int matchScore,
+                                                int mismatchScore, int gapOpenScore,
+                                                int gapExtensionScore, double minIdentity,
+                                                int minReadBases, char * anchorFlank,
+                                                int flankBeforeBarcode, int barcodeLength,
+                                                int * fullAdapterBarcodes,
+                                                double anchorBarcodeThreshold,
+                                                double anchorBarcodeDiff, int barcodeEarlyExit,
+                                                double barcodeDiff);
+
+    void deleteAdapterProfileSet(AdapterProfileSet * profiles);
+}
+
+
+#endif // ADAPTER_PROFILE_H
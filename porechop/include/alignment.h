@@ -10,6 +10,21 @@
 using namespace seqan;
 
 
+// This struct holds the same values as ScoredAlignment::getString, but it is filled in directly by
+// the lane aligner (and PathAligner) so the results don't need to go through a string. Python has a
+// matching ctypes Structure (AlignmentResult in cpp_function_wrappers.py), so the field order and
+// types must stay in sync with that.
+struct AlignmentResult {
+    int readStartPos;
+    int readEndPos;
+    int adapterStartPos;
+    int adapterEndPos;
+    int rawScore;
+    double alignedRegionPercentIdentity;
+    double fullAdapterPercentIdentity;
+};
+
+
 class ScoredAlignment {
 public:
     ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
@@ -0,0 +1,52 @@
+#ifndef KMER_SCREEN_H
+#define KMER_SCREEN_H
+
+#include <string>
+#include <vector>
+
+
+// This is a quick screen for adapter set discovery, to find which adapters can't possibly have a
+// full adapter identity over the threshold in which check reads, so they don't need aligning.
+//
+// It uses the q-gram lemma: if an alignment of the adapter has at most e edits, then at least
+// (adapter length - k + 1 - k * e) of the adapter's k-mers (counted by position) are unchanged in
+// the read. A full adapter identity of at least t allows at most adapter length * (1/t - 1) edits
+// (unmatched adapter bases plus read bases inserted into the adapter). The unchanged k-mers are
+// also all on nearby diagonals (read position minus adapter position), as only the e edits can
+// shift them, so they must fall in a band of e + 1 diagonals. A read end without that many shared
+// k-mers in any band can't reach the threshold.
+
+
+// The positions of each k-mer in a read, as linked lists.
+struct ReadKmerIndex {
+    std::vector<int> firstPositions;  // for each k-mer, where it first occurs (or -1)
+    std::vector<int> nextPositions;   // for each read position, where its k-mer next occurs
+    int readLength;
+};
+
+
+class KmerScreen {
+public:
+    static const int KMER_SIZE = 6;
+
+    KmerScreen(const char * adapterSeq, double minIdentity);
+    bool passes(const ReadKmerIndex & read, std::vector<int> & diagonalCounts) const;
+
+    static int getMaxEdits(int adapterLength, double minIdentity);
+    static void indexRead(const std::string & read, ReadKmerIndex & index);
+
+private:
+    std::vector<int> m_kmers;  // -1 for any k-mer with an N, which counts as shared everywhere
+    int m_nKmerCount;
+    int m_maxEdits;
+    int m_minSharedKmers;
+};
+
+
+extern "C" {
+    void kmerScreenPasses(char ** readSeqs, int readCount, char ** adapterSeqs,
+                          int adapterCount, double minIdentity, int * passes);
+}
+
+
+#endif // KMER_SCREEN_H
@@ -0,0 +1,130 @@
+#ifndef LANE_ALIGNMENT_H
+#define LANE_ALIGNMENT_H
+
+#include <cstdint>
+#include <cstdlib>
+#include <new>
+#include <string>
+#include <vector>
+#include "alignment.h"
+#include "path_alignment.h"
+
+
+// This aligns many reads to one adapter at once. It does the same DP as PathAligner (so the
+// results also match alignAdapter's), but each cell holds a vector of values, one for each of
+// several reads of the same length (the lanes). The read ends which Porechop aligns adapters to are
+// all the same length (apart from reads shorter than the end size), so nearly all of them can
+// share vectors.
+//
+// The vectors use GCC's vector extensions (which Clang also supports). On x86-64, the DP is
+// compiled for AVX2 (8 lanes), SSE4.2 (4 lanes) and the baseline SSE2 (4 lanes), and the best one
+// for the CPU is chosen at run time. Elsewhere, the 4 lane version is compiled for the target's
+// own SIMD instructions (e.g. NEON on ARM).
+
+
+typedef int32_t EightLanes __attribute__((vector_size(32)));
+typedef int32_t FourLanes __attribute__((vector_size(16)));
+
+
+// The rows of vectors are allocated with this, as std::allocator only aligns to 16 bytes (before
+// C++17). The alignment is fixed rather than taken from the type, because GCC gives EightLanes a
+// smaller alignment when compiling for instruction sets without 32-byte registers, but the AVX2
+// version of the DP still expects 32.
+template <typename T>
+struct LaneAllocator {
+    typedef T value_type;
+    static const size_t ALIGNMENT = 64;
+
+    LaneAllocator() = default;
+    template <typename U> LaneAllocator(const LaneAllocator<U> &) {}
+    T * allocate(size_t n) {
+        void * p = nullptr;
+        if (posix_memalign(&p, ALIGNMENT, n * sizeof(T)) != 0)
+            throw std::bad_alloc();
+        return static_cast<T *>(p);
+    }
+    void deallocate(T * p, size_t) {free(p);}
+};
+
+template <typename T, typename U>
+bool operator==(const LaneAllocator<T> &, const LaneAllocator<U> &) {return true;}
+template <typename T, typename U>
+bool operator!=(const LaneAllocator<T> &, const LaneAllocator<U> &) {return false;}
+
+template <typename T>
+using LaneArray = std::vector<T, LaneAllocator<T>>;
+
+
+// PathCounts for each lane.
+template <typename Lanes>
+struct LaneCounts {
+    Lanes matches;
+    Lanes diagonals;
+    Lanes readGaps;
+    Lanes adapterGaps;
+    Lanes startRead;
+    Lanes startAdapter;
+};
+
+
+// The rows of the DP matrices for each lane (see PathMatrixRows).
+template <typename Lanes>
+struct LaneMatrixRows {
+    LaneArray<Lanes> diagonalScores;
+    LaneArray<Lanes> verticalScores;
+    LaneArray<LaneCounts<Lanes>> diagonalCounts;
+    LaneArray<LaneCounts<Lanes>> verticalCounts;
+    LaneArray<Lanes> lastRowMoves;
+    LaneArray<Lanes> lastColumnScores;
+    LaneArray<LaneCounts<Lanes>> lastColumnCounts;
+    LaneArray<Lanes> lastColumnMoves;
+};
+
+
+// The DP rows and the reads' bases in lane order, kept between alignments to avoid reallocating
+// them.
+template <typename Lanes>
+struct LaneWorkspace {
+    LaneMatrixRows<Lanes> rows;
+    LaneArray<Lanes> readColumns;
+};
+
+
+template <typename Lanes>
+class LaneAligner {
+public:
+    static const int LANES = int(sizeof(Lanes) / sizeof(int32_t));
+
+    // The DP for one set of lanes, compiled for the instruction set which suits Lanes.
+    typedef void (*FillFunction)(const Lanes * readColumns, int readLength,
+                                 const char * adapterSeq, int adapterLength,
+                                 int matchScore, int mismatchScore, int gapOpenScore,
+                                 int gapExtensionScore, LaneMatrixRows<Lanes> & rows);
+
+    LaneAligner(int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                FillFunction fillRows, LaneWorkspace<Lanes> & workspace);
+    void alignReads(const std::string * const * reads, int readCount,
+                    const std::string & adapter, AlignmentResult * const * results);
+
+private:
+    int m_matchScore;
+    int m_mismatchScore;
+    int m_gapOpenScore;
+    int m_gapExtensionScore;
+    FillFunction m_fillRows;
+    PathAligner m_pathAligner;
+    LaneMatrixRows<Lanes> & m_rows;
+    LaneArray<Lanes> & m_readColumns;
+
+    void alignLanes(const std::string * const * reads, int laneCount,
+                    const std::string & adapter, AlignmentResult ** results);
+};
+
+
+void alignReadsInLanes(const std::string * const * reads, int readCount,
+                       const std::string & adapter, int matchScore, int mismatchScore,
+                       int gapOpenScore, int gapExtensionScore,
+                       AlignmentResult * const * results);
+
+
+#endif // LANE_ALIGNMENT_H
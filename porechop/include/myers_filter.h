@@ -0,0 +1,51 @@
+#ifndef MYERS_FILTER_H
+#define MYERS_FILTER_H
+
+#include <cstdint>
+#include <string>
+#include <vector>
+
+
+// This is a quick check of whether aligning an adapter to a read end could possibly give an
+// aligned region identity over a threshold. It uses Myers' bit-parallel edit distance algorithm,
+// so each read base costs only a few bitwise operations.
+//
+// The aligned region of an adapter alignment (see ScoredAlignment) runs from where both sequences
+// have started to where either has ended, so it is one of: the whole adapter against part of the
+// read, an adapter prefix against a read suffix, an adapter suffix against a read prefix, or the
+// whole read against part of the adapter. In each case, the region's edit cost is at least the
+// edit distance between its adapter and read bases, and its match count is at most the number of
+// adapter bases. If no choice of region can reach the identity that way, the alignment can't
+// either.
+
+
+// The edit distances for an adapter (the pattern) against a read (the text), where the adapter
+// may start anywhere in the read.
+struct MyersDistances {
+    int bestFullAdapterDistance;         // whole adapter, ending anywhere in the read
+    std::vector<int> prefixEndDistances;  // adapter prefix of length i+1, ending at the read end
+};
+
+
+// The adapter's bit masks (where each base occurs in it, forwards and reversed) are made when the
+// filter is, so a filter can be kept and used for any number of reads.
+class MyersFilter {
+public:
+    static const int MAX_ADAPTER_LENGTH = 64;
+
+    MyersFilter(const char * adapterSeq);
+    bool canReachIdentity(const std::string & read, const std::string & reverseRead,
+                          double minIdentity, int minReadBases) const;
+    double maxFullAdapterIdentity(const std::string & read) const;
+
+private:
+    int m_adapterLength;
+    uint64_t m_forwardPeq[5];
+    uint64_t m_reversePeq[5];
+
+    MyersDistances getDistances(const uint64_t * peq, const std::string & read) const;
+    static bool possibleIdentity(int adapterBases, int editDistance, double identityFraction);
+};
+
+
+#endif // MYERS_FILTER_H
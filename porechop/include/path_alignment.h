@@ -0,0 +1,200 @@
+#ifndef PATH_ALIGNMENT_H
+#define PATH_ALIGNMENT_H
+
+#include <string>
+#include <vector>
+#include "alignment.h"
+
+
+// This is a linear-memory version of the adapter alignment done by alignAdapter: the same
+// semi-global, affine gap dynamic programming, but with no traceback matrix and no alignment
+// strings. Instead, each cell carries a few counts describing the best path which reaches it,
+// which is all that's needed for the values in an AlignmentResult. Ties are broken the same way
+// that SeqAn breaks them, so the results match those from alignAdapter.
+
+
+// Low enough to never win a comparison, but with room to add gap scores without overflowing.
+static const int MIN_SCORE = -(1 << 28);
+
+
+// The running totals for the best path into a DP cell.
+struct PathCounts {
+    int matches;
+    int diagonals;
+    int readGaps;     // read bases aligned to a gap, within the adapter's span
+    int adapterGaps;  // adapter bases aligned to a gap, within the read's span
+    int startRead;    // where the path left the first row/column
+    int startAdapter;
+
+    static PathCounts atStart(int readPos, int adapterPos) {
+        return PathCounts{0, 0, 0, 0, readPos, adapterPos};
+    }
+    void addDiagonal(bool match) {matches += match; ++diagonals;}
+    void addReadGap() {++readGaps;}
+    void addAdapterGap() {++adapterGaps;}
+};
+
+
+// A cut-down version of PathCounts with just enough for the full adapter identity. The match count
+// and read gap count are packed into one integer, so carrying them along costs a single add.
+struct IdentityCounts {
+    long long packed;
+
+    static IdentityCounts atStart(int, int) {return IdentityCounts{0};}
+    void addDiagonal(bool match) {packed += match;}
+    void addReadGap() {packed += 1LL << 32;}
+    void addAdapterGap() {}
+    int matches() const {return int(packed & 0xFFFFFFFF);}
+    int readGaps() const {return int(packed >> 32);}
+};
+
+
+enum PathMove : char {NO_MOVE, DIAGONAL_MOVE, HORIZONTAL_MOVE, VERTICAL_MOVE};
+
+
+// The cell where the best path ends, along with its counts and the move which entered it.
+template <typename Counts>
+struct PathEnd {
+    int score;
+    int readPos;
+    int adapterPos;
+    Counts counts;
+    PathMove lastMove;
+};
+
+
+// The rows of the DP matrices, kept between alignments to avoid reallocating them.
+template <typename Counts>
+struct PathMatrixRows {
+    std::vector<int> diagonalScores;
+    std::vector<int> verticalScores;
+    std::vector<Counts> diagonalCounts;
+    std::vector<Counts> verticalCounts;
+    std::vector<PathMove> lastRowMoves;
+    std::vector<int> lastColumnScores;
+    std::vector<Counts> lastColumnCounts;
+    std::vector<PathMove> lastColumnMoves;
+};
+
+
+class PathAligner {
+public:
+    PathAligner(int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore);
+    void align(const char * readSeq, int readLength, const char * adapterSeq, int adapterLength,
+               AlignmentResult & result);
+    double fullAdapterIdentity(const char * readSeq, int readLength,
+                               const char * adapterSeq, int adapterLength);
+
+private:
+    int m_matchScore;
+    int m_mismatchScore;
+    int m_gapOpenScore;
+    int m_gapExtensionScore;
+    PathMatrixRows<PathCounts> m_pathRows;
+    PathMatrixRows<IdentityCounts> m_identityRows;
+
+    template <typename Counts>
+    PathEnd<Counts> findBestPath(const char * readSeq, int readLength,
+                                 const char * adapterSeq, int adapterLength,
+                                 PathMatrixRows<Counts> & rows);
+};
+
+
+// Python has a matching ctypes Structure (MiddleAdapterHit in cpp_function_wrappers.py), so the
+// field order and types must stay in sync with that.
+struct MiddleAdapterHit {
+    int readStartPos;
+    int readEndPos;
+    double fullAdapterPercentIdentity;
+};
+
+
+// The counts needed for a middle adapter hit: its identity and where it starts in the read.
+struct HitCounts {
+    int matches;
+    int readGaps;
+    int startRead;
+
+    static HitCounts atStart(int readPos, int) {return HitCounts{0, 0, readPos};}
+    void addDiagonal(bool match) {matches += match;}
+    void addReadGap() {++readGaps;}
+    void addAdapterGap() {}
+    bool operator==(const HitCounts & other) const {
+        return matches == other.matches && readGaps == other.readGaps &&
+               startRead == other.startRead;
+    }
+};
+
+
+// One cell of a DP column in the read direction. The vertical scores aren't needed from one column
+// to the next, so they aren't kept.
+struct ColumnCell {
+    int diagonalScore;
+    int horizontalScore;
+    HitCounts diagonalCounts;
+    HitCounts horizontalCounts;
+
+    bool operator==(const ColumnCell & other) const {
+        return diagonalScore == other.diagonalScore && horizontalScore == other.horizontalScore &&
+               diagonalCounts == other.diagonalCounts &&
+               horizontalCounts == other.horizontalCounts;
+    }
+};
+
+
+// This finds every hit for an adapter in a read, giving the same hits as repeatedly aligning the
+// adapter to the read and masking out each hit, until the best alignment is below the threshold.
+// But it only does the full DP once. The matrix is filled column by column along the read, with
+// every CHECKPOINT_INTERVAL'th column saved. Masking a hit only changes the columns after its
+// start, so those are recomputed from the last checkpoint before it, stopping as soon as a
+// checkpoint after the hit comes out the same as before (the rest of the matrix can't change).
+class MiddleAdapterFinder {
+public:
+    MiddleAdapterFinder(int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore);
+    int findHits(const char * readSeq, const char * adapterSeq, double threshold, int maxHits,
+                 MiddleAdapterHit * hits);
+
+private:
+    static const int CHECKPOINT_INTERVAL = 32;
+
+    int m_matchScore;
+    int m_mismatchScore;
+    int m_gapOpenScore;
+    int m_gapExtensionScore;
+
+    std::string m_read;
+    std::string m_adapter;
+    std::vector<ColumnCell> m_column;
+    std::vector<ColumnCell> m_checkpoints;
+    std::vector<int> m_lastRowScores;
+    std::vector<HitCounts> m_lastRowCounts;
+    std::vector<PathMove> m_lastRowMoves;
+    std::vector<int> m_lastColumnScores;
+    std::vector<HitCounts> m_lastColumnCounts;
+    std::vector<PathMove> m_lastColumnMoves;
+
+    void fillColumns(int firstChangedColumn, int lastChangedColumn);
+    void computeColumn(int j);
+    PathEnd<HitCounts> findBestHit() const;
+};
+
+
+void fillAlignmentResult(const PathEnd<PathCounts> & best, int adapterLength,
+                         AlignmentResult & result);
+std::string encodeBases(const char * seq);
+std::string encodeBases(const char * seq, int length);
+double roundLikeString(double value);
+
+
+extern "C" {
+    void adapterIdentityBatch(char * readSeq, char ** adapterSeqs, int adapterCount,
+                              int matchScore, int mismatchScore, int gapOpenScore,
+                              int gapExtensionScore, double * identities);
+
+    int middleAdapterHits(char * readSeq, char * adapterSeq, int matchScore, int mismatchScore,
+                          int gapOpenScore, int gapExtensionScore, double threshold, int maxHits,
+                          MiddleAdapterHit * hits);
+}
+
+
+#endif // PATH_ALIGNMENT_H
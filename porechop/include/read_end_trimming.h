@@ -0,0 +1,54 @@
+#ifndef READ_END_TRIMMING_H
+#define READ_END_TRIMMING_H
+
+#include <cstdint>
+#include <string>
+#include "adapter_profile.h"
+#include "alignment.h"
+
+
+// This finds the adapters at the ends of a whole batch of reads in one call: both ends of every
+// read are prefiltered and aligned against the start and end adapter profiles, the trim amounts
+// are decided and everything is returned in flat arrays. Python (and the GIL) isn't involved until
+// the whole batch is done, so Python threads can each run their own batch in parallel.
+
+
+// How much to trim from each end of one read.
+struct ReadEndTrims {
+    int startTrimAmount;
+    int endTrimAmount;
+};
+
+
+// What happened with each adapter at a read end. Python has matching constants (see
+// cpp_function_wrappers.py).
+enum EndAlignmentCall {
+    NOT_ALIGNED = 0,  // skipped by the prefilter (it couldn't trim the read)
+    ALIGNED = 1,      // aligned, but not well enough to trim the read
+    TRIMMED = 2       // aligned well enough to trim the read
+};
+
+
+// The settings for deciding whether an alignment trims a read end (see getTrimAmount).
+struct EndTrimSettings {
+    int endSize;
+    int extraTrimSize;
+    double endThreshold;
+    int minTrimSize;
+};
+
+
+int getTrimAmount(const AlignmentResult & result, bool readStart,
+                  const EndTrimSettings & settings);
+
+
+extern "C" {
+    void trimReadEnds(AdapterProfileSet * startProfiles, AdapterProfileSet * endProfiles,
+                      char * seqs, int64_t * seqOffsets, int readCount, int endSize,
+                      int extraTrimSize, double endThreshold, int minTrimSize,
+                      ReadEndTrims * trims, int * startCalls, AlignmentResult * startResults,
+                      int * endCalls, AlignmentResult * endResults);
+}
+
+
+#endif // READ_END_TRIMMING_H
@@ -21,6 +21,9 @@ import textwrap
 import shutil
 import argparse
 
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+LINE_ENDINGS = b'\r\n'
+
 
 def float_to_str(num, decimals, max_num=0):
     """
@@ -120,52 +123,201 @@ def load_fasta_or_fastq(filename):
         sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
 
 
+def iterate_fasta_or_fastq(filename):
+    """
+    Like load_fasta_or_fastq, but returns a generator of the records instead of a list, so the
+    whole file never needs to be held in memory.
+    """
+    file_type = get_sequence_file_type(filename)
+    if file_type == 'FASTA':
+        records = iterate_fasta(filename)
+    else:  # FASTQ
+        records = iterate_fastq(filename)
+
+    def check_records():
+        try:
+            yield from records
+        except IndexError:
+            sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
+    return check_records(), file_type
+
+
 def load_fasta(fasta_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fasta file.
     """
-    if get_compression_type(fasta_filename) == 'gz':
-        open_func = gzip.open
-    else:  # plain text
-        open_func = open
-    fasta_seqs = []
-    with open_func(fasta_filename, 'rt') as fasta_file:
-        name = ''
-        sequence = ''
-        for line in fasta_file:
-            line = line.strip()
-            if not line:
-                continue
-            if line[0] == '>':  # Header line = start of new contig
-                if name:
-                    fasta_seqs.append((name.split()[0], sequence, name))
-                    sequence = ''
-                name = line[1:]
-            else:
-                sequence += line
-        if name:
-            fasta_seqs.append((name.split()[0], sequence, name))
-    return fasta_seqs
+    return list(iterate_fasta(fasta_filename))
+
+
+def iterate_fasta(fasta_filename):
+    """
+    Yields a tuple (header, seq) for each record in the fasta file. A record only ends where a line
+    starts with '>', so blocks without one are kept aside until the record which spans them is
+    complete. They're only joined then, and the search for the record's end resumes where it left
+    off, so a long record isn't copied or searched again for each block.
+    """
+    buf, pos, pending, pending_size = b'', 0, [], 0
+    for block in iterate_file_blocks(fasta_filename):
+        previous_end = pending[-1][-1:] if pending else buf[-1:]
+        if find_fasta_header(block, 0) == -1 and \
+                not (previous_end == b'\n' and block.startswith(b'>')):
+            pending.append(block)
+            pending_size += len(block)
+            continue
+        search_pos = max(len(buf) - pos + pending_size - 1, 0)
+        buf = b''.join([buf[pos:]] + pending + [block])
+        pending, pending_size = [], 0
+        pos = yield from parse_fasta_records(buf, 0, False, search_pos)
+    search_pos = max(len(buf) - pos + pending_size - 1, 0)
+    buf, pending = b''.join([buf[pos:]] + pending), []
+    yield from parse_fasta_records(buf, 0, True, search_pos)
+
+
+def parse_fasta_records(buf, pos, at_end, search_pos=0):
+    """
+    Yields the complete FASTA records in a block of bytes, starting from pos, and returns the
+    position of the first incomplete record. A record's sequence runs until the next line starting
+    with '>', so only at the end of the file is the last record known to be complete. There's no
+    such line before search_pos. Wrapped sequence lines are joined by deleting the line breaks from
+    the whole sequence at once. Other whitespace is only stripped from the ends of each line, so a
+    space within a line is kept. Like a truncated FASTQ file, a file which doesn't start with a
+    header raises an IndexError.
+    """
+    while True:
+        header_end = buf.find(b'\n', pos)
+        if header_end == -1:
+            if not at_end:
+                return pos
+            header_end = len(buf)
+        header = buf[pos:header_end].strip()
+        if not header:  # blank line
+            if header_end == len(buf):
+                return header_end
+            pos = header_end + 1
+            continue
+        if not header.startswith(b'>'):  # only possible for the first record
+            raise IndexError
+        next_header = find_fasta_header(buf, max(header_end, search_pos))
+        if next_header == -1:
+            if not at_end:
+                return pos
+            next_header = len(buf)
+        name = header[1:].decode()
+        sequence = buf[header_end+1:next_header]
+        if b' ' in sequence or b'\t' in sequence:  # rare, so each line is only stripped then
+            sequence = b''.join(line.strip() for line in sequence.split(b'\n'))
+        else:
+            sequence = sequence.translate(None, LINE_ENDINGS)
+        yield name.split()[0], sequence.decode(), name
+        pos = next_header + 1
+
+
+def find_fasta_header(buf, start):
+    """
+    Returns the position of the first line break followed by '>' in a block of bytes, at or after
+    start, or -1 if there isn't one. Only headers can have '>', so it's searched for on its own,
+    which is much faster than searching for both bytes.
+    """
+    header_pos = start
+    while True:
+        header_pos = buf.find(b'>', header_pos + 1)
+        if header_pos == -1:
+            return -1
+        if buf[header_pos - 1:header_pos] == b'\n':
+            return header_pos - 1
 
 
 def load_fastq(fastq_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fastq file.
     """
-    if get_compression_type(fastq_filename) == 'gz':
+    return list(iterate_fastq(fastq_filename))
+
+
+def iterate_fastq(fastq_filename):
+    """
+    Yields a tuple (header, seq) for each record in the fastq file. A record needs four line
+    breaks, so blocks which don't complete them are kept aside (not joined or searched again) until
+    the record which spans them is complete.
+    """
+    buf, pos, pending, pending_line_count = b'', 0, [], 0
+    for block in iterate_file_blocks(fastq_filename):
+        pending_line_count += count_line_breaks(block, 0, 4 - pending_line_count)
+        if pending_line_count < 4:
+            pending.append(block)
+            continue
+        buf = b''.join([buf[pos:]] + pending + [block])
+        pending = []
+        pos = yield from parse_fastq_records(buf, 0)
+        pending_line_count = count_line_breaks(buf, pos, 4)
+    if b''.join([buf[pos:]] + pending).strip():  # the file ended partway through a record
+        raise IndexError
+
+
+def parse_fastq_records(buf, pos):
+    """
+    Yields the complete FASTQ records in a block of bytes, starting from pos, and returns the
+    position of the first incomplete record. Each record is four lines, found with find instead of
+    by splitting the block into lines.
+    """
+    while True:
+        header_end = buf.find(b'\n', pos)
+        if header_end == -1:
+            return pos
+        header = buf[pos:header_end].strip()
+        if not header:  # blank line
+            pos = header_end + 1
+            continue
+        seq_end = buf.find(b'\n', header_end + 1)
+        if seq_end == -1:
+            return pos
+        spacer_end = buf.find(b'\n', seq_end + 1)
+        if spacer_end == -1:
+            return pos
+        qual_end = buf.find(b'\n', spacer_end + 1)
+        if qual_end == -1:
+            return pos
+        full_name = header[1:].decode()
+        sequence = buf[header_end+1:seq_end].strip().decode()
+        spacer = buf[seq_end+1:spacer_end].strip().decode()
+        qualities = buf[spacer_end+1:qual_end].strip().decode()
+        yield full_name.split()[0], sequence, spacer, qualities, full_name
+        pos = qual_end + 1
+
+
+def count_line_breaks(buf, start, max_count):
+    """
+    Returns the number of line breaks in a block of bytes from start, counting no more than
+    max_count. Each one is found with find, which is much faster than count over a whole block.
+    """
+    line_count, pos = 0, start - 1
+    while line_count < max_count:
+        pos = buf.find(b'\n', pos + 1)
+        if pos == -1:
+            break
+        line_count += 1
+    return line_count
+
+
+def iterate_file_blocks(filename):
+    """
+    Yields the contents of a (possibly gzipped) file as large blocks of bytes. If the file doesn't
+    end with a newline, one is added so every line in the file is terminated.
+    """
+    if get_compression_type(filename) == 'gz':
         open_func = gzip.open
     else:  # plain text
         open_func = open
-    reads = []
-    with open_func(fastq_filename, 'rt') as fastq:
-        for line in fastq:
-            full_name = line.strip()[1:]
-            short_name = full_name.split()[0]
-            sequence = next(fastq).strip()
-            spacer = next(fastq).strip()
-            qualities = next(fastq).strip()
-            reads.append((short_name, sequence, spacer, qualities, full_name))
-    return reads
+    with open_func(filename, 'rb') as seq_file:
+        block = b''
+        while True:
+            next_block = seq_file.read(READ_BLOCK_SIZE)
+            if not next_block:
+                break
+            block = next_block
+            yield block
+        if block and not block.endswith(b'\n'):
+            yield b'\n'
 
 
 def print_table(table, print_dest, alignments='', max_col_width=30, col_separation=3, indent=2,
@@ -330,12 +482,9 @@ def add_line_breaks_to_sequence(sequence, line_length):
     """
     if not sequence:
         return '\n'
-    seq_with_breaks = ''
-    pos = 0
-    while pos < len(sequence):
-        seq_with_breaks += sequence[pos:pos+line_length] + '\n'
-        pos += line_length
-    return seq_with_breaks
+    lines = [sequence[pos:pos+line_length] for pos in range(0, len(sequence), line_length)]
+    lines.append('')
+    return '\n'.join(lines)
 
 
 class MyHelpFormatter(argparse.HelpFormatter):
@@ -14,11 +14,29 @@ details. You should have received a copy of the GNU General Public License along
 not, see <http://www.gnu.org/licenses/>.
 """
 
-from .cpp_function_wrappers import adapter_alignment
+from .cpp_function_wrappers import adapter_identity_batch, middle_adapter_hits, trim_read_ends, \
+    AdapterProfileSet, TRIMMED
 from .misc import yellow, red, add_line_breaks_to_sequence, END_FORMATTING, RED, YELLOW
 
 
+# Seeds shorter than this would hit too often by chance to save any alignment.
+MIN_MIDDLE_SEED_SIZE = 6
+
+
 class NanoporeRead(object):
+    """
+    There can be millions of these, so they use __slots__ instead of a __dict__, and the lists,
+    sets and dicts which only some reads need (adapter alignments, middle adapter positions and
+    barcode scores) are left as None until they are first used. Middle adapters and the parts of
+    the read trimmed around them are kept as sorted lists of non-overlapping (start, end)
+    intervals, in the coordinates of the read with its start/end adapters trimmed.
+    """
+    __slots__ = ['name', 'seq', 'quals', 'rna', 'start_trim_amount', 'end_trim_amount',
+                 'start_adapter_alignments', 'end_adapter_alignments', 'middle_adapter_intervals',
+                 'middle_trim_intervals', 'middle_hit_str', 'start_barcode_scores',
+                 'end_barcode_scores', 'best_start_barcode', 'best_end_barcode',
+                 'second_best_start_barcode', 'second_best_end_barcode', 'barcode_call',
+                 'albacore_barcode_call']
 
     def __init__(self, name, seq, quals):
         self.name = name
@@ -30,21 +48,21 @@ class NanoporeRead(object):
         else:
             self.rna = False
 
+        # Reads from FASTA files have no qualities. They are only padded out when needed (see
+        # get_quals), so these reads don't carry a string of fake qualities around.
         self.quals = quals
-        if len(quals) < len(seq):
-            self.quals += '+' * (len(seq) - len(quals))
 
         self.start_trim_amount = 0
         self.end_trim_amount = 0
-        self.start_adapter_alignments = []
-        self.end_adapter_alignments = []
+        self.start_adapter_alignments = None
+        self.end_adapter_alignments = None
 
-        self.middle_adapter_positions = set()
-        self.middle_trim_positions = set()
+        self.middle_adapter_intervals = None
+        self.middle_trim_intervals = None
         self.middle_hit_str = ''
 
-        self.start_barcode_scores = {}
-        self.end_barcode_scores = {}
+        self.start_barcode_scores = None
+        self.end_barcode_scores = None
 
         self.best_start_barcode = ('none', 0.0)
         self.best_end_barcode = ('none', 0.0)
@@ -54,6 +72,39 @@ class NanoporeRead(object):
 
         self.albacore_barcode_call = None
 
+    def get_worker_input(self):
+        """
+        Returns what a worker process needs to process this read (see read_from_worker_input).
+        """
+        return (self.name, self.seq, self.quals, self.rna, self.start_trim_amount,
+                self.end_trim_amount, self.albacore_barcode_call)
+
+    def get_end_trim_results(self):
+        """
+        Returns the results of end trimming and barcoding, for sending back from a worker process.
+        """
+        return self.start_trim_amount, self.end_trim_amount, self.barcode_call
+
+    def set_end_trim_results(self, results):
+        self.start_trim_amount, self.end_trim_amount, self.barcode_call = results
+
+    def get_middle_trim_results(self):
+        """
+        Returns the results of the middle adapter search, for sending back from a worker process.
+        """
+        return self.middle_adapter_intervals, self.middle_trim_intervals, self.middle_hit_str
+
+    def set_middle_trim_results(self, results):
+        self.middle_adapter_intervals, self.middle_trim_intervals, self.middle_hit_str = results
+
+    def get_quals(self):
+        """
+        Returns the qualities, padded to the length of the sequence if there aren't enough.
+        """
+        if len(self.quals) < len(self.seq):
+            return self.quals + '+' * (len(self.seq) - len(self.quals))
+        return self.quals
+
     def get_seq_with_start_end_adapters_trimmed(self):
         if not self.start_trim_amount and not self.end_trim_amount:
             return self.seq
@@ -66,36 +117,36 @@ class NanoporeRead(object):
         return len(self.get_seq_with_start_end_adapters_trimmed())
 
     def get_quals_with_start_end_adapters_trimmed(self):
+        quals = self.get_quals()
         if not self.start_trim_amount and not self.end_trim_amount:
-            return self.quals
+            return quals
         start_pos = self.start_trim_amount
-        end_pos = len(self.quals) - self.end_trim_amount
-        trimmed_quals = self.quals[start_pos:end_pos]
+        end_pos = len(quals) - self.end_trim_amount
+        trimmed_quals = quals[start_pos:end_pos]
         return trimmed_quals
 
     def get_split_read_parts(self, min_split_read_size):
         """
-        Returns the read split into parts as determined by the middle_trim_positions set.
+        Returns the read split into parts as determined by the middle_trim_intervals list: the
+        pieces of the read between the trimmed intervals.
         """
         trimmed_seq = self.get_seq_with_start_end_adapters_trimmed()
         trimmed_quals = self.get_quals_with_start_end_adapters_trimmed()
         split_read_parts = []
-        part_seq, part_quals = [], []
-        for i in range(len(trimmed_seq)):
-            if i in self.middle_trim_positions:
-                if part_seq:
-                    split_read_parts.append((''.join(part_seq), ''.join(part_quals)))
-                    part_seq, part_quals = [], []
-            else:
-                part_seq.append(trimmed_seq[i])
-                part_quals.append(trimmed_quals[i])
-        if part_seq:
-            split_read_parts.append((''.join(part_seq), ''.join(part_quals)))
+        part_start = 0
+        for trim_start, trim_end in self.middle_trim_intervals:
+            trim_start = min(trim_start, len(trimmed_seq))
+            if trim_start > part_start:
+                split_read_parts.append((trimmed_seq[part_start:trim_start],
+                                         trimmed_quals[part_start:trim_start]))
+            part_start = max(part_start, trim_end)
+        if part_start < len(trimmed_seq):
+            split_read_parts.append((trimmed_seq[part_start:], trimmed_quals[part_start:]))
         split_read_parts = [x for x in split_read_parts if len(x[0]) >= min_split_read_size]
         return split_read_parts
 
     def get_fasta(self, min_split_read_size, discard_middle, untrimmed=False):
-        if not self.middle_trim_positions:
+        if not self.middle_trim_intervals:
             if untrimmed:
                 seq = self.seq
             else:
@@ -108,7 +159,7 @@ class NanoporeRead(object):
         elif discard_middle:
             return ''
         else:
-            fasta_str = ''
+            fasta_parts = []
             for i, split_read_part in enumerate(self.get_split_read_parts(min_split_read_size)):
                 read_name = add_number_to_read_name(self.name, i + 1)
                 if not split_read_part[0]:  # Don't return empty sequences
@@ -116,14 +167,14 @@ class NanoporeRead(object):
                 seq = add_line_breaks_to_sequence(split_read_part[0], 70)
                 if self.rna:
                     seq = seq.replace('T', 'U')
-                fasta_str += ''.join(['>', read_name, '\n', seq])
-            return fasta_str
+                fasta_parts += ['>', read_name, '\n', seq]
+            return ''.join(fasta_parts)
 
     def get_fastq(self, min_split_read_size, discard_middle, untrimmed=False):
-        if not self.middle_trim_positions:
+        if not self.middle_trim_intervals:
             if untrimmed:
                 seq = self.seq
-                quals = self.quals
+                quals = self.get_quals()
             else:
                 seq = self.get_seq_with_start_end_adapters_trimmed()
                 quals = self.get_quals_with_start_end_adapters_trimmed()
@@ -135,7 +186,7 @@ class NanoporeRead(object):
         elif discard_middle:
             return ''
         else:
-            fastq_str = ''
+            fastq_parts = []
             for i, split_read_part in enumerate(self.get_split_read_parts(min_split_read_size)):
                 read_name = add_number_to_read_name(self.name, i + 1)
                 seq, qual = split_read_part[0], split_read_part[1]
@@ -143,88 +194,110 @@ class NanoporeRead(object):
                     return ''
                 if self.rna:
                     seq = seq.replace('T', 'U')
-                fastq_str += ''.join(['@', read_name, '\n', seq, '\n+\n', qual, '\n'])
-            return fastq_str
-
-    def align_adapter_set(self, adapter_set, end_size, scoring_scheme_vals):
-        """
-        This function aligns the adapter to the reads and updates the best score for the adapter.
-        This is not to determine where to trim the reads, but rather to figure out which adapter
-        sets are present in the data.
-        """
-        if adapter_set.start_sequence:
-            read_seq_start = self.seq[:end_size]
-            score, _, _, _ = align_adapter(read_seq_start, adapter_set.start_sequence[1],
-                                           scoring_scheme_vals)
-            adapter_set.best_start_score = max(adapter_set.best_start_score, score)
-        if adapter_set.end_sequence:
-            read_seq_end = self.seq[-end_size:]
-            score, _, _, _ = align_adapter(read_seq_end, adapter_set.end_sequence[1],
-                                           scoring_scheme_vals)
-            adapter_set.best_end_score = max(adapter_set.best_end_score, score)
-
-    def find_start_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                        scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse):
-        """
-        Aligns one or more adapter sequences and possibly adjusts the read's start trim amount based
-        on the result.
-        """
-        read_seq_start = self.seq[:end_size]
-        for adapter in adapters:
-            if not adapter.start_sequence:
-                continue
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_start, adapter.start_sequence[1], scoring_scheme_vals)
-            if partial_score > end_threshold and read_end != end_size and \
-                    read_end - read_start >= min_trim_size:
-                trim_amount = read_end + extra_trim_size
-                self.start_trim_amount = max(self.start_trim_amount, trim_amount)
+                fastq_parts += ['@', read_name, '\n', seq, '\n+\n', qual, '\n']
+            return ''.join(fastq_parts)
+
+    def get_adapter_set_scores(self, adapter_sets, end_size, scoring_scheme_vals,
+                               start_sets=None, end_sets=None):
+        """
+        This function aligns the adapter sets to the start and end of the read and returns their
+        scores (two lists, one for the starts and one for the ends, with a score of 0.0 for any
+        adapter set without that sequence). This is not to determine where to trim the reads, but
+        rather to figure out which adapter sets are present in the data. If start_sets or end_sets
+        are given, only those adapter sets are aligned to that end of the read and the rest also
+        get a score of 0.0.
+        """
+        if start_sets is None:
+            start_sets = [x for x in adapter_sets if x.start_sequence]
+        if end_sets is None:
+            end_sets = [x for x in adapter_sets if x.end_sequence]
+        start_seqs = [x.start_sequence[1] for x in start_sets]
+        end_seqs = [x.end_sequence[1] for x in end_sets]
+
+        # Each distinct sequence is only aligned once to each read end. For a read no longer than
+        # end_size, both ends are the whole read, so they are aligned together.
+        read_start, read_end = self.seq[:end_size], self.seq[-end_size:]
+        if read_start == read_end:
+            start_identities = get_adapter_identities(read_start, start_seqs + end_seqs,
+                                                      scoring_scheme_vals)
+            end_identities = start_identities
+        else:
+            start_identities = get_adapter_identities(read_start, start_seqs, scoring_scheme_vals)
+            end_identities = get_adapter_identities(read_end, end_seqs, scoring_scheme_vals)
+        start_scores = {x: start_identities[x.start_sequence[1]] for x in start_sets}
+        end_scores = {x: end_identities[x.end_sequence[1]] for x in end_sets}
+
+        # The identities are rounded to the same precision as the string results from
+        # adapter_alignment, so the scores are the same as they would be from a full alignment.
+        return ([round(start_scores.get(x, 0.0), 6) for x in adapter_sets],
+                [round(end_scores.get(x, 0.0), 6) for x in adapter_sets])
+
+    def set_start_trim(self, trim_amount, alignments, check_barcodes, forward_or_reverse):
+        """
+        Sets the read's start trim amount (from find_read_end_trims) and keeps the alignments of
+        adapters to its start which trimmed it, along with any barcode scores. The alignments are
+        (adapter, alignment values, whether it trimmed the read) for each adapter that was aligned.
+        """
+        self.start_trim_amount = max(self.start_trim_amount, trim_amount)
+        for adapter, alignment, trimmed in alignments:
+            full_score, partial_score, read_start, read_end = alignment
+            if trimmed:
+                if self.start_adapter_alignments is None:
+                    self.start_adapter_alignments = []
                 self.start_adapter_alignments.append((adapter, full_score, partial_score,
                                                       read_start, read_end))
             if check_barcodes and adapter.is_barcode() and \
                     adapter.barcode_direction() == forward_or_reverse:
+                if self.start_barcode_scores is None:
+                    self.start_barcode_scores = {}
                 self.start_barcode_scores[adapter.get_barcode_name()] = full_score
 
-    def find_end_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                      scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse):
-        """
-        Aligns one or more adapter sequences and possibly adjusts the read's end trim amount based
-        on the result.
-        """
-        read_seq_end = self.seq[-end_size:]
-        for adapter in adapters:
-            if not adapter.end_sequence:
-                continue
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_end, adapter.end_sequence[1], scoring_scheme_vals)
-            if partial_score > end_threshold and read_start != 0 and \
-                    read_end - read_start >= min_trim_size:
-                trim_amount = (end_size - read_start) + extra_trim_size
-                self.end_trim_amount = max(self.end_trim_amount, trim_amount)
+    def set_end_trim(self, trim_amount, alignments, check_barcodes, forward_or_reverse):
+        """
+        Sets the read's end trim amount (from find_read_end_trims) and keeps the alignments of
+        adapters to its end which trimmed it, along with any barcode scores. The alignments are
+        (adapter, alignment values, whether it trimmed the read) for each adapter that was aligned.
+        """
+        self.end_trim_amount = max(self.end_trim_amount, trim_amount)
+        for adapter, alignment, trimmed in alignments:
+            full_score, partial_score, read_start, read_end = alignment
+            if trimmed:
+                if self.end_adapter_alignments is None:
+                    self.end_adapter_alignments = []
                 self.end_adapter_alignments.append((adapter, full_score, partial_score,
                                                     read_start, read_end))
             if check_barcodes and adapter.is_barcode() and \
                     adapter.barcode_direction() == forward_or_reverse:
+                if self.end_barcode_scores is None:
+                    self.end_barcode_scores = {}
                 self.end_barcode_scores[adapter.get_barcode_name()] = full_score
 
-    def find_middle_adapters(self, adapters, middle_threshold, extra_middle_trim_good_side,
-                             extra_middle_trim_bad_side, scoring_scheme_vals,
-                             start_sequence_names, end_sequence_names):
+    def find_middle_adapters(self, adapters, adapter_seeds, middle_threshold,
+                             extra_middle_trim_good_side, extra_middle_trim_bad_side,
+                             scoring_scheme_vals, start_sequence_names, end_sequence_names):
         """
-        Aligns an adapter sequence to the whole read to find places where the read should be split.
+        Aligns an adapter sequence to the read to find places where the read should be split.
+        Only the windows of the read around the adapter's seed k-mers (from adapter_seeds, made by
+        get_middle_adapter_seeds) are aligned, as a good enough hit can't be anywhere else.
         """
         masked_seq = self.get_seq_with_start_end_adapters_trimmed()
+        adapter_intervals, trim_intervals = [], []
         for adapter_name, adapter_seq in adapters:
-
-            # We keep aligning adapters as long we get strong hits, so we can find multiple
-            # occurrences in a single read.
-            while True:
-                full_score, _, read_start, read_end = align_adapter(masked_seq, adapter_seq,
-                                                                    scoring_scheme_vals)
-                if full_score >= middle_threshold:
+            windows = get_middle_adapter_windows(masked_seq, adapter_seq,
+                                                 adapter_seeds.get(adapter_seq))
+            for window_start, window_end in windows:
+
+                # All hits in the window are found in one go, each one masked out before looking
+                # for the next, so we can find multiple occurrences in a single read.
+                hits = middle_adapter_hits(masked_seq[window_start:window_end], adapter_seq,
+                                           scoring_scheme_vals, middle_threshold)
+                for hit in hits:
+                    full_score = hit.full_adapter_percent_identity
+                    read_start = hit.read_start + window_start
+                    read_end = hit.read_end + window_start + 1
                     masked_seq = masked_seq[:read_start] + '-' * (read_end - read_start) + \
                         masked_seq[read_end:]
-                    self.middle_adapter_positions.update(range(read_start, read_end))
+                    adapter_intervals.append((read_start, read_end))
 
                     self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
                                            str(read_start) + '-' + str(read_end) + ', ' + \
@@ -238,9 +311,11 @@ class NanoporeRead(object):
                     if adapter_name in end_sequence_names:
                         trim_end = read_end + extra_middle_trim_bad_side
 
-                    self.middle_trim_positions.update(range(trim_start, trim_end))
-                else:
-                    break
+                    trim_intervals.append((max(trim_start, 0), min(trim_end, len(masked_seq))))
+
+        if adapter_intervals:
+            self.middle_adapter_intervals = merge_intervals(adapter_intervals)
+            self.middle_trim_intervals = merge_intervals(trim_intervals)
 
     def formatted_start_seq(self, end_size, extra_trim_size):
         """
@@ -338,9 +413,9 @@ class NanoporeRead(object):
             end_name, end_id = self.best_end_barcode
             output += '  Barcodes:\n'
             all_start_barcodes_str = ', '.join([b[0] + ' (' + '%.1f' % b[1] + '%)'
-                                                for b in self.start_barcode_scores.items()])
+                                                for b in self.get_start_barcode_scores()])
             all_end_barcodes_str = ', '.join([b[0] + ' (' + '%.1f' % b[1] + '%)'
-                                              for b in self.end_barcode_scores.items()])
+                                              for b in self.get_end_barcode_scores()])
             output += '    start barcodes:        ' + all_start_barcodes_str + '\n'
             output += '    end barcodes:          ' + all_end_barcodes_str + '\n'
             output += '    best start barcode:    ' + start_name + ' (' + '%.1f' % start_id + '%)\n'
@@ -355,32 +430,40 @@ class NanoporeRead(object):
         If a middle adapter was found, this returns the relevant part of the read sequence, with
         the adapter highlighted in red.
         """
-        if not self.middle_adapter_positions:
+        if not self.middle_adapter_intervals:
             return
 
         trimmed_seq = self.get_seq_with_start_end_adapters_trimmed()
 
-        range_start = max(0, min(self.middle_trim_positions) - 100)
-        range_end = min(len(trimmed_seq),
-                        max(self.middle_trim_positions) + 100)
+        range_start, range_end = 0, len(trimmed_seq)
+        if self.middle_trim_intervals:
+            range_start = max(0, self.middle_trim_intervals[0][0] - 100)
+            range_end = min(len(trimmed_seq), self.middle_trim_intervals[-1][1] - 1 + 100)
         formatted_str = '' if range_start == 0 else '(' + str(range_start) + ' bp)...'
 
+        # The sequence is coloured in pieces, split wherever an adapter or trimmed interval starts
+        # or ends, as the colour can only change at those positions.
+        boundaries = {range_start, range_end}
+        for start, end in self.middle_adapter_intervals + self.middle_trim_intervals:
+            boundaries.update(x for x in (start, end) if range_start < x < range_end)
+        boundaries = sorted(boundaries)
+
         last_colour = None
-        for i in range(range_start, range_end):
-            char_colour = None
-            if i in self.middle_trim_positions:
-                char_colour = 'yellow'
-            if i in self.middle_adapter_positions:
-                char_colour = 'red'
-            if char_colour != last_colour:
+        for piece_start, piece_end in zip(boundaries, boundaries[1:]):
+            piece_colour = None
+            if in_intervals(piece_start, self.middle_trim_intervals):
+                piece_colour = 'yellow'
+            if in_intervals(piece_start, self.middle_adapter_intervals):
+                piece_colour = 'red'
+            if piece_colour != last_colour:
                 formatted_str += END_FORMATTING
-                if char_colour == 'yellow':
+                if piece_colour == 'yellow':
                     formatted_str += YELLOW
-                if char_colour == 'red':
+                if piece_colour == 'red':
                     formatted_str += RED
 
-            formatted_str += trimmed_seq[i]
-            last_colour = char_colour
+            formatted_str += trimmed_seq[piece_start:piece_end]
+            last_colour = piece_colour
         if last_colour is not None:
             formatted_str += END_FORMATTING
 
@@ -389,21 +472,37 @@ class NanoporeRead(object):
         return formatted_str
 
     def middle_adapter_results(self, verbosity):
-        if not self.middle_adapter_positions:
+        if not self.middle_adapter_intervals:
             return ''
         results = self.name + '\n' + self.middle_hit_str
         if verbosity > 1:
             results += self.formatted_middle_seq() + '\n'
         return results
 
+    def get_start_barcode_scores(self):
+        """
+        Returns (barcode name, score) pairs for the barcodes aligned to the start of the read.
+        """
+        if self.start_barcode_scores is None:
+            return []
+        return list(self.start_barcode_scores.items())
+
+    def get_end_barcode_scores(self):
+        """
+        Returns (barcode name, score) pairs for the barcodes aligned to the end of the read.
+        """
+        if self.end_barcode_scores is None:
+            return []
+        return list(self.end_barcode_scores.items())
+
     def determine_barcode(self, barcode_threshold, barcode_diff, require_two_barcodes):
         """
         This function works through the logic of choosing a barcode for the read based on the
         settings and the read's barcode alignments. It stores its result in self.barcode_call.
         """
-        start_barcode_scores = sorted(self.start_barcode_scores.items(), reverse=True,
+        start_barcode_scores = sorted(self.get_start_barcode_scores(), reverse=True,
                                       key=lambda x: x[1])
-        end_barcode_scores = sorted(self.end_barcode_scores.items(), reverse=True,
+        end_barcode_scores = sorted(self.get_end_barcode_scores(), reverse=True,
                                     key=lambda x: x[1])
 
         if len(start_barcode_scores) >= 1:
@@ -473,22 +572,227 @@ class NanoporeRead(object):
             self.barcode_call = 'none'
 
 
-def align_adapter(read_seq, adapter_seq, scoring_scheme_vals):
-    alignment_result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
-    result_parts = alignment_result.split(',')
-    read_start = int(result_parts[0])
+def get_middle_adapter_seeds(adapter_seq, middle_threshold, scoring_scheme_vals):
+    """
+    Returns the seed k-mers for finding an adapter in the middle of reads, as (adapter position,
+    k-mer) tuples. An alignment which reaches the threshold can only have so many errors
+    (mismatches, gaps and overhanging adapter bases), so the adapter is cut into one more piece than
+    that. Any good enough alignment must then contain at least one of the pieces exactly. If the
+    pieces would be too short to be useful seeds, this returns None and the whole read is aligned.
+
+    The windows around the seeds (see get_middle_adapter_windows) also rely on the scoring scheme
+    rewarding matches and penalising everything else, so the best alignments stay close to the
+    adapter's length. Otherwise (e.g. with free gaps) this also returns None.
+    """
+    if middle_threshold <= 0.0:
+        return None
+    match_score, mismatch_score, gap_open_score, gap_extend_score = scoring_scheme_vals
+    if match_score <= 0 or mismatch_score >= 0 or gap_open_score >= 0 or gap_extend_score >= 0:
+        return None
+    adapter_length = len(adapter_seq)
+    max_errors = get_middle_adapter_max_errors(adapter_length, middle_threshold)
+    piece_count = max_errors + 1
+    seed_size = adapter_length // piece_count
+    if seed_size < MIN_MIDDLE_SEED_SIZE:
+        return None
+    adapter_seq = adapter_seq.upper()
+    return [(i * seed_size, adapter_seq[i * seed_size:(i + 1) * seed_size])
+            for i in range(piece_count)]
+
+
+def get_middle_adapter_max_errors(adapter_length, middle_threshold):
+    """
+    An alignment's full adapter identity is matches / (adapter length + read gaps), so the more read
+    gaps it has, the more matches it needs. This gives the most errors (non-matching adapter bases
+    plus read gaps) which an alignment can have and still reach the threshold. It also bounds the
+    number of read gaps. It's rounded up slightly, so the seeds err on the side of caution.
+    """
+    return int(adapter_length * (100.0 - middle_threshold) / middle_threshold + 0.001)
+
+
+def get_middle_adapter_windows(read_seq, adapter_seq, seeds):
+    """
+    Returns the (start, end) ranges of the read which could hold a good enough alignment to the
+    adapter: those around seed hits, merged where they overlap. Each window covers the adapter's
+    span around its seed plus an adapter length on either side. That is more than enough for any
+    read gaps (there must be few for a seed to be used), and the rest is a margin so alignments
+    near the window edges don't get free end gaps that they wouldn't get in the whole read.
+    """
+    read_length = len(read_seq)
+    if seeds is None:
+        return [(0, read_length)] if read_length else []
+    adapter_length = len(adapter_seq)
+    read_seq = read_seq.upper()
+    adapter_starts = []
+    for seed_pos, seed in seeds:
+        hit_pos = read_seq.find(seed)
+        while hit_pos != -1:
+            adapter_starts.append(hit_pos - seed_pos)
+            hit_pos = read_seq.find(seed, hit_pos + 1)
+    windows = []
+    for adapter_start in sorted(adapter_starts):
+        window_start = max(adapter_start - adapter_length, 0)
+        window_end = min(adapter_start + 2 * adapter_length, read_length)
+        if windows and window_start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], window_end))
+        else:
+            windows.append((window_start, window_end))
+    return windows
+
+
+def find_read_end_trims(reads, start_adapters, start_profiles, end_adapters, end_profiles,
+                        end_size, extra_trim_size, end_threshold, min_trim_size, check_barcodes,
+                        forward_or_reverse):
+    """
+    Aligns adapter sequences to the starts and ends of the reads and sets the reads' trim amounts,
+    adapter alignments and barcode scores based on the results. The alignments and trim decisions
+    for all of the reads are made in one C++ call. The adapters must be in the same order as their
+    profiles (from make_end_adapter_profiles).
+    """
+    trims, start_calls, start_results, end_calls, end_results = \
+        trim_read_ends(start_profiles, end_profiles, [x.seq for x in reads], end_size,
+                       extra_trim_size, end_threshold, min_trim_size)
+    start_alignments = get_read_end_alignments(len(reads), start_adapters, start_calls,
+                                               start_results)
+    end_alignments = get_read_end_alignments(len(reads), end_adapters, end_calls, end_results)
+    for read, read_trims, read_start_alignments, read_end_alignments in \
+            zip(reads, trims, start_alignments, end_alignments):
+        read.set_start_trim(read_trims.start_trim_amount, read_start_alignments, check_barcodes,
+                            forward_or_reverse)
+        read.set_end_trim(read_trims.end_trim_amount, read_end_alignments, check_barcodes,
+                          forward_or_reverse)
+
+
+def get_read_end_alignments(read_count, adapters, calls, results):
+    """
+    Returns a list of (adapter, alignment values, whether it trimmed the read) for each read, for
+    the adapters which were aligned to that read end (the others were ruled out by the prefilter).
+    """
+    adapter_count = len(adapters)
+    read_alignments = []
+    for i in range(read_count):
+        offset = i * adapter_count
+        read_calls = calls[offset:offset + adapter_count]
+        read_alignments.append([(adapter, get_alignment_values(results[offset + j]),
+                                 read_calls[j] == TRIMMED)
+                                for j, adapter in enumerate(adapters) if read_calls[j]])
+    return read_alignments
+
+
+def get_adapter_identities(read_sequence, adapter_sequences, scoring_scheme_vals):
+    """
+    Returns a dictionary of full adapter identity in the read sequence for each distinct adapter
+    sequence.
+    """
+    distinct_sequences = list(dict.fromkeys(adapter_sequences))
+    return dict(zip(distinct_sequences,
+                    adapter_identity_batch(read_sequence, distinct_sequences,
+                                           scoring_scheme_vals)))
+
+
+def make_end_adapter_profiles(adapters, adapter_seqs, scoring_scheme_vals, end_threshold,
+                              min_trim_size, check_barcodes, forward_or_reverse,
+                              anchor_barcodes=False, read_start=True, barcode_threshold=0.0,
+                              barcode_diff=0.0, barcode_early_exit=False):
+    """
+    Prepares the adapter sequences for aligning to read ends. An adapter is only aligned to a read
+    end if the Myers prefilter shows it could align well enough to trim the read, or if it's a
+    barcode that needs a score. The trim needs read_end - read_start to be at least
+    min_trim_size, which means at least min_trim_size - 1 read bases in the aligned region. With
+    anchor_barcodes, any full barcode adapters are found with a barcode anchor (see
+    get_barcode_anchor), using barcode_threshold and barcode_diff to tell whether the anchor found
+    a barcode. With barcode_early_exit, the barcodes are only scored where they could change the
+    read's barcode call.
+    """
+    always_align = [check_barcodes and x.is_barcode() and
+                    x.barcode_direction() == forward_or_reverse for x in adapters]
+    barcode_anchor = None
+    if anchor_barcodes:
+        barcode_anchor = get_barcode_anchor(adapters, adapter_seqs, read_start, barcode_threshold,
+                                            barcode_diff)
+    return AdapterProfileSet(adapter_seqs, always_align, scoring_scheme_vals, end_threshold,
+                             min_trim_size - 1, barcode_anchor,
+                             barcode_diff if barcode_early_exit else None)
+
+
+def get_barcode_anchor(adapters, adapter_seqs, read_start, barcode_threshold, barcode_diff):
+    """
+    Returns the barcode anchor for the full barcode adapters at one end of the reads (see
+    AdapterProfileSet), or None if there isn't one. They need to share the same flank on the
+    outside of their barcodes (before it at read starts, after it at read ends), and their barcodes
+    need to be among the adapters. Reads whose best barcode next to the flank isn't good enough to
+    call (given barcode_threshold and barcode_diff) have their barcodes aligned to the whole read
+    end instead.
+    """
+    full_adapter_barcodes, flanks, barcode_lengths = [], set(), set()
+    for adapter, seq in zip(adapters, adapter_seqs):
+        barcode_flanks = adapter.start_barcode_flanks if read_start else \
+            adapter.end_barcode_flanks
+        if barcode_flanks is None:
+            full_adapter_barcodes.append(-1)
+            continue
+        before_barcode, after_barcode = barcode_flanks
+        barcode_seq = seq[len(before_barcode):len(seq) - len(after_barcode)]
+        if barcode_seq not in adapter_seqs:
+            return None
+        full_adapter_barcodes.append(adapter_seqs.index(barcode_seq))
+        flanks.add(before_barcode if read_start else after_barcode)
+        barcode_lengths.add(len(barcode_seq))
+    if len(flanks) != 1:
+        return None
+    return (flanks.pop(), read_start, max(barcode_lengths), full_adapter_barcodes,
+            barcode_threshold, barcode_diff)
+
+
+def get_alignment_values(result):
+    """
+    Returns the full adapter identity, aligned region identity, read start and read end (exclusive)
+    from an AlignmentResult, the same values as from parsing an adapter_alignment string.
+    """
+    read_start = result.read_start
 
     # If the read start is -1, that indicates that the alignment failed completely.
     if read_start == -1:
-        read_end = 0
-        aligned_region_percent_identity = 0.0
-        full_adapter_percent_identity = 0.0
-    else:
-        read_end = int(result_parts[1]) + 1
-        aligned_region_percent_identity = float(result_parts[5])
-        full_adapter_percent_identity = float(result_parts[6])
+        return 0.0, 0.0, read_start, 0
+
+    # The identities are rounded to the same precision as the string results from
+    # adapter_alignment, so both functions give exactly the same values.
+    return (round(result.full_adapter_percent_identity, 6),
+            round(result.aligned_region_percent_identity, 6),
+            read_start, result.read_end + 1)
+
+
+def read_from_worker_input(worker_input):
+    """
+    Makes a read from the output of NanoporeRead.get_worker_input.
+    """
+    name, seq, quals, rna, start_trim_amount, end_trim_amount, albacore_barcode_call = worker_input
+    read = NanoporeRead(name, seq, quals)
+    read.rna = rna
+    read.start_trim_amount = start_trim_amount
+    read.end_trim_amount = end_trim_amount
+    read.albacore_barcode_call = albacore_barcode_call
+    return read
+
+
+def merge_intervals(intervals):
+    """
+    Returns the (start, end) intervals sorted, without any empty intervals and with any that
+    overlap or touch combined.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
 
-    return full_adapter_percent_identity, aligned_region_percent_identity, read_start, read_end
+def in_intervals(pos, intervals):
+    return any(start <= pos < end for start, end in intervals)
 
 
 def add_number_to_read_name(read_name, number):
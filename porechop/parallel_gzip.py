@@ -0,0 +1,113 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains a gzip file writer which compresses its data in blocks using a pool of
+threads, like pigz does. zlib releases the GIL while it compresses, so the threads run in parallel.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+import zlib
+from collections import deque
+from multiprocessing.dummy import Pool as ThreadPool
+
+BLOCK_SIZE = 1024 * 1024
+DICTIONARY_SIZE = 32 * 1024
+COMPRESSION_LEVEL = 6
+
+# A gzip header with no file name or timestamp: magic bytes, deflate method, no flags, zero mtime,
+# no extra flags and an unknown OS.
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+class GzipCompressionPool(object):
+    """
+    A pool of threads which compresses blocks for any number of ParallelGzipWriters (e.g. one per
+    barcode bin). Compressed blocks are written to their files in the order they were submitted,
+    which keeps each file's blocks in order. The number of blocks waiting is limited across all
+    files, so memory use doesn't grow with the number of files.
+    """
+
+    def __init__(self, threads):
+        self.pool = ThreadPool(threads)
+        self.max_pending = max(2, threads * 2)
+        self.pending = deque()
+
+    def submit(self, out_file, block, dictionary):
+        self.pending.append((out_file, self.pool.apply_async(compress_block, (block, dictionary))))
+        while len(self.pending) > self.max_pending:
+            self.write_oldest()
+
+    def write_oldest(self):
+        out_file, compressed_block = self.pending.popleft()
+        out_file.write(compressed_block.get())
+
+    def write_all(self):
+        while self.pending:
+            self.write_oldest()
+
+    def close(self):
+        self.write_all()
+        self.pool.terminate()
+
+
+class ParallelGzipWriter(object):
+    """
+    Writes text to a gzip file. The text is gathered into blocks which are compressed by a
+    GzipCompressionPool while more text is written. Each block is deflated separately (primed with
+    the end of the previous block, so little compression is lost) and they are written in order as
+    one gzip member, so the file is the same as any other gzip file to the tools that read it.
+    """
+
+    def __init__(self, filename, compression_pool):
+        self.out_file = open(filename, 'wb')
+        self.out_file.write(GZIP_HEADER)
+        self.compression_pool = compression_pool
+        self.buffer = []
+        self.buffer_size = 0
+        self.dictionary = b''
+        self.crc = 0
+        self.total_size = 0
+
+    def write(self, text):
+        data = text.encode()
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= BLOCK_SIZE:
+            self.submit_block()
+
+    def submit_block(self):
+        block = b''.join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        self.crc = zlib.crc32(block, self.crc)
+        self.total_size += len(block)
+        self.compression_pool.submit(self.out_file, block, self.dictionary)
+        self.dictionary = block[-DICTIONARY_SIZE:]
+
+    def close(self):
+        if self.buffer:
+            self.submit_block()
+        self.compression_pool.write_all()
+        self.out_file.write(zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15).flush())
+        self.out_file.write(struct.pack('<II', self.crc, self.total_size & 0xFFFFFFFF))
+        self.out_file.close()
+
+
+def compress_block(block, dictionary):
+    """
+    Deflates one block, ending with a sync flush so the next block's output can follow it directly.
+    """
+    if dictionary:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
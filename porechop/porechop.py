@@ -15,68 +15,69 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 import argparse
+import json
 import os
 import sys
-import subprocess
 import multiprocessing
-import shutil
 import re
+import itertools
 from multiprocessing.dummy import Pool as ThreadPool
 from collections import defaultdict
-from .misc import load_fasta_or_fastq, print_table, red, bold_underline, MyHelpFormatter, int_to_str
+from .misc import load_fasta_or_fastq, iterate_fasta_or_fastq, print_table, red, bold_underline, \
+    MyHelpFormatter, int_to_str
 from .adapters import ADAPTERS, make_full_native_barcode_adapter,\
     make_old_full_rapid_barcode_adapter, make_new_full_rapid_barcode_adapter
-from .nanopore_read import NanoporeRead
+from .nanopore_read import NanoporeRead, get_middle_adapter_seeds, read_from_worker_input, \
+    find_read_end_trims, make_end_adapter_profiles
+from .cpp_function_wrappers import kmer_screen_passes
+from .parallel_gzip import GzipCompressionPool, ParallelGzipWriter
 from .version import __version__
 
 
 def main():
     args = get_arguments()
-    reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
-                                               args.check_reads)
-
-    matching_sets = find_matching_adapter_sets(check_reads, args.verbosity, args.end_size,
-                                               args.scoring_scheme_vals, args.print_dest,
-                                               args.adapter_threshold, args.threads)
-    matching_sets = fix_up_1d2_sets(matching_sets)
+    if args.stream:
+        # With a loaded adapter profile, this only gets the read type (there are no check reads).
+        check_reads, read_type = load_check_reads(args.input,
+                                                  0 if args.load_adapter_profile
+                                                  else args.verbosity,
+                                                  args.print_dest, args.check_reads)
+    else:
+        reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
+                                                   args.check_reads)
 
-    if args.barcode_dir:
-        forward_or_reverse_barcodes = choose_barcoding_kit(matching_sets, args.verbosity,
-                                                           args.print_dest)
+    if args.load_adapter_profile:
+        matching_sets, forward_or_reverse_barcodes = \
+            load_adapter_profile(args.load_adapter_profile, args.barcode_dir, args.verbosity,
+                                 args.print_dest)
     else:
-        forward_or_reverse_barcodes = None
+        matching_sets = find_matching_adapter_sets(check_reads, args.verbosity, args.end_size,
+                                                   args.scoring_scheme_vals, args.print_dest,
+                                                   args.adapter_threshold, args.threads,
+                                                   args.chunk_size, args.adaptive_check)
+        matching_sets = fix_up_1d2_sets(matching_sets)
+
+        if args.barcode_dir:
+            forward_or_reverse_barcodes = choose_barcoding_kit(matching_sets, args.verbosity,
+                                                               args.print_dest)
+        else:
+            forward_or_reverse_barcodes = None
+
+        display_adapter_set_results(matching_sets, args.verbosity, args.print_dest)
+        if args.save_adapter_profile:
+            save_adapter_profile(args.save_adapter_profile, matching_sets,
+                                 forward_or_reverse_barcodes)
 
-    display_adapter_set_results(matching_sets, args.verbosity, args.print_dest)
     matching_sets = add_full_barcode_adapter_sets(matching_sets)
 
     if args.verbosity > 0:
         print('\n', file=args.print_dest)
 
-    if matching_sets:
-        check_barcodes = (args.barcode_dir is not None)
-        find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
-                                   args.extra_end_trim, args.end_threshold,
-                                   args.scoring_scheme_vals, args.print_dest, args.min_trim_size,
-                                   args.threads, check_barcodes, args.barcode_threshold,
-                                   args.barcode_diff, args.require_two_barcodes,
-                                   forward_or_reverse_barcodes)
-        display_read_end_trimming_summary(reads, args.verbosity, args.print_dest)
-
-        if not args.no_split:
-            find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
-                                          args.middle_threshold, args.extra_middle_trim_good_side,
-                                          args.extra_middle_trim_bad_side, args.scoring_scheme_vals,
-                                          args.print_dest, args.threads, args.discard_middle)
-            display_read_middle_trimming_summary(reads, args.discard_middle, args.verbosity,
-                                                 args.print_dest)
-    elif args.verbosity > 0:
-        print('No adapters found - output reads are unchanged from input reads\n',
-              file=args.print_dest)
-
-    output_reads(reads, args.format, args.output, read_type, args.verbosity,
-                 args.discard_middle, args.min_split_read_size, args.print_dest,
-                 args.barcode_dir, args.input, args.untrimmed, args.threads,
-                 args.discard_unassigned)
+    # In streaming mode, the reads are only loaded from the input as they are needed.
+    del check_reads
+    if args.stream:
+        reads = iterate_reads(args.input)
+    trim_and_output_reads(args, reads, matching_sets, forward_or_reverse_barcodes, read_type)
 
 
 def get_arguments():
@@ -107,6 +108,19 @@ def get_arguments():
                                  'a file and stderr if reads are printed to stdout')
     main_group.add_argument('-t', '--threads', type=int, default=default_threads,
                             help='Number of threads to use for adapter alignment')
+    main_group.add_argument('--engine', choices=['thread', 'process'], default='thread',
+                            help='How to run the end trimming and middle splitting in parallel: '
+                                 'thread = a pool of threads, process = a pool of worker '
+                                 'processes (uses more memory but scales better with many '
+                                 'threads)')
+    main_group.add_argument('--chunk_size', type=int,
+                            help='Number of reads given to a thread or process at a time '
+                                 '(default: chosen based on the number of reads and threads)')
+    main_group.add_argument('--stream', action='store_true',
+                            help='Process reads in chunks as they are loaded, instead of loading '
+                                 'all reads into memory first (for very large inputs)')
+    main_group.add_argument('--stream_buffer', type=int, default=10000,
+                            help='In streaming mode, this many reads are held in memory at once')
 
     barcode_group = parser.add_argument_group('Barcode binning settings',
                                               'Control the binning of reads based on barcodes '
@@ -127,6 +141,12 @@ def get_arguments():
                                help='Reads will only be put in barcode bins if they have a strong '
                                     'match for the barcode on both their start and end (default: '
                                     'a read can be binned with a match at its start or end)')
+    barcode_group.add_argument('--anchor_barcodes', action='store_true',
+                               help='Find barcodes in full barcode adapters by first aligning the '
+                                    'constant sequence next to them, then aligning the barcodes '
+                                    'only to that part of the read (faster with many barcodes, '
+                                    'but scores can differ slightly from the default of aligning '
+                                    'barcodes to the whole read end)')
     barcode_group.add_argument('--untrimmed', action='store_true',
                                help='Bin reads but do not trim them (default: trim the reads)')
     barcode_group.add_argument('--discard_unassigned', action='store_true',
@@ -142,6 +162,19 @@ def get_arguments():
     adapter_search_group.add_argument('--check_reads', type=int, default=10000,
                                       help='This many reads will be aligned to all possible '
                                            'adapters to determine which adapter sets are present')
+    adapter_search_group.add_argument('--adaptive_check', action='store_true',
+                                      help='Align the check reads in rounds and stop once each '
+                                           'adapter set has either reached '
+                                           '--adapter_threshold or is unlikely to (default: '
+                                           'align all check reads)')
+    adapter_search_group.add_argument('--save_adapter_profile',
+                                      help='Save the adapter sets found (with their best '
+                                           'identities and the barcode orientation) to this '
+                                           'file, for use with --load_adapter_profile')
+    adapter_search_group.add_argument('--load_adapter_profile',
+                                      help='Use the adapter sets in this file (made with '
+                                           '--save_adapter_profile) instead of searching the '
+                                           'check reads for adapter sets')
     adapter_search_group.add_argument('--scoring_scheme', type=str, default='3,-6,-5,-2',
                                       help='Comma-delimited string of alignment scores: match, '
                                            'mismatch, gap open, gap extend')
@@ -204,6 +237,14 @@ def get_arguments():
     if args.barcode_dir is not None and args.output is not None:
         sys.exit('Error: only one of the following options may be used: --output, --barcode_dir')
 
+    if args.save_adapter_profile is not None and args.load_adapter_profile is not None:
+        sys.exit('Error: only one of the following options may be used: --save_adapter_profile, '
+                 '--load_adapter_profile')
+
+    # A loaded adapter profile replaces the adapter search, so no check reads are needed.
+    if args.load_adapter_profile is not None:
+        args.check_reads = 0
+
     if args.untrimmed and args.barcode_dir is None:
         sys.exit('Error: --untrimmed can only be used with --barcode_dir')
 
@@ -218,6 +259,12 @@ def get_arguments():
     if args.threads < 1:
         sys.exit('Error: at least one thread required')
 
+    if args.stream_buffer < 1:
+        sys.exit('Error: --stream_buffer must be at least 1')
+
+    if args.chunk_size is not None and args.chunk_size < 1:
+        sys.exit('Error: --chunk_size must be at least 1')
+
     return args
 
 
@@ -241,12 +288,7 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     elif os.path.isdir(input_file_or_directory):
         if verbosity > 0:
             print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
-        fastqs = sorted([os.path.join(dir_path, f)
-                         for dir_path, _, filenames in os.walk(input_file_or_directory)
-                         for f in filenames
-                         if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
-        if not fastqs:
-            sys.exit('Error: could not find fastq files in ' + input_file_or_directory)
+        fastqs = find_fastq_files(input_file_or_directory)
         reads = []
         read_type = 'FASTQ'
         check_reads = []
@@ -273,6 +315,90 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     return reads, check_reads, read_type
 
 
+def load_check_reads(input_file_or_directory, verbosity, print_dest, check_read_count):
+    """
+    Used in streaming mode: only the check reads are loaded now (chosen the same way as in
+    load_reads), and the full set of reads is read from the input later by iterate_reads.
+    """
+    if os.path.isfile(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Loading check reads'), flush=True, file=print_dest)
+            print(input_file_or_directory, flush=True, file=print_dest)
+        check_reads, read_type = iterate_fasta_or_fastq(input_file_or_directory)
+        check_reads = list(itertools.islice(check_reads, check_read_count))
+        if read_type == 'FASTA':
+            check_reads = [NanoporeRead(x[2], x[1], '') for x in check_reads]
+        else:  # FASTQ
+            check_reads = [NanoporeRead(x[4], x[1], x[3]) for x in check_reads]
+
+    elif os.path.isdir(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
+        fastqs = find_fastq_files(input_file_or_directory)
+        read_type = 'FASTQ'
+        check_reads = []
+        check_reads_per_file = int(round(check_read_count / len(fastqs)))
+        for fastq_file in fastqs:
+            if verbosity > 0:
+                print(fastq_file, flush=True, file=print_dest)
+            file_reads, _ = iterate_fasta_or_fastq(fastq_file)
+            check_reads += [NanoporeRead(x[4], x[1], x[3])
+                            for x in itertools.islice(file_reads, check_reads_per_file)]
+        if verbosity > 0:
+            print('', flush=True, file=print_dest)
+
+    else:
+        sys.exit('Error: could not find ' + input_file_or_directory)
+
+    if verbosity > 0:
+        print(int_to_str(len(check_reads)) + ' check reads loaded\n\n', flush=True,
+              file=print_dest)
+    return check_reads, read_type
+
+
+def iterate_reads(input_file_or_directory):
+    """
+    Yields NanoporeRead objects one at a time from the input file or Albacore directory.
+    """
+    if os.path.isfile(input_file_or_directory):
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory)
+        for record in records:
+            if read_type == 'FASTA':
+                yield NanoporeRead(record[2], record[1], '')
+            else:  # FASTQ
+                yield NanoporeRead(record[4], record[1], record[3])
+    else:
+        for fastq_file in find_fastq_files(input_file_or_directory):
+            albacore_barcode = get_albacore_barcode_from_path(fastq_file)
+            records, _ = iterate_fasta_or_fastq(fastq_file)
+            for record in records:
+                read = NanoporeRead(record[4], record[1], record[3])
+                read.albacore_barcode_call = albacore_barcode
+                yield read
+
+
+def iterate_read_chunks(reads, chunk_size):
+    """
+    Groups an iterable of reads into lists of (at most) chunk_size reads.
+    """
+    reads = iter(reads)
+    while True:
+        chunk = list(itertools.islice(reads, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def find_fastq_files(directory):
+    fastqs = sorted([os.path.join(dir_path, f)
+                     for dir_path, _, filenames in os.walk(directory)
+                     for f in filenames
+                     if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
+    if not fastqs:
+        sys.exit('Error: could not find fastq files in ' + directory)
+    return fastqs
+
+
 def get_albacore_barcode_from_path(albacore_path):
     if '/unclassified/' in albacore_path:
         return 'none'
@@ -284,47 +410,191 @@ def get_albacore_barcode_from_path(albacore_path):
 
 
 def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_vals, print_dest,
-                               adapter_threshold, threads):
+                               adapter_threshold, threads, chunk_size, adaptive_check):
     """
     Aligns all of the adapter sets to the start/end of reads to see which (if any) matches best.
+    Each read end is only aligned to the adapter sets which pass the k-mer screen for it (see
+    screen_adapter_sets). With adaptive_check, the reads are aligned in rounds and this stops early
+    once the results are settled (see adapter_set_search_is_settled).
     """
     read_count = len(check_reads)
     if verbosity > 0:
         print(bold_underline('Looking for known adapter sets'), flush=True, file=print_dest)
         output_progress_line(0, read_count, print_dest)
 
+    # With adaptive_check, the screen lets through anything within the margin of the threshold, so
+    # the near-threshold counts are the same as they would be without the screen.
     search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
-    search_adapter_count = len(search_adapters)
-
-    # If single-threaded, do the work in a simple loop.
-    if threads == 1:
-        for read_num, read in enumerate(check_reads):
-            for adapter_set in search_adapters:
-                read.align_adapter_set(adapter_set, end_size, scoring_scheme_vals)
-            if verbosity > 0:
-                output_progress_line(read_num+1, read_count, print_dest)
-
-    # If multi-threaded, use a thread pool.
+    screen_threshold = adapter_threshold
+    if adaptive_check:
+        screen_threshold -= ADAPTIVE_CHECK_MARGIN
+    read_screens = screen_adapter_sets(search_adapters, check_reads, end_size, screen_threshold)
+    reads_and_screens = list(zip(check_reads, read_screens))
+
+    def get_adapter_set_scores_for_chunk(chunk):
+        return [r.get_adapter_set_scores(search_adapters, end_size, scoring_scheme_vals,
+                                         start_sets, end_sets)
+                for r, (start_sets, end_sets) in chunk]
+
+    if adaptive_check:
+        read_rounds = iterate_read_chunks(reads_and_screens, ADAPTIVE_CHECK_ROUND_SIZE)
     else:
-        def align_adapter_set_one_arg(all_args):
-            r, a, b, c = all_args
-            r.align_adapter_set(a, b, c)
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in check_reads:
-                for adapter_set in search_adapters:
-                    arg_list.append((read, adapter_set, end_size, scoring_scheme_vals))
-            finished_count = 0
-            for _ in pool.imap(align_adapter_set_one_arg, arg_list):
-                finished_count += 1
-                if verbosity > 0 and finished_count % search_adapter_count == 0:
-                    output_progress_line(finished_count // search_adapter_count,
-                                         read_count, print_dest)
+        read_rounds = [reads_and_screens]
+    near_threshold_counts = [0] * len(search_adapters)
+    finished_count = 0
+    pool = ThreadPool(threads) if threads > 1 else None
+    try:
+        for round_reads in read_rounds:
+
+            # If single-threaded, do the work in a simple loop.
+            if pool is None:
+                for read_and_screen in round_reads:
+                    scores = get_adapter_set_scores_for_chunk([read_and_screen])[0]
+                    update_best_adapter_set_scores(search_adapters, scores)
+                    count_near_threshold_scores(near_threshold_counts, scores, adapter_threshold)
+                    finished_count += 1
+                    if verbosity > 0:
+                        output_progress_line(finished_count, read_count, print_dest)
+
+            # If multi-threaded, use a thread pool. Each chunk of reads is one task and the best
+            # scores are only updated here in the main thread.
+            else:
+                read_chunks = iterate_read_chunks(round_reads,
+                                                  get_chunk_size(chunk_size, len(round_reads),
+                                                                 threads))
+                for chunk_scores in pool.imap(get_adapter_set_scores_for_chunk, read_chunks):
+                    for scores in chunk_scores:
+                        update_best_adapter_set_scores(search_adapters, scores)
+                        count_near_threshold_scores(near_threshold_counts, scores,
+                                                    adapter_threshold)
+                    finished_count += len(chunk_scores)
+                    if verbosity > 0:
+                        output_progress_line(finished_count, read_count, print_dest, step=1)
+
+            if adaptive_check and adapter_set_search_is_settled(search_adapters,
+                                                                near_threshold_counts,
+                                                                finished_count,
+                                                                adapter_threshold):
+                break
+
+        # The screen can't change which sets reach the threshold, but the matching sets' best
+        # scores are used again later (and displayed), so they are completed by aligning them to
+        # the read ends the screen left out.
+        matching_sets = [x for x in search_adapters
+                         if x.best_start_or_end_score() >= adapter_threshold]
+        if matching_sets:
+            unscreened = [(r, ([x for x in matching_sets
+                                if x.start_sequence and x not in start_sets],
+                               [x for x in matching_sets
+                                if x.end_sequence and x not in end_sets]))
+                          for r, (start_sets, end_sets) in reads_and_screens[:finished_count]]
+            read_chunks = list(iterate_read_chunks(unscreened,
+                                                   get_chunk_size(chunk_size, len(unscreened),
+                                                                  threads)))
+            if pool is None:
+                all_chunk_scores = map(get_adapter_set_scores_for_chunk, read_chunks)
+            else:
+                all_chunk_scores = pool.imap(get_adapter_set_scores_for_chunk, read_chunks)
+            for chunk_scores in all_chunk_scores:
+                for scores in chunk_scores:
+                    update_best_adapter_set_scores(search_adapters, scores)
+    finally:
+        if pool is not None:
+            pool.terminate()
 
     if verbosity > 0:
-        output_progress_line(read_count, read_count, print_dest, end_newline=True)
+        output_progress_line(finished_count, read_count, print_dest, end_newline=True)
+        if adaptive_check:
+            print('Adapter sets settled after ' + int_to_str(finished_count) + ' / ' +
+                  int_to_str(read_count) + ' check reads', flush=True, file=print_dest)
+
+    return matching_sets
 
-    return [x for x in search_adapters if x.best_start_or_end_score() >= adapter_threshold]
+
+def screen_adapter_sets(adapter_sets, check_reads, end_size, threshold):
+    """
+    Finds which adapter sets could reach the threshold in each check read: those whose start
+    sequence shares enough k-mers with the read's start or whose end sequence does with the read's
+    end. Returns (start sets, end sets) for each read and sets each adapter set's k-mer screen
+    count (the number of read ends it passed for) and whether it was screened out of any read
+    starts or ends.
+    """
+    start_sets = [x for x in adapter_sets if x.start_sequence]
+    start_passes = kmer_screen_passes([x.seq[:end_size] for x in check_reads],
+                                      [x.start_sequence[1] for x in start_sets], threshold)
+    end_sets = [x for x in adapter_sets if x.end_sequence]
+    end_passes = kmer_screen_passes([x.seq[-end_size:] for x in check_reads],
+                                    [x.end_sequence[1] for x in end_sets], threshold)
+    read_screens = []
+    for i in range(len(check_reads)):
+        read_start_passes = start_passes[i * len(start_sets):(i + 1) * len(start_sets)]
+        read_end_passes = end_passes[i * len(end_sets):(i + 1) * len(end_sets)]
+        read_screens.append(([x for x, p in zip(start_sets, read_start_passes) if p],
+                             [x for x, p in zip(end_sets, read_end_passes) if p]))
+    start_counts, end_counts = defaultdict(int), defaultdict(int)
+    for read_start_sets, read_end_sets in read_screens:
+        for adapter_set in read_start_sets:
+            start_counts[adapter_set.name] += 1
+        for adapter_set in read_end_sets:
+            end_counts[adapter_set.name] += 1
+    for adapter_set in adapter_sets:
+        start_count, end_count = start_counts[adapter_set.name], end_counts[adapter_set.name]
+        adapter_set.kmer_screen_count = start_count + end_count
+        adapter_set.kmer_screen_partial_start = bool(adapter_set.start_sequence) and \
+            start_count < len(check_reads)
+        adapter_set.kmer_screen_partial_end = bool(adapter_set.end_sequence) and \
+            end_count < len(check_reads)
+    return read_screens
+
+
+# The settings for --adaptive_check. The check reads are aligned in rounds of this many reads. An
+# adapter set which hasn't reached the threshold is ruled out once enough reads have been checked
+# that, if it matched well in even the minimum fraction of reads, missing all of them would have
+# had less than the given probability. But if at least that fraction of reads have come within the
+# margin of the threshold, the set may well be there, so it isn't ruled out.
+ADAPTIVE_CHECK_ROUND_SIZE = 1000
+ADAPTIVE_CHECK_MIN_READ_FRACTION = 0.001
+ADAPTIVE_CHECK_MISS_PROBABILITY = 0.05
+ADAPTIVE_CHECK_MARGIN = 5.0
+
+
+def adapter_set_search_is_settled(adapter_sets, near_threshold_counts, checked_count,
+                                  adapter_threshold):
+    """
+    Returns whether each adapter set has either reached the threshold or is unlikely to if more
+    reads were checked.
+    """
+    chance_of_missing = (1.0 - ADAPTIVE_CHECK_MIN_READ_FRACTION) ** checked_count
+    if chance_of_missing >= ADAPTIVE_CHECK_MISS_PROBABILITY:
+        return False
+    for adapter_set, near_threshold_count in zip(adapter_sets, near_threshold_counts):
+        if adapter_set.best_start_or_end_score() >= adapter_threshold:
+            continue
+        if near_threshold_count >= ADAPTIVE_CHECK_MIN_READ_FRACTION * checked_count:
+            return False
+    return True
+
+
+def count_near_threshold_scores(near_threshold_counts, scores, adapter_threshold):
+    """
+    Takes the start and end scores for one read (from get_adapter_set_scores) and counts it for
+    each adapter set it came close to (see ADAPTIVE_CHECK_MARGIN).
+    """
+    start_scores, end_scores = scores
+    for i, (start_score, end_score) in enumerate(zip(start_scores, end_scores)):
+        if max(start_score, end_score) >= adapter_threshold - ADAPTIVE_CHECK_MARGIN:
+            near_threshold_counts[i] += 1
+
+
+def update_best_adapter_set_scores(adapter_sets, scores):
+    """
+    Takes the start and end scores for one read (from get_adapter_set_scores) and keeps the best
+    of them in each adapter set.
+    """
+    start_scores, end_scores = scores
+    for adapter_set, start_score, end_score in zip(adapter_sets, start_scores, end_scores):
+        adapter_set.best_start_score = max(adapter_set.best_start_score, start_score)
+        adapter_set.best_end_score = max(adapter_set.best_end_score, end_score)
 
 
 def choose_barcoding_kit(adapter_sets, verbosity, print_dest):
@@ -393,19 +663,121 @@ def fix_up_1d2_sets(matching_sets):
 def display_adapter_set_results(matching_sets, verbosity, print_dest):
     if verbosity < 1:
         return
-    table = [['Set', 'Best read start %ID', 'Best read end %ID']]
+    table = [['Set', 'K-mer screen read ends', 'Best read start %ID', 'Best read end %ID']]
     row_colours = {}
     matching_set_names = [x.name for x in matching_sets]
     search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
+    any_partial = False
     for adapter_set in search_adapters:
-        start_score = '%.1f' % adapter_set.best_start_score
-        end_score = '%.1f' % adapter_set.best_end_score
-        table.append([adapter_set.name, start_score, end_score])
+
+        # Sets which didn't pass the k-mer screen for any read end weren't aligned at all. The
+        # matching sets were aligned to every read end, but the best scores of the others only
+        # come from the read ends which passed the screen, so they are marked.
+        if adapter_set.kmer_screen_count:
+            start_score = '%.1f' % adapter_set.best_start_score
+            end_score = '%.1f' % adapter_set.best_end_score
+            if adapter_set.name not in matching_set_names:
+                if adapter_set.kmer_screen_partial_start:
+                    start_score += '*'
+                if adapter_set.kmer_screen_partial_end:
+                    end_score += '*'
+                any_partial = any_partial or adapter_set.kmer_screen_partial_start or \
+                    adapter_set.kmer_screen_partial_end
+        else:
+            start_score, end_score = '-', '-'
+        table.append([adapter_set.name, int_to_str(adapter_set.kmer_screen_count or 0),
+                      start_score, end_score])
         if adapter_set.name in matching_set_names:
             row_colours[len(table) - 1] = 'green'
     if verbosity > 0:
-        print_table(table, print_dest, alignments='LRR', row_colour=row_colours,
+        print_table(table, print_dest, alignments='LRRR', row_colour=row_colours,
+                    fixed_col_widths=[35, 8, 8, 8])
+        screened_count = len([x for x in search_adapters if x.kmer_screen_count])
+        print('\n' + int_to_str(screened_count) + ' / ' + int_to_str(len(search_adapters)) +
+              ' adapter sets passed the k-mer screen for at least one check read end',
+              file=print_dest)
+        if any_partial:
+            print('* best identity from only the read ends which passed the k-mer screen (the '
+                  'true best may be higher, but is under the threshold)', file=print_dest)
+
+
+# The format version of adapter profile files, which is increased whenever the format changes.
+ADAPTER_PROFILE_VERSION = 1
+
+
+def save_adapter_profile(filename, matching_sets, forward_or_reverse_barcodes):
+    """
+    Saves the results of the adapter search (the matching sets with their best scores and the
+    barcode orientation, if one was chosen) as JSON, so later runs can load them with
+    load_adapter_profile instead of searching again.
+    """
+    profile = {'adapter_profile_version': ADAPTER_PROFILE_VERSION,
+               'porechop_version': __version__,
+               'adapter_sets': [{'name': x.name,
+                                 'start_sequence': x.start_sequence,
+                                 'end_sequence': x.end_sequence,
+                                 'best_start_score': x.best_start_score,
+                                 'best_end_score': x.best_end_score}
+                                for x in matching_sets],
+               'barcode_orientation': forward_or_reverse_barcodes}
+    with open(filename, 'wt') as profile_file:
+        json.dump(profile, profile_file, indent=2)
+        profile_file.write('\n')
+
+
+def load_adapter_profile(filename, barcode_dir, verbosity, print_dest):
+    """
+    Loads the matching sets and barcode orientation saved by save_adapter_profile. The adapter sets
+    must still be the same as Porechop's known adapter sets. If barcodes are being binned but the
+    profile has no barcode orientation (it was saved without --barcode_dir), the orientation is
+    chosen from the saved scores, the same as it would have been then.
+    """
+    if not os.path.isfile(filename):
+        sys.exit('Error: could not find ' + filename)
+    if verbosity > 0:
+        print(bold_underline('Loading adapter profile'), flush=True, file=print_dest)
+        print(filename, flush=True, file=print_dest)
+    try:
+        with open(filename, 'rt') as profile_file:
+            profile = json.load(profile_file)
+        if profile['adapter_profile_version'] != ADAPTER_PROFILE_VERSION:
+            sys.exit('Error: ' + filename + ' is from an incompatible version of Porechop')
+        saved_sets = profile['adapter_sets']
+        forward_or_reverse_barcodes = profile['barcode_orientation']
+        known_sets = {x.name: x for x in ADAPTERS if '(full sequence)' not in x.name}
+        matching_sets = []
+        for saved_set in saved_sets:
+            adapter_set = known_sets.get(saved_set['name'])
+            if adapter_set is None or \
+                    list(adapter_set.start_sequence) != saved_set['start_sequence'] or \
+                    list(adapter_set.end_sequence) != saved_set['end_sequence']:
+                sys.exit('Error: adapter set ' + saved_set['name'] + ' in ' + filename +
+                         ' does not match any of Porechop\'s known adapter sets')
+            adapter_set.best_start_score = float(saved_set['best_start_score'])
+            adapter_set.best_end_score = float(saved_set['best_end_score'])
+            matching_sets.append(adapter_set)
+    except (ValueError, KeyError, TypeError):
+        sys.exit('Error: ' + filename + ' could not be parsed - is it an adapter profile?')
+
+    if verbosity > 0:
+        table = [['Set', 'Best read start %ID', 'Best read end %ID']]
+        for adapter_set in matching_sets:
+            table.append([adapter_set.name, '%.1f' % adapter_set.best_start_score,
+                          '%.1f' % adapter_set.best_end_score])
+        print('', file=print_dest)
+        print_table(table, print_dest, alignments='LRR',
+                    row_colour={i: 'green' for i in range(1, len(table))},
                     fixed_col_widths=[35, 8, 8])
+        print('\n' + int_to_str(len(matching_sets)) + ' adapter sets loaded', file=print_dest)
+
+    if not barcode_dir:
+        return matching_sets, None
+    if forward_or_reverse_barcodes is None:
+        return matching_sets, choose_barcoding_kit(matching_sets, verbosity, print_dest)
+    if verbosity > 0:
+        print('\nBarcodes determined to be in ' + forward_or_reverse_barcodes + ' orientation',
+              file=print_dest)
+    return matching_sets, forward_or_reverse_barcodes
 
 
 def add_full_barcode_adapter_sets(matching_sets):
@@ -435,109 +807,281 @@ def add_full_barcode_adapter_sets(matching_sets):
     return matching_sets
 
 
-def find_adapters_at_read_ends(reads, matching_sets, verbosity, end_size, extra_trim_size,
-                               end_threshold, scoring_scheme_vals, print_dest, min_trim_size,
-                               threads, check_barcodes, barcode_threshold, barcode_diff,
-                               require_two_barcodes, forward_or_reverse_barcodes):
-    if verbosity > 0:
-        print(bold_underline('Trimming adapters from read ends'),
-              file=print_dest)
-        name_len = max(max(len(x.start_sequence[0])
-                           if x.start_sequence else 0 for x in matching_sets),
-                       max(len(x.end_sequence[0])
-                           if x.end_sequence else 0 for x in matching_sets))
-        for matching_set in matching_sets:
-            if matching_set.start_sequence:
-                print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
-                      red(matching_set.start_sequence[1]), file=print_dest)
-            if matching_set.end_sequence:
-                print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
-                      red(matching_set.end_sequence[1]), file=print_dest)
-        print('', file=print_dest)
+def display_read_end_trimming_header(matching_sets, verbosity, print_dest):
+    if verbosity < 1:
+        return
+    print(bold_underline('Trimming adapters from read ends'), file=print_dest)
+    name_len = max(max(len(x.start_sequence[0]) if x.start_sequence else 0 for x in matching_sets),
+                   max(len(x.end_sequence[0]) if x.end_sequence else 0 for x in matching_sets))
+    for matching_set in matching_sets:
+        if matching_set.start_sequence:
+            print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
+                  red(matching_set.start_sequence[1]), file=print_dest)
+        if matching_set.end_sequence:
+            print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
+                  red(matching_set.end_sequence[1]), file=print_dest)
+    print('', file=print_dest)
 
-    read_count = len(reads)
-    if verbosity == 1:
-        output_progress_line(0, read_count, print_dest)
 
-    # If single-threaded, do the work in a simple loop.
-    if threads == 1:
-        for read_num, read in enumerate(reads):
-            read.find_start_trim(matching_sets, end_size, extra_trim_size, end_threshold,
-                                 scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 forward_or_reverse_barcodes)
-            read.find_end_trim(matching_sets, end_size, extra_trim_size, end_threshold,
-                               scoring_scheme_vals, min_trim_size, check_barcodes,
-                               forward_or_reverse_barcodes)
-            if check_barcodes:
-                read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes)
-            if verbosity == 1:
-                output_progress_line(read_num+1, read_count, print_dest)
-            elif verbosity == 2:
-                print(read.formatted_start_and_end_seq(end_size, extra_trim_size, check_barcodes),
-                      file=print_dest)
-            elif verbosity > 2:
-                print(read.full_start_end_output(end_size, extra_trim_size, check_barcodes),
-                      file=print_dest)
-
-    # If multi-threaded, use a thread pool.
-    else:
-        def start_end_trim_one_arg(all_args):
-            r, a, b, c, d, e, f, g, h, i, j, k, v = all_args
-            r.find_start_trim(a, b, c, d, e, f, g, k)
-            r.find_end_trim(a, b, c, d, e, f, g, k)
-            if check_barcodes:
-                r.determine_barcode(h, i, j)
-            if v == 2:
-                return r.formatted_start_and_end_seq(b, c, g)
-            if v > 2:
-                return r.full_start_end_output(b, c, g)
-            else:
-                return ''
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in reads:
-                arg_list.append((read, matching_sets, end_size, extra_trim_size, end_threshold,
-                                 scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 barcode_threshold, barcode_diff, require_two_barcodes,
-                                 forward_or_reverse_barcodes, verbosity))
-            finished_count = 0
-            for out in pool.imap(start_end_trim_one_arg, arg_list):
-                finished_count += 1
-                if verbosity == 1:
-                    output_progress_line(finished_count, read_count, print_dest)
-                elif verbosity > 1:
-                    print(out, file=print_dest, flush=True)
-
-    if verbosity == 1:
-        output_progress_line(read_count, read_count, print_dest, end_newline=True)
-    if verbosity > 0:
-        print('', file=print_dest)
+def tally_read_end_trimming(reads, trimming_stats):
+    """
+    Adds the end trimming results for these reads to the running totals in trimming_stats (a
+    defaultdict(int)), so the summary can be built up one chunk of reads at a time.
+    """
+    for read in reads:
+        trimming_stats['read_count'] += 1
+        if read.start_trim_amount:
+            trimming_stats['start_trim_count'] += 1
+            trimming_stats['start_trim_total'] += read.start_trim_amount
+        if read.end_trim_amount:
+            trimming_stats['end_trim_count'] += 1
+            trimming_stats['end_trim_total'] += read.end_trim_amount
 
 
-def display_read_end_trimming_summary(reads, verbosity, print_dest):
+def tally_read_middle_trimming(reads, trimming_stats):
+    trimming_stats['middle_trim_count'] += sum(1 if x.middle_adapter_intervals else 0
+                                               for x in reads)
+
+
+def display_read_end_trimming_summary(trimming_stats, verbosity, print_dest):
     if verbosity < 1:
         return
-    start_trim_total = sum(x.start_trim_amount for x in reads)
-    start_trim_count = sum(1 if x.start_trim_amount else 0 for x in reads)
-    end_trim_count = sum(1 if x.end_trim_amount else 0 for x in reads)
-    end_trim_total = sum(x.end_trim_amount for x in reads)
-    print(int_to_str(start_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their start (' +
-          int_to_str(start_trim_total) + ' bp removed)', file=print_dest)
-    print(int_to_str(end_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their end (' +
-          int_to_str(end_trim_total) + ' bp removed)', file=print_dest)
+    read_count = trimming_stats['read_count']
+    print('', file=print_dest)
+    print(int_to_str(trimming_stats['start_trim_count']).rjust(len(int_to_str(read_count))) +
+          ' / ' + int_to_str(read_count) + ' reads had adapters trimmed from their start (' +
+          int_to_str(trimming_stats['start_trim_total']) + ' bp removed)', file=print_dest)
+    print(int_to_str(trimming_stats['end_trim_count']).rjust(len(int_to_str(read_count))) +
+          ' / ' + int_to_str(read_count) + ' reads had adapters trimmed from their end (' +
+          int_to_str(trimming_stats['end_trim_total']) + ' bp removed)', file=print_dest)
     print('\n', file=print_dest)
 
 
-def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_threshold,
-                                  extra_trim_good_side, extra_trim_bad_side, scoring_scheme_vals,
-                                  print_dest, threads, discard_middle):
-    if verbosity > 0:
-        verb = 'Discarding' if discard_middle else 'Splitting'
-        print(bold_underline(verb + ' reads containing middle adapters'),
-              file=print_dest)
+def display_read_middle_trimming_header(discard_middle, verbosity, print_dest):
+    if verbosity < 1:
+        return
+    verb = 'Discarding' if discard_middle else 'Splitting'
+    print(bold_underline(verb + ' reads containing middle adapters'), file=print_dest)
+
+
+def display_read_middle_trimming_summary(trimming_stats, discard_middle, verbosity, print_dest):
+    if verbosity < 1:
+        return
+    verb = 'discarded' if discard_middle else 'split'
+    print(int_to_str(trimming_stats['middle_trim_count']) + ' / ' +
+          int_to_str(trimming_stats['read_count']) + ' reads were ' + verb +
+          ' based on middle adapters\n\n', file=print_dest)
+
+
+def trim_and_output_reads(args, reads, matching_sets, forward_or_reverse_barcodes, read_type):
+    """
+    Trims, splits and outputs the reads. Each read goes through all of these steps in one task (see
+    ReadPipeline) and is written as soon as it's done, in input order. In streaming mode, reads is
+    an iterator and only one chunk of reads is held in memory at a time, so memory usage depends on
+    --stream_buffer, not on the input size.
+    """
+    split_reads = matching_sets and not args.no_split
+    if matching_sets:
+        display_read_end_trimming_header(matching_sets, args.verbosity, args.print_dest)
+        if split_reads:
+            display_read_middle_trimming_header(args.discard_middle, args.verbosity,
+                                                args.print_dest)
+            if args.verbosity > 0:
+                print('', file=args.print_dest)
+    elif args.verbosity > 0:
+        print('No adapters found - output reads are unchanged from input reads\n',
+              file=args.print_dest)
+
+    read_output = ReadOutput(args.format, args.output, read_type, args.verbosity, args.print_dest,
+                             args.barcode_dir, args.input, args.untrimmed, args.threads,
+                             args.discard_unassigned)
+    pipeline = ReadPipeline(args, matching_sets, forward_or_reverse_barcodes,
+                            read_output.out_format)
+
+    # Without streaming, the reads are all in memory, so they are one stream chunk and the
+    # progress line can show the total.
+    if args.stream:
+        read_count = None
+        stream_chunks = iterate_read_chunks(reads, args.stream_buffer)
+    else:
+        read_count = len(reads)
+        stream_chunks = [reads]
+
+    trimming_stats = defaultdict(int)
+    finished_count = 0
+    if args.verbosity == 1:
+        output_pipeline_progress_line(0, read_count, args.print_dest)
+    pool = get_read_pipeline_pool(pipeline, args.threads, args.engine)
+    try:
+        for reads in stream_chunks:
+            chunk_size = get_chunk_size(args.chunk_size, len(reads), args.threads)
+            for read_chunk, chunk_results in get_read_pipeline_results(pipeline, reads, pool,
+                                                                       args.engine, chunk_size):
+                for read, (read_str, outputs) in zip(read_chunk, chunk_results):
+                    read_output.write_read(read, read_str)
+                    for out in outputs:
+                        print(out, file=args.print_dest, flush=True)
+                read_output.write_buffered_reads()
+                finished_count += len(read_chunk)
+                if args.verbosity == 1 and read_count is not None:
+                    output_progress_line(finished_count, read_count, args.print_dest, step=1)
+            if matching_sets:
+                tally_read_end_trimming(reads, trimming_stats)
+            else:
+                trimming_stats['read_count'] += len(reads)
+            if split_reads:
+                tally_read_middle_trimming(reads, trimming_stats)
+            if args.verbosity == 1 and read_count is None:
+                output_pipeline_progress_line(finished_count, read_count, args.print_dest)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if args.verbosity == 1:
+        output_pipeline_progress_line(finished_count, read_count, args.print_dest,
+                                      end_newline=True)
+
+    if matching_sets:
+        display_read_end_trimming_summary(trimming_stats, args.verbosity, args.print_dest)
+    if split_reads:
+        display_read_middle_trimming_summary(trimming_stats, args.discard_middle, args.verbosity,
+                                             args.print_dest)
+    read_output.close()
+
+
+class ReadPipeline(object):
+    """
+    This class does all of the work for one read: finding adapters at its ends, calling its
+    barcode, finding adapters in its middle and making its output string. It only holds the
+    settings, so one object can be shared by threads or copied to worker processes.
+    """
+
+    def __init__(self, args, matching_sets, forward_or_reverse_barcodes, out_format):
+        self.matching_sets = matching_sets
+        self.forward_or_reverse_barcodes = forward_or_reverse_barcodes
+        self.check_barcodes = (args.barcode_dir is not None)
+        self.split_reads = bool(matching_sets) and not args.no_split
+        self.verbosity = args.verbosity
+        self.scoring_scheme_vals = args.scoring_scheme_vals
+
+        self.start_adapters = [x for x in matching_sets if x.start_sequence]
+        self.end_adapters = [x for x in matching_sets if x.end_sequence]
+        self.end_size = args.end_size
+        self.extra_end_trim = args.extra_end_trim
+        self.end_threshold = args.end_threshold
+        self.min_trim_size = args.min_trim_size
+        self.barcode_threshold = args.barcode_threshold
+        self.barcode_diff = args.barcode_diff
+        self.require_two_barcodes = args.require_two_barcodes
+        self.anchor_barcodes = args.anchor_barcodes
+
+        self.middle_adapters, self.start_sequence_names, self.end_sequence_names = \
+            get_middle_adapters(matching_sets)
+        self.middle_threshold = args.middle_threshold
+        self.extra_middle_trim_good_side = args.extra_middle_trim_good_side
+        self.extra_middle_trim_bad_side = args.extra_middle_trim_bad_side
+
+        # The seed k-mers for each adapter only depend on the threshold and scoring scheme, so
+        # they're made once here.
+        self.middle_adapter_seeds = {seq: get_middle_adapter_seeds(seq, args.middle_threshold,
+                                                                   args.scoring_scheme_vals)
+                                     for _, seq in self.middle_adapters}
+
+        self.out_format = out_format
+        self.min_split_read_size = args.min_split_read_size
+        self.discard_middle = args.discard_middle
+        self.untrimmed = args.untrimmed
+        self.discard_unassigned = self.check_barcodes and args.discard_unassigned
+        self.make_adapter_profiles()
+
+    def make_adapter_profiles(self):
+        """
+        The start and end adapter sequences are prepared in C++ once, for use with every read.
+        Barcodes are only aligned where they could change a read's barcode call, except at the
+        highest verbosity, which shows every barcode's score.
+        """
+        self.start_adapter_profiles = \
+            make_end_adapter_profiles(self.start_adapters,
+                                      [x.start_sequence[1] for x in self.start_adapters],
+                                      self.scoring_scheme_vals, self.end_threshold,
+                                      self.min_trim_size, self.check_barcodes,
+                                      self.forward_or_reverse_barcodes, self.anchor_barcodes,
+                                      read_start=True, barcode_threshold=self.barcode_threshold,
+                                      barcode_diff=self.barcode_diff,
+                                      barcode_early_exit=self.verbosity < 3)
+        self.end_adapter_profiles = \
+            make_end_adapter_profiles(self.end_adapters,
+                                      [x.end_sequence[1] for x in self.end_adapters],
+                                      self.scoring_scheme_vals, self.end_threshold,
+                                      self.min_trim_size, self.check_barcodes,
+                                      self.forward_or_reverse_barcodes, self.anchor_barcodes,
+                                      read_start=False, barcode_threshold=self.barcode_threshold,
+                                      barcode_diff=self.barcode_diff,
+                                      barcode_early_exit=self.verbosity < 3)
+
+    def __getstate__(self):
+        """
+        The adapter profiles are C++ objects, so they aren't copied to worker processes along with
+        the rest of the pipeline. Each process makes its own instead.
+        """
+        state = self.__dict__.copy()
+        del state['start_adapter_profiles']
+        del state['end_adapter_profiles']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.make_adapter_profiles()
+
+    def process_reads(self, reads):
+        """
+        Returns each read's output string (empty if it isn't to be outputted) and a list of any
+        verbose output for it. The adapters at the ends of all the reads are found first, in one
+        C++ call.
+        """
+        if self.matching_sets:
+            find_read_end_trims(reads, self.start_adapters, self.start_adapter_profiles,
+                                self.end_adapters, self.end_adapter_profiles, self.end_size,
+                                self.extra_end_trim, self.end_threshold, self.min_trim_size,
+                                self.check_barcodes, self.forward_or_reverse_barcodes)
+        return [self.process_read(x) for x in reads]
+
+    def process_read(self, read):
+        """
+        Does the rest of the work for one read, after its end adapters have been found.
+        """
+        outputs = []
+        if self.matching_sets:
+            if self.check_barcodes:
+                read.determine_barcode(self.barcode_threshold, self.barcode_diff,
+                                       self.require_two_barcodes)
+            if self.verbosity == 2:
+                outputs.append(read.formatted_start_and_end_seq(self.end_size, self.extra_end_trim,
+                                                                self.check_barcodes))
+            elif self.verbosity > 2:
+                outputs.append(read.full_start_end_output(self.end_size, self.extra_end_trim,
+                                                          self.check_barcodes))
+
+        if self.split_reads:
+            read.find_middle_adapters(self.middle_adapters, self.middle_adapter_seeds,
+                                      self.middle_threshold, self.extra_middle_trim_good_side,
+                                      self.extra_middle_trim_bad_side, self.scoring_scheme_vals,
+                                      self.start_sequence_names, self.end_sequence_names)
+            if read.middle_adapter_intervals and self.verbosity > 1:
+                outputs.append(read.middle_adapter_results(self.verbosity))
+
+        if self.discard_unassigned and read.barcode_call == 'none':
+            read_str = ''
+        else:
+            read_str = get_read_str(read, self.out_format, self.min_split_read_size,
+                                    self.discard_middle, self.untrimmed)
+        return read_str, outputs
+
 
+def get_middle_adapters(matching_sets):
+    """
+    Returns the adapter sequences to look for in the middle of reads (without duplicates), along
+    with the names of the start and end sequences.
+    """
     adapters = []
     for matching_set in matching_sets:
         if matching_set.start_sequence:
@@ -555,183 +1099,248 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
         if matching_set.end_sequence:
             end_sequence_names.add(matching_set.end_sequence[0])
 
-    read_count = len(reads)
-    if verbosity == 1:
-        output_progress_line(0, read_count, print_dest)
+    return adapters, start_sequence_names, end_sequence_names
 
-    # If single-threaded, do the work in a simple loop.
+
+def get_read_str(read, out_format, min_split_size, discard_middle, untrimmed):
+    if out_format == 'fasta':
+        return read.get_fasta(min_split_size, discard_middle, untrimmed)
+    else:
+        return read.get_fastq(min_split_size, discard_middle, untrimmed)
+
+
+def get_read_pipeline_pool(pipeline, threads, engine):
+    """
+    Returns the pool for running the read pipeline: None when single-threaded, otherwise a thread
+    pool or a pool of worker processes (each with its own copy of the pipeline).
+    """
     if threads == 1:
-        for read_num, read in enumerate(reads):
-            read.find_middle_adapters(adapters, middle_threshold, extra_trim_good_side,
-                                      extra_trim_bad_side, scoring_scheme_vals,
-                                      start_sequence_names, end_sequence_names)
-            if verbosity == 1:
-                output_progress_line(read_num+1, read_count, print_dest)
-            if read.middle_adapter_positions and verbosity > 1:
-                print(read.middle_adapter_results(verbosity), file=print_dest, flush=True)
-
-    # If multi-threaded, use a thread pool.
+        return None
+    if engine == 'process':
+        return multiprocessing.Pool(threads, initializer=set_worker_pipeline,
+                                    initargs=(pipeline,))
+    return ThreadPool(threads)
+
+
+def get_read_pipeline_results(pipeline, reads, pool, engine, chunk_size):
+    """
+    Runs the reads through the pipeline, chunk_size reads per task. Yields each chunk of reads
+    along with a list of their results (output string and verbose output), in the same order as
+    the reads.
+    """
+    read_chunks = iterate_read_chunks(reads, chunk_size)
+
+    # If single-threaded, do the work in a simple loop.
+    if pool is None:
+        for read_chunk in read_chunks:
+            yield read_chunk, pipeline.process_reads(read_chunk)
+
+    # If using worker processes, the workers send back the reads' trimming results along with
+    # their output strings.
+    elif engine == 'process':
+        read_chunks = list(read_chunks)
+        input_chunks = ([x.get_worker_input() for x in chunk] for chunk in read_chunks)
+        for read_chunk, worker_results in zip(read_chunks, pool.imap(process_reads_in_worker,
+                                                                     input_chunks)):
+            chunk_results = []
+            for read, (end_results, middle_results, read_str, outputs) in zip(read_chunk,
+                                                                              worker_results):
+                read.set_end_trim_results(end_results)
+                read.set_middle_trim_results(middle_results)
+                chunk_results.append((read_str, outputs))
+            yield read_chunk, chunk_results
+
+    # If multi-threaded, each thread in the pool does all the work for its chunk, the same as a
+    # worker process. The read ends are found in C++, which doesn't need the GIL, so the threads
+    # find them in parallel.
     else:
-        def find_middle_adapters_one_arg(all_args):
-            r, a, b, c, d, e, f, g, v = all_args
-            r.find_middle_adapters(a, b, c, d, e, f, g)
-            return r.middle_adapter_results(v)
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in reads:
-                arg_list.append((read, adapters, middle_threshold, extra_trim_good_side,
-                                 extra_trim_bad_side, scoring_scheme_vals, start_sequence_names,
-                                 end_sequence_names, verbosity))
-            finished_count = 0
-            for out in pool.imap(find_middle_adapters_one_arg, arg_list):
-                finished_count += 1
-                if verbosity == 1:
-                    output_progress_line(finished_count + 1, read_count, print_dest)
-                if verbosity > 1 and out:
-                    print(out, file=print_dest, flush=True)
-
-    if verbosity == 1:
-        output_progress_line(read_count, read_count, print_dest, end_newline=True)
-        print('', flush=True, file=print_dest)
-
-
-def display_read_middle_trimming_summary(reads, discard_middle, verbosity, print_dest):
-    if verbosity < 1:
-        return
-    middle_trim_count = sum(1 if x.middle_adapter_positions else 0 for x in reads)
-    verb = 'discarded' if discard_middle else 'split'
-    print(int_to_str(middle_trim_count) + ' / ' + int_to_str(len(reads)) + ' reads were ' + verb +
-          ' based on middle adapters\n\n', file=print_dest)
+        read_chunks = list(read_chunks)
+        for read_chunk, chunk_results in zip(read_chunks, pool.imap(pipeline.process_reads,
+                                                                    read_chunks)):
+            yield read_chunk, chunk_results
 
 
-def output_reads(reads, out_format, output, read_type, verbosity, discard_middle,
-                 min_split_size, print_dest, barcode_dir, input_filename,
-                 untrimmed, threads, discard_unassigned):
-    if verbosity > 0:
-        trimmed_or_untrimmed = 'untrimmed' if untrimmed else 'trimmed'
+# The read pipeline in a worker process, so it doesn't need to be sent with every chunk of reads.
+WORKER_PIPELINE = None
+
+
+def set_worker_pipeline(pipeline):
+    global WORKER_PIPELINE
+    WORKER_PIPELINE = pipeline
+
+
+def get_chunk_size(chunk_size, read_count, threads):
+    """
+    Returns the number of reads to give a thread or process at a time: the --chunk_size setting if
+    given, otherwise big enough to keep the per-task overhead low but small enough that the work
+    is spread evenly over the threads and the progress updates regularly.
+    """
+    if chunk_size is not None:
+        return chunk_size
+    return max(1, min(100, read_count // (threads * 4)))
+
+
+def process_reads_in_worker(read_inputs):
+    """
+    Runs a chunk of reads through the pipeline in a worker process. Returns each read's compact
+    results, output string and verbose output.
+    """
+    reads = [read_from_worker_input(x) for x in read_inputs]
+    return [(read.get_end_trim_results(), read.get_middle_trim_results(), read_str, outputs)
+            for read, (read_str, outputs) in zip(reads, WORKER_PIPELINE.process_reads(reads))]
+
+
+class ReadOutput(object):
+    """
+    This class saves reads to stdout, a file or barcode bins. Reads are given one at a time, with
+    their output strings already made, and buffered until write_buffered_reads is called (once per
+    chunk of reads). The output is finished off (compression, summary table) when close is called.
+    """
+
+    def __init__(self, out_format, output, read_type, verbosity, print_dest, barcode_dir,
+                 input_filename, untrimmed, threads, discard_unassigned):
+        self.output = output
+        self.verbosity = verbosity
+        self.print_dest = print_dest
+        self.barcode_dir = barcode_dir
+        self.untrimmed = untrimmed
+        self.discard_unassigned = discard_unassigned
+
+        if verbosity > 0:
+            trimmed_or_untrimmed = 'untrimmed' if untrimmed else 'trimmed'
+            if barcode_dir is not None:
+                verb = 'Saving '
+                destination = 'barcode-specific files'
+            elif output is None:
+                verb = 'Outputting '
+                destination = 'stdout'
+            else:
+                verb = 'Saving '
+                destination = 'file'
+            print(bold_underline(verb + trimmed_or_untrimmed + ' reads to ' + destination),
+                  flush=True, file=print_dest)
+
+        if out_format == 'auto':
+            if output is None:
+                out_format = read_type.lower()
+                if barcode_dir is not None and input_filename.lower().endswith('.gz'):
+                    out_format += '.gz'
+            elif '.fasta.gz' in output.lower():
+                out_format = 'fasta.gz'
+            elif '.fastq.gz' in output.lower():
+                out_format = 'fastq.gz'
+            elif '.fasta' in output.lower():
+                out_format = 'fasta'
+            elif '.fastq' in output.lower():
+                out_format = 'fastq'
+            else:
+                out_format = read_type.lower()
+
+        self.gzipped_out = False
+        if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
+            self.gzipped_out = True
+            out_format = out_format[:-3]
+            self.compression_pool = GzipCompressionPool(threads)
+        self.out_format = out_format
+        self.read_str_buffers = defaultdict(list)
+
         if barcode_dir is not None:
-            verb = 'Saving '
-            destination = 'barcode-specific files'
+            if not os.path.isdir(barcode_dir):
+                os.makedirs(barcode_dir)
+            self.barcode_files = {}
+            self.barcode_read_counts = defaultdict(int)
+            self.barcode_base_counts = defaultdict(int)
+            self.out_file = None
         elif output is None:
-            verb = 'Outputting '
-            destination = 'stdout'
+            self.out_file = None
+        elif self.gzipped_out:
+            self.out_file = ParallelGzipWriter(output, self.compression_pool)
         else:
-            verb = 'Saving '
-            destination = 'file'
-        print(bold_underline(verb + trimmed_or_untrimmed + ' reads to ' + destination),
-              flush=True, file=print_dest)
-
-    if out_format == 'auto':
-        if output is None:
-            out_format = read_type.lower()
-            if barcode_dir is not None and input_filename.lower().endswith('.gz'):
-                out_format += '.gz'
-        elif '.fasta.gz' in output.lower():
-            out_format = 'fasta.gz'
-        elif '.fastq.gz' in output.lower():
-            out_format = 'fastq.gz'
-        elif '.fasta' in output.lower():
-            out_format = 'fasta'
-        elif '.fastq' in output.lower():
-            out_format = 'fastq'
-        else:
-            out_format = read_type.lower()
-
-    gzipped_out = False
-    gzip_command = 'gzip'
-    if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
-        gzipped_out = True
-        out_format = out_format[:-3]
-        if shutil.which('pigz'):
-            if verbosity > 0:
-                print('pigz found - using it to compress instead of gzip')
-            gzip_command = 'pigz -p ' + str(threads)
-        else:
-            if verbosity > 0:
-                print('pigz not found - using gzip to compress')
-
-    # Output reads to barcode bins.
-    if barcode_dir is not None:
-        if not os.path.isdir(barcode_dir):
-            os.makedirs(barcode_dir)
-        barcode_files = {}
-        barcode_read_counts, barcode_base_counts = defaultdict(int), defaultdict(int)
-        for read in reads:
+            self.out_file = open(output, 'wt')
+
+    def write_read(self, read, read_str):
+        """
+        Adds one read, given its output string (from get_read_str), to the buffer for its
+        destination. The buffers are written out in one go by write_buffered_reads.
+        """
+        if not read_str:
+            return
+
+        # Output reads to barcode bins.
+        if self.barcode_dir is not None:
             barcode_name = read.barcode_call
-            if discard_unassigned and barcode_name == 'none':
-                continue
-            if out_format == 'fasta':
-                read_str = read.get_fasta(min_split_size, discard_middle, untrimmed)
-            else:
-                read_str = read.get_fastq(min_split_size, discard_middle, untrimmed)
-            if not read_str:
-                continue
-            if barcode_name not in barcode_files:
-                barcode_files[barcode_name] = \
-                    open(os.path.join(barcode_dir, barcode_name + '.' + out_format), 'wt')
-            barcode_files[barcode_name].write(read_str)
-            barcode_read_counts[barcode_name] += 1
-            if untrimmed:
+            if self.discard_unassigned and barcode_name == 'none':
+                return
+            if barcode_name not in self.barcode_files:
+                bin_filename = self.get_bin_filename(barcode_name)
+                if self.gzipped_out:
+                    self.barcode_files[barcode_name] = ParallelGzipWriter(bin_filename,
+                                                                          self.compression_pool)
+                else:
+                    self.barcode_files[barcode_name] = open(bin_filename, 'wt')
+            out_file = self.barcode_files[barcode_name]
+            self.barcode_read_counts[barcode_name] += 1
+            if self.untrimmed:
                 seq_length = len(read.seq)
             else:
                 seq_length = read.seq_length_with_start_end_adapters_trimmed()
-            barcode_base_counts[barcode_name] += seq_length
-        table = [['Barcode', 'Reads', 'Bases', 'File']]
-
-        for barcode_name in sorted(barcode_files.keys()):
-            barcode_files[barcode_name].close()
-            bin_filename = os.path.join(barcode_dir, barcode_name + '.' + out_format)
-
-            if gzipped_out:
-                if not os.path.isfile(bin_filename):
-                    continue
-                bin_filename_gz = bin_filename + '.gz'
-                if os.path.isfile(bin_filename_gz):
-                    os.remove(bin_filename_gz)
-                try:
-                    subprocess.check_output(gzip_command + ' ' + bin_filename,
-                                            stderr=subprocess.STDOUT, shell=True)
-                except subprocess.CalledProcessError:
-                    pass
-                bin_filename = bin_filename_gz
-
-            table_row = [barcode_name, int_to_str(barcode_read_counts[barcode_name]),
-                         int_to_str(barcode_base_counts[barcode_name]), bin_filename]
-            table.append(table_row)
+            self.barcode_base_counts[barcode_name] += seq_length
 
-        if verbosity > 0:
-            print('')
-            print_table(table, print_dest, alignments='LRRL', max_col_width=60, col_separation=2)
-
-    # Output to all reads to stdout.
-    elif output is None:
-        for read in reads:
-            read_str = read.get_fasta(min_split_size, discard_middle) if out_format == 'fasta' \
-                else read.get_fastq(min_split_size, discard_middle)
-            print(read_str, end='')
-        if verbosity > 0:
-            print('Done', flush=True, file=print_dest)
+        # Output to all reads to stdout.
+        elif self.output is None:
+            out_file = sys.stdout
 
-    # Output to all reads to file.
-    else:
-        if gzipped_out:
-            out_filename = 'TEMP_' + str(os.getpid()) + '.fastq'
+        # Output to all reads to file.
         else:
-            out_filename = output
-        with open(out_filename, 'wt') as out:
-            for read in reads:
-                read_str = read.get_fasta(min_split_size, discard_middle) if out_format == 'fasta' \
-                    else read.get_fastq(min_split_size, discard_middle)
-                out.write(read_str)
-        if gzipped_out:
-            subprocess.check_output(gzip_command + ' -c ' + out_filename + ' > ' + output,
-                                    stderr=subprocess.STDOUT, shell=True)
-            os.remove(out_filename)
-        if verbosity > 0:
-            print('\nSaved result to ' + os.path.abspath(output), file=print_dest)
+            out_file = self.out_file
+
+        self.read_str_buffers[out_file].append(read_str)
+
+    def write_buffered_reads(self):
+        """
+        Writes the buffered reads with one write per destination. The buffers are kept for reuse.
+        """
+        for out_file, read_strs in self.read_str_buffers.items():
+            if read_strs:
+                out_file.write(''.join(read_strs))
+                read_strs.clear()
+
+    def get_bin_filename(self, barcode_name):
+        bin_filename = os.path.join(self.barcode_dir, barcode_name + '.' + self.out_format)
+        if self.gzipped_out:
+            bin_filename += '.gz'
+        return bin_filename
+
+    def close(self):
+        self.write_buffered_reads()
+        if self.barcode_dir is not None:
+            table = [['Barcode', 'Reads', 'Bases', 'File']]
+            for barcode_name in sorted(self.barcode_files.keys()):
+                self.barcode_files[barcode_name].close()
+                bin_filename = self.get_bin_filename(barcode_name)
+                table_row = [barcode_name, int_to_str(self.barcode_read_counts[barcode_name]),
+                             int_to_str(self.barcode_base_counts[barcode_name]), bin_filename]
+                table.append(table_row)
+
+            if self.verbosity > 0:
+                print('')
+                print_table(table, self.print_dest, alignments='LRRL', max_col_width=60,
+                            col_separation=2)
+
+        elif self.output is None:
+            if self.verbosity > 0:
+                print('Done', flush=True, file=self.print_dest)
 
-    if verbosity > 0:
-        print('', flush=True, file=print_dest)
+        else:
+            self.out_file.close()
+            if self.verbosity > 0:
+                print('\nSaved result to ' + os.path.abspath(self.output), file=self.print_dest)
+
+        if self.gzipped_out:
+            self.compression_pool.close()
+
+        if self.verbosity > 0:
+            print('', flush=True, file=self.print_dest)
 
 
 def output_progress_line(completed, total, print_dest, end_newline=False, step=10):
@@ -746,3 +1355,16 @@ def output_progress_line(completed, total, print_dest, end_newline=False, step=1
 
     end_char = '\n' if end_newline else ''
     print('\r' + progress_str, end=end_char, flush=True, file=print_dest)
+
+
+def output_pipeline_progress_line(completed, total, print_dest, end_newline=False):
+    """
+    Shows how many reads the pipeline has processed: out of the total, or just a count in
+    streaming mode, where the total isn't known in advance (total is None).
+    """
+    if total is not None:
+        output_progress_line(completed, total, print_dest, end_newline)
+        return
+    end_char = '\n' if end_newline else ''
+    print('\r' + int_to_str(completed) + ' reads processed', end=end_char, flush=True,
+          file=print_dest)
@@ -10,24 +10,26 @@
 
 char * adapterAlignment(char * readSeq, char * adapterSeq,
                         int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore) {
-    std::string output;
-
     Dna5String sequenceH = readSeq;
     Dna5String sequenceV = adapterSeq;
-    std::string readName = "";
-    std::string refName = "";
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+
+    ScoredAlignment scoredAlignment = alignAdapter(sequenceH, sequenceV, scoringScheme);
+    return cppStringToCString(scoredAlignment.getString());
+}
+
 
+ScoredAlignment alignAdapter(Dna5String & sequenceH, Dna5String & sequenceV,
+                             Score<int, Simple> & scoringScheme) {
     Align<Dna5String, ArrayGaps> alignment;
     resize(rows(alignment), 2);
     assignSource(row(alignment, 0), sequenceH);
     assignSource(row(alignment, 1), sequenceV);
-    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
 
     AlignConfig<true, true, true, true> alignConfig;
     int score = globalAlignment(alignment, scoringScheme, alignConfig);
 
-    ScoredAlignment scoredAlignment(alignment, length(readSeq), length(adapterSeq), score);
-    return cppStringToCString(scoredAlignment.getString());
+    return ScoredAlignment(alignment, length(sequenceH), length(sequenceV), score);
 }
 
 
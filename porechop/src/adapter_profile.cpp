@@ -0,0 +1,455 @@
+#include "adapter_profile.h"
+
+#include <algorithm>
+#include <map>
+#include "lane_alignment.h"
+#include "path_alignment.h"
+
+
+// The barcode anchor's flank must align to a read with at least this identity (over the aligned
+// region) and this many adapter bases, up to its edge next to the barcode. The barcode window
+// then extends this many bases either side of where the barcode should be, to allow for indels.
+static const double ANCHOR_MIN_IDENTITY = 80.0;
+static const int ANCHOR_MIN_BASES = 16;
+static const int ANCHOR_WINDOW_MARGIN = 6;
+
+// Identities are compared after Python rounds them, so the barcode early exit allows this much
+// either way.
+static const double BARCODE_CALL_ALLOWANCE = 0.0001;
+
+
+// minIdentity and minReadBases are the prefilter's settings (see MyersFilter::canReachIdentity).
+// anchorFlank is empty if there's no barcode anchor. Otherwise fullAdapterBarcodes has the index
+// of each full barcode adapter's barcode adapter (or -1 for other adapters), and the barcode
+// threshold and diff of the anchor are the ones used to call barcodes (see alignBarcodeWindows).
+// With the barcode early exit, the adapters in alwaysAlign are the barcodes to score (see
+// alignBarcodeCandidates).
+AdapterProfileSet::AdapterProfileSet(char ** adapterSeqs, int * alwaysAlign, int adapterCount,
+                                     int matchScore, int mismatchScore, int gapOpenScore,
+                                     int gapExtensionScore, double minIdentity, int minReadBases,
+                                     const char * anchorFlank, bool flankBeforeBarcode,
+                                     int barcodeLength, int * fullAdapterBarcodes,
+                                     double anchorBarcodeThreshold, double anchorBarcodeDiff,
+                                     bool barcodeEarlyExit, double barcodeDiff):
+    m_anchor{encodeBases(anchorFlank), flankBeforeBarcode, barcodeLength,
+             anchorBarcodeThreshold, anchorBarcodeDiff},
+    m_barcodeEarlyExit(barcodeEarlyExit), m_barcodeDiff(barcodeDiff),
+    m_matchScore(matchScore), m_mismatchScore(mismatchScore),
+    m_gapOpenScore(gapOpenScore), m_gapExtensionScore(gapExtensionScore),
+    m_minIdentity(minIdentity), m_minReadBases(minReadBases)
+{
+    std::map<std::string, int> sequenceIndices;
+    for (int i = 0; i < adapterCount; ++i) {
+        auto inserted = sequenceIndices.emplace(adapterSeqs[i], int(m_profiles.size()));
+        if (inserted.second)
+            m_profiles.push_back(AdapterProfile{encodeBases(adapterSeqs[i]),
+                                                MyersFilter(adapterSeqs[i])});
+        m_profileIndices.push_back(inserted.first->second);
+        m_alwaysAlign.push_back(alwaysAlign[i] != 0);
+    }
+
+    m_fullAdapterBarcodes.assign(adapterCount, -1);
+    m_barcodeProfiles.assign(m_profiles.size(), false);
+    if (m_anchor.flank.empty())
+        return;
+    for (int i = 0; i < adapterCount; ++i) {
+        int barcode = fullAdapterBarcodes[i];
+        m_fullAdapterBarcodes[i] = barcode;
+        if (barcode != -1 && !m_barcodeProfiles[m_profileIndices[barcode]]) {
+            m_barcodeProfiles[m_profileIndices[barcode]] = true;
+            m_barcodeAdapters.push_back(barcode);
+        }
+    }
+
+    // Any other adapter with a barcode's sequence is also aligned to the barcode windows, so it
+    // can share the barcode's alignment.
+    for (int i = 0; i < adapterCount; ++i)
+        if (m_barcodeProfiles[m_profileIndices[i]] &&
+                std::find(m_barcodeAdapters.begin(), m_barcodeAdapters.end(), i) ==
+                m_barcodeAdapters.end())
+            m_barcodeAdapters.push_back(i);
+}
+
+
+// Aligns the adapters to many read ends, which must already be encoded with encodeBases. For each
+// read and adapter (at read * adapterCount + adapter in the arrays), aligned is set to 1 and the
+// result filled in if the adapter needed aligning, or aligned is set to 0 if it didn't (the
+// prefilter showed it couldn't trim the read, or the barcode anchor showed it wasn't the read's
+// barcode). Each distinct adapter sequence is aligned to all of its reads together, so they can
+// share SIMD lanes, and adapters with the same sequence get copies of the same result.
+void AdapterProfileSet::alignReadEnds(const std::string * reads, int readCount, int * aligned,
+                                      AlignmentResult * results) const {
+    int adapterCount = int(m_profileIndices.size());
+    int profileCount = int(m_profiles.size());
+
+    // Reads with a barcode window (windowStarts not -1) have their barcodes aligned to that.
+    std::vector<std::string> windows(readCount);
+    std::vector<int> windowStarts(readCount, -1);
+    if (!m_anchor.flank.empty()) {
+        findBarcodeWindows(reads, readCount, windows, windowStarts);
+        alignBarcodeWindows(windows, windowStarts, aligned, results);
+    }
+
+    std::vector<std::vector<const std::string *>> profileReads(profileCount);
+    std::vector<std::vector<AlignmentResult *>> profileResults(profileCount);
+    std::vector<std::pair<AlignmentResult *, AlignmentResult *>> copies;
+
+    // With the barcode early exit, each read's barcodes which weren't aligned for trimming are
+    // kept here along with their identity bounds, to be aligned if needed.
+    std::vector<std::vector<std::pair<double, int>>> barcodeCandidates(readCount);
+
+    // For the current read: each profile's prefilter call (-1 if not run yet) and where its
+    // alignment goes (nullptr if it isn't aligned).
+    std::vector<int> filterCalls(profileCount);
+    std::vector<AlignmentResult *> readResults(profileCount);
+    auto addAlignment = [&](int p, const std::string * read, AlignmentResult * result) {
+        if (readResults[p] == nullptr) {
+            readResults[p] = result;
+            profileReads[p].push_back(read);
+            profileResults[p].push_back(result);
+            return true;
+        }
+        copies.emplace_back(result, readResults[p]);
+        return false;
+    };
+    auto alignProfiles = [&]() {
+        for (int p = 0; p < profileCount; ++p) {
+            alignReadsInLanes(profileReads[p].data(), int(profileReads[p].size()),
+                              m_profiles[p].adapter, m_matchScore, m_mismatchScore,
+                              m_gapOpenScore, m_gapExtensionScore, profileResults[p].data());
+            profileReads[p].clear();
+            profileResults[p].clear();
+        }
+    };
+
+    // The full barcode adapters of anchored reads are left until their barcodes are aligned, and
+    // their barcodes already have been.
+    for (int i = 0; i < readCount; ++i) {
+        std::string reverseRead(reads[i].rbegin(), reads[i].rend());
+        bool anchored = windowStarts[i] != -1;
+        std::fill(filterCalls.begin(), filterCalls.end(), -1);
+        std::fill(readResults.begin(), readResults.end(), nullptr);
+        for (int j = 0; j < adapterCount; ++j) {
+            int p = m_profileIndices[j];
+            int index = i * adapterCount + j;
+            if (anchored && m_fullAdapterBarcodes[j] != -1) {
+                aligned[index] = 0;
+                continue;
+            }
+            if (anchored && m_barcodeProfiles[p])
+                continue;
+            if (m_barcodeEarlyExit && m_alwaysAlign[j]) {
+                aligned[index] = filterPasses(p, reads[i], reverseRead, filterCalls);
+                if (!aligned[index])
+                    barcodeCandidates[i].emplace_back(
+                        m_profiles[p].filter.maxFullAdapterIdentity(reads[i]), j);
+            }
+            else
+                aligned[index] = profileAligns(j, reads[i], reverseRead, filterCalls);
+            if (aligned[index])
+                addAlignment(p, &reads[i], &results[index]);
+        }
+    }
+    alignProfiles();
+    for (auto & copy : copies)
+        *copy.first = *copy.second;
+    copies.clear();
+    if (m_barcodeEarlyExit)
+        alignBarcodeCandidates(reads, readCount, barcodeCandidates, aligned, results);
+
+    for (int i = 0; i < readCount; ++i) {
+        if (windowStarts[i] == -1)
+            continue;
+        int bestBarcode = getBestBarcode(i, results);
+        if (bestBarcode == -1)
+            continue;
+        std::string reverseRead(reads[i].rbegin(), reads[i].rend());
+        std::fill(filterCalls.begin(), filterCalls.end(), -1);
+        std::fill(readResults.begin(), readResults.end(), nullptr);
+        for (int j = 0; j < adapterCount; ++j) {
+            if (m_fullAdapterBarcodes[j] != bestBarcode)
+                continue;
+            int index = i * adapterCount + j;
+            aligned[index] = profileAligns(j, reads[i], reverseRead, filterCalls);
+            if (aligned[index])
+                addAlignment(m_profileIndices[j], &reads[i], &results[index]);
+        }
+    }
+    alignProfiles();
+    for (auto & copy : copies)
+        *copy.first = *copy.second;
+}
+
+
+// Returns whether an adapter needs aligning to a read: if it must always be aligned or if the
+// prefilter shows it could trim the read. The prefilter is only run once for each profile (its
+// calls for the current read are kept in filterCalls).
+bool AdapterProfileSet::profileAligns(int adapter, const std::string & read,
+                                      const std::string & reverseRead,
+                                      std::vector<int> & filterCalls) const {
+    return m_alwaysAlign[adapter] ||
+           filterPasses(m_profileIndices[adapter], read, reverseRead, filterCalls);
+}
+
+
+bool AdapterProfileSet::filterPasses(int profile, const std::string & read,
+                                     const std::string & reverseRead,
+                                     std::vector<int> & filterCalls) const {
+    if (filterCalls[profile] == -1)
+        filterCalls[profile] = m_profiles[profile].filter.canReachIdentity(read, reverseRead,
+                                                                           m_minIdentity,
+                                                                           m_minReadBases);
+    return filterCalls[profile] != 0;
+}
+
+
+// Aligns the barcode anchor's flank to each read and, where it's found, sets the read's barcode
+// window: the part of the read next to the flank where the barcode should be.
+void AdapterProfileSet::findBarcodeWindows(const std::string * reads, int readCount,
+                                           std::vector<std::string> & windows,
+                                           std::vector<int> & windowStarts) const {
+    std::vector<AlignmentResult> flankResults(readCount);
+    std::vector<const std::string *> readPointers;
+    std::vector<AlignmentResult *> resultPointers;
+    for (int i = 0; i < readCount; ++i) {
+        readPointers.push_back(&reads[i]);
+        resultPointers.push_back(&flankResults[i]);
+    }
+    alignReadsInLanes(readPointers.data(), readCount, m_anchor.flank, m_matchScore,
+                      m_mismatchScore, m_gapOpenScore, m_gapExtensionScore,
+                      resultPointers.data());
+
+    int flankLength = int(m_anchor.flank.size());
+    int minBases = std::min(ANCHOR_MIN_BASES, flankLength);
+    for (int i = 0; i < readCount; ++i) {
+        const AlignmentResult & result = flankResults[i];
+        if (result.readStartPos == -1 ||
+                result.alignedRegionPercentIdentity < ANCHOR_MIN_IDENTITY ||
+                result.adapterEndPos - result.adapterStartPos + 1 < minBases)
+            continue;
+        int barcodeStart;
+        if (m_anchor.flankBeforeBarcode) {
+            if (result.adapterEndPos != flankLength - 1)
+                continue;
+            barcodeStart = result.readEndPos + 1;
+        }
+        else {
+            if (result.adapterStartPos != 0)
+                continue;
+            barcodeStart = result.readStartPos - m_anchor.barcodeLength;
+        }
+        int windowStart = std::max(0, barcodeStart - ANCHOR_WINDOW_MARGIN);
+        int windowEnd = std::min(int(reads[i].size()),
+                                 barcodeStart + m_anchor.barcodeLength + ANCHOR_WINDOW_MARGIN);
+
+        // A read which doesn't have room for the whole barcode next to the flank is aligned as
+        // usual.
+        if (windowEnd - windowStart < m_anchor.barcodeLength)
+            continue;
+        windows[i] = reads[i].substr(windowStart, windowEnd - windowStart);
+        windowStarts[i] = windowStart;
+    }
+}
+
+
+// Aligns the barcodes to the barcode windows of the anchored reads and moves their results to
+// read positions. A read loses its anchor (and so is aligned as usual) if its best barcode in the
+// window wouldn't be called: if it's under the barcode threshold or not far enough ahead of the
+// second best. That happens when an indel next to the flank puts part of the barcode outside the
+// window, so the barcode is then looked for in the whole read end.
+void AdapterProfileSet::alignBarcodeWindows(const std::vector<std::string> & windows,
+                                            std::vector<int> & windowStarts, int * aligned,
+                                            AlignmentResult * results) const {
+    int readCount = int(windows.size());
+    int adapterCount = int(m_profileIndices.size());
+    int profileCount = int(m_profiles.size());
+    std::vector<std::vector<const std::string *>> profileReads(profileCount);
+    std::vector<std::vector<AlignmentResult *>> profileResults(profileCount);
+    std::vector<std::pair<AlignmentResult *, AlignmentResult *>> copies;
+    std::vector<AlignmentResult *> readResults(profileCount);
+    for (int i = 0; i < readCount; ++i) {
+        if (windowStarts[i] == -1)
+            continue;
+        std::fill(readResults.begin(), readResults.end(), nullptr);
+        for (int j : m_barcodeAdapters) {
+            int p = m_profileIndices[j];
+            int index = i * adapterCount + j;
+            aligned[index] = 1;
+            if (readResults[p] == nullptr) {
+                readResults[p] = &results[index];
+                profileReads[p].push_back(&windows[i]);
+                profileResults[p].push_back(&results[index]);
+            }
+            else
+                copies.emplace_back(&results[index], readResults[p]);
+        }
+    }
+    for (int p = 0; p < profileCount; ++p)
+        alignReadsInLanes(profileReads[p].data(), int(profileReads[p].size()),
+                          m_profiles[p].adapter, m_matchScore, m_mismatchScore, m_gapOpenScore,
+                          m_gapExtensionScore, profileResults[p].data());
+    for (auto & copy : copies)
+        *copy.first = *copy.second;
+
+    for (int i = 0; i < readCount; ++i) {
+        if (windowStarts[i] == -1)
+            continue;
+        for (int j : m_barcodeAdapters) {
+            AlignmentResult & result = results[i * adapterCount + j];
+            if (result.readStartPos != -1) {
+                result.readStartPos += windowStarts[i];
+                result.readEndPos += windowStarts[i];
+            }
+        }
+        if (!windowBarcodeCalled(i, results))
+            windowStarts[i] = -1;
+    }
+}
+
+
+// Returns whether an anchored read's best barcode in its window passes the barcode threshold and
+// diff. Adapters which share a barcode's sequence share its alignment, so each sequence is only
+// counted once.
+bool AdapterProfileSet::windowBarcodeCalled(int read, const AlignmentResult * results) const {
+    int adapterCount = int(m_profileIndices.size());
+    std::vector<bool> counted(m_profiles.size(), false);
+    double bestIdentity = 0.0, secondBestIdentity = 0.0;
+    for (int barcode : m_barcodeAdapters) {
+        int p = m_profileIndices[barcode];
+        if (counted[p])
+            continue;
+        counted[p] = true;
+        double identity = results[read * adapterCount + barcode].fullAdapterPercentIdentity;
+        if (identity > bestIdentity) {
+            secondBestIdentity = bestIdentity;
+            bestIdentity = identity;
+        }
+        else if (identity > secondBestIdentity)
+            secondBestIdentity = identity;
+    }
+    return bestIdentity >= m_anchor.barcodeThreshold &&
+           bestIdentity >= secondBestIdentity + m_anchor.barcodeDiff;
+}
+
+
+// Returns the barcode adapter with the best full adapter identity in an anchored read, or -1 if
+// none of them aligned at all.
+int AdapterProfileSet::getBestBarcode(int read, const AlignmentResult * results) const {
+    int adapterCount = int(m_profileIndices.size());
+    int bestBarcode = -1;
+    double bestIdentity = 0.0;
+    for (int barcode : m_barcodeAdapters) {
+        double identity = results[read * adapterCount + barcode].fullAdapterPercentIdentity;
+        if (identity > bestIdentity) {
+            bestBarcode = barcode;
+            bestIdentity = identity;
+        }
+    }
+    return bestBarcode;
+}
+
+
+// Aligns the barcodes for the early exit: the ones in candidates (with their identity bounds from
+// MyersFilter::maxFullAdapterIdentity) weren't aligned for trimming, so each is only aligned if
+// it could change the read's barcode call. Each read's candidates are tried from the highest
+// bound down, in rounds over all of the reads so they can still share SIMD lanes. A read with no
+// barcode alignments yet gets its most promising one, and after that, every candidate which could
+// change the call given the best so far. This repeats until no read needs any more.
+void AdapterProfileSet::alignBarcodeCandidates(
+        const std::string * reads, int readCount,
+        std::vector<std::vector<std::pair<double, int>>> & candidates,
+        int * aligned, AlignmentResult * results) const {
+    int adapterCount = int(m_profileIndices.size());
+    int profileCount = int(m_profiles.size());
+    for (auto & readCandidates : candidates)
+        std::sort(readCandidates.begin(), readCandidates.end(),
+                  [](const std::pair<double, int> & a, const std::pair<double, int> & b) {
+                      return a.first > b.first || (a.first == b.first && a.second < b.second);});
+
+    std::vector<size_t> nextCandidates(readCount, 0);
+    std::vector<std::vector<const std::string *>> profileReads(profileCount);
+    std::vector<std::vector<AlignmentResult *>> profileResults(profileCount);
+    while (true) {
+        bool anyAligned = false;
+        for (int i = 0; i < readCount; ++i) {
+            const auto & readCandidates = candidates[i];
+            size_t & next = nextCandidates[i];
+            if (next == readCandidates.size())
+                continue;
+            size_t end = next;
+            double bestIdentity = getBestBarcodeIdentity(i, aligned, results);
+            if (bestIdentity < 0.0)
+                ++end;
+            else
+                while (end < readCandidates.size() &&
+                       barcodeCouldChangeCall(readCandidates[end].first, bestIdentity))
+                    ++end;
+            for (; next < end; ++next) {
+                int j = readCandidates[next].second;
+                int index = i * adapterCount + j;
+                aligned[index] = 1;
+                profileReads[m_profileIndices[j]].push_back(&reads[i]);
+                profileResults[m_profileIndices[j]].push_back(&results[index]);
+                anyAligned = true;
+            }
+        }
+        if (!anyAligned)
+            break;
+        for (int p = 0; p < profileCount; ++p) {
+            alignReadsInLanes(profileReads[p].data(), int(profileReads[p].size()),
+                              m_profiles[p].adapter, m_matchScore, m_mismatchScore,
+                              m_gapOpenScore, m_gapExtensionScore, profileResults[p].data());
+            profileReads[p].clear();
+            profileResults[p].clear();
+        }
+    }
+}
+
+
+// Returns the best full adapter identity of the barcodes aligned to a read so far, or -1 if none
+// have been.
+double AdapterProfileSet::getBestBarcodeIdentity(int read, const int * aligned,
+                                                 const AlignmentResult * results) const {
+    int adapterCount = int(m_profileIndices.size());
+    double bestIdentity = -1.0;
+    for (int j = 0; j < adapterCount; ++j) {
+        int index = read * adapterCount + j;
+        if (m_alwaysAlign[j] && aligned[index])
+            bestIdentity = std::max(bestIdentity, results[index].fullAdapterPercentIdentity);
+    }
+    return bestIdentity;
+}
+
+
+// Returns whether a barcode which can't score more than maxIdentity could change a read's barcode
+// call (see determine_barcode in nanopore_read.py), given the best barcode at this read end so far.
+// It can't if it's further below the best than the barcode diff, as then it can't become the best
+// or the second-best too close to it (even when the read's start and end are called together, as
+// the best overall is at least as good). This also keeps each end's best barcode exact, as it's
+// shown at verbosity 2.
+bool AdapterProfileSet::barcodeCouldChangeCall(double maxIdentity, double bestIdentity) const {
+    double diff = std::max(m_barcodeDiff, 0.0);
+    return maxIdentity + BARCODE_CALL_ALLOWANCE >= bestIdentity - diff;
+}
+
+
+AdapterProfileSet * createAdapterProfileSet(char ** adapterSeqs, int * alwaysAlign,
+                                            int adapterCount, int matchScore, int mismatchScore,
+                                            int gapOpenScore, int gapExtensionScore,
+                                            double minIdentity, int minReadBases,
+                                            char * anchorFlank, int flankBeforeBarcode,
+                                            int barcodeLength, int * fullAdapterBarcodes,
+                                            double anchorBarcodeThreshold,
+                                            double anchorBarcodeDiff, int barcodeEarlyExit,
+                                            double barcodeDiff) {
+    return new AdapterProfileSet(adapterSeqs, alwaysAlign, adapterCount, matchScore,
+                                 mismatchScore, gapOpenScore, gapExtensionScore, minIdentity,
+                                 minReadBases, anchorFlank, flankBeforeBarcode != 0,
+                                 barcodeLength, fullAdapterBarcodes, anchorBarcodeThreshold,
+                                 anchorBarcodeDiff, barcodeEarlyExit != 0, barcodeDiff);
+}
+
+
+void deleteAdapterProfileSet(AdapterProfileSet * profiles) {
+    delete profiles;
+}
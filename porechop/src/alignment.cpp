@@ -6,108 +6,88 @@
 ScoredAlignment::ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
                                  int readLength, int adapterLength, int score):
     m_readLength(readLength), m_adapterLength(adapterLength),
-    m_readStartPos(-1), m_adapterStartPos(-1), m_rawScore(score)
+    m_readStartPos(-1), m_readEndPos(-1), m_adapterStartPos(-1), m_adapterEndPos(-1),
+    m_rawScore(0), m_alignedRegionPercentIdentity(0.0), m_fullAdapterPercentIdentity(0.0)
 {
-    // Extract the alignment sequences into C++ strings for constant time random access.
-    std::ostringstream stream1;
-    stream1 << row(alignment, 0);
-    std::string readAlignment =  stream1.str();
-    std::ostringstream stream2;
-    stream2 << row(alignment, 1);
-    std::string adapterAlignment =  stream2.str();
-
-    int alignmentLength = std::max(readAlignment.size(), adapterAlignment.size());
+    // A failed alignment (where the read or adapter is empty) keeps these values, the same as
+    // PathAligner's failed result.
+    typedef Row<Align<Dna5String, ArrayGaps> >::Type TRow;
+    typedef Iterator<TRow, Standard>::Type TRowIterator;
+    TRow & readRow = row(alignment, 0);
+    TRow & adapterRow = row(alignment, 1);
+    int readRowLength = length(readRow);
+    int adapterRowLength = length(adapterRow);
+    int alignmentLength = std::max(readRowLength, adapterRowLength);
     if (alignmentLength == 0)
         return;
 
-
-    // We consider the alignment to have started when we've encountered a base in both
-    // sequences (though not necessarily at the same time).
-    int alignmentStartPos = -1;
-    bool readStarted = false;
-    bool adapterStarted = false;
+    // We consider the alignment to have started when we've encountered a base in both sequences
+    // (though not necessarily at the same time) and to have ended at the last column where neither
+    // sequence has finished. So it runs from the later of the two sequences' first base columns to
+    // the earlier of their last base columns. Those are all found in one pass over the gapped rows,
+    // along with how many bases of the other sequence came before each last base column, which
+    // gives the end positions.
+    int firstReadColumn = -1, lastReadColumn = -1;
+    int firstAdapterColumn = -1, lastAdapterColumn = -1;
+    int adapterBasesBeforeLastRead = 0, readBasesBeforeLastAdapter = 0;
+    int readBases = 0, adapterBases = 0, matchCount = 0;
+    TRowIterator readIt = begin(readRow, Standard());
+    TRowIterator adapterIt = begin(adapterRow, Standard());
     for (int i = 0; i < alignmentLength; ++i) {
-        if (readAlignment[i] != '-')
-            readStarted = true;
-        if (adapterAlignment[i] != '-')
-            adapterStarted = true;
-        if (readStarted && adapterStarted) {
-            alignmentStartPos = i;
-            break;
-        }
-    }
+        bool readBase = i < readRowLength && !isGap(readIt);
+        bool adapterBase = i < adapterRowLength && !isGap(adapterIt);
 
-    // We use the same logic to see when the alignment has ended.
-    int alignmentEndPos = -1;
-    bool readEnded = false;
-    bool adapterEnded = false;
-    for (int i = alignmentLength - 1; i >= 0; --i) {
-        if (readAlignment[i] != '-')
-            readEnded = true;
-        if (adapterAlignment[i] != '-')
-            adapterEnded = true;
-        if (readEnded && adapterEnded) {
-            alignmentEndPos = i;
-            break;
+        if (readBase) {
+            if (firstReadColumn == -1)
+                firstReadColumn = i;
+            lastReadColumn = i;
+            adapterBasesBeforeLastRead = adapterBases;
         }
-    }
-
-    if (alignmentStartPos == -1 || alignmentEndPos == -1)
-        return;
-
-    // We also determine the start and end of the adapter in the alignment.
-    int adapterAlignmentStartPos = -1;
-    for (int i = 0; i < alignmentLength; ++i) {
-        if (adapterAlignment[i] != '-') {
-            adapterAlignmentStartPos = i;
-            break;
-        }
-    }
-    int adapterAlignmentEndPos = -1;
-    for (int i = alignmentLength - 1; i >= 0; --i) {
-        if (adapterAlignment[i] != '-') {
-            adapterAlignmentEndPos = i;
-            break;
+        if (adapterBase) {
+            if (firstAdapterColumn == -1)
+                firstAdapterColumn = i;
+            lastAdapterColumn = i;
+            readBasesBeforeLastAdapter = readBases;
         }
-    }
-
-    // Now get the percent identity of the alignment using both the full alignment range and the
-    // adapter alignment range.
-    int alignedMatchCount = 0;
-    for (int i = alignmentStartPos; i < alignmentEndPos+1; ++i) {
-        if (adapterAlignment[i] == readAlignment[i])
-            ++alignedMatchCount;
-    }
-    int alignedRegionLength = alignmentEndPos - alignmentStartPos + 1;
-    m_alignedRegionPercentIdentity = 100.0 * alignedMatchCount / alignedRegionLength;
-
-    int fullAdapterMatchCount = 0;
-    for (int i = adapterAlignmentStartPos; i < adapterAlignmentEndPos+1; ++i) {
-        if (adapterAlignment[i] == readAlignment[i])
-            ++fullAdapterMatchCount;
-    }
-    int fullAdapterLength = adapterAlignmentEndPos - adapterAlignmentStartPos + 1;
-    m_fullAdapterPercentIdentity = 100.0 * fullAdapterMatchCount / fullAdapterLength;
-
-    int readBases = 0, adapterBases = 0;
-    for (int i = 0; i < alignmentLength; ++i) {
-        char base1 = readAlignment[i];
-        char base2 = adapterAlignment[i];
-
-        if (i == alignmentStartPos) {
+        if (m_readStartPos == -1 && firstReadColumn != -1 && firstAdapterColumn != -1) {
             m_readStartPos = readBases;
             m_adapterStartPos = adapterBases;
         }
-        if (i == alignmentEndPos) {
-            m_readEndPos = readBases;
-            m_adapterEndPos = adapterBases;
-        }
+        if (readBase && adapterBase && *readIt == *adapterIt)
+            ++matchCount;
 
-        if (base1 != '-')
+        if (readBase)
             ++readBases;
-        if (base2 != '-')
+        if (adapterBase)
             ++adapterBases;
+        if (i < readRowLength)
+            ++readIt;
+        if (i < adapterRowLength)
+            ++adapterIt;
     }
+
+    if (m_readStartPos == -1)
+        return;
+    m_rawScore = score;
+    int alignmentStartPos = std::max(firstReadColumn, firstAdapterColumn);
+    int alignmentEndPos = std::min(lastReadColumn, lastAdapterColumn);
+    if (lastReadColumn <= lastAdapterColumn) {
+        m_readEndPos = readBases - 1;
+        m_adapterEndPos = adapterBasesBeforeLastRead;
+    }
+    else {
+        m_readEndPos = readBasesBeforeLastAdapter;
+        m_adapterEndPos = adapterBases - 1;
+    }
+
+    // Now get the percent identity of the alignment using both the full alignment range and the
+    // adapter alignment range. A match needs a base in both sequences, so every match is inside
+    // the aligned region, which is itself inside the adapter's range. The two ranges therefore
+    // have the same match count, just different lengths.
+    int alignedRegionLength = alignmentEndPos - alignmentStartPos + 1;
+    m_alignedRegionPercentIdentity = 100.0 * matchCount / alignedRegionLength;
+    int fullAdapterLength = lastAdapterColumn - firstAdapterColumn + 1;
+    m_fullAdapterPercentIdentity = 100.0 * matchCount / fullAdapterLength;
 }
 
 std::string ScoredAlignment::getString() {
@@ -0,0 +1,121 @@
+#include "kmer_screen.h"
+
+#include <algorithm>
+#include <cmath>
+#include "path_alignment.h"
+
+
+// Gets the k-mer index (base 4) at each position of an encoded sequence, or -1 where the k-mer
+// includes an N.
+static std::vector<int> getKmerIndices(const std::string & seq) {
+    std::vector<int> indices;
+    int kmerCount = int(seq.size()) - KmerScreen::KMER_SIZE + 1;
+    for (int i = 0; i < kmerCount; ++i) {
+        int index = 0;
+        for (int j = i; j < i + KmerScreen::KMER_SIZE; ++j) {
+            if (seq[j] > 3) {
+                index = -1;
+                break;
+            }
+            index = index * 4 + seq[j];
+        }
+        indices.push_back(index);
+    }
+    return indices;
+}
+
+
+// minIdentity is the full adapter identity threshold (as a percentage).
+KmerScreen::KmerScreen(const char * adapterSeq, double minIdentity) {
+    std::string adapter = encodeBases(adapterSeq);
+    int adapterLength = int(adapter.size());
+    m_kmers = getKmerIndices(adapter);
+    m_nKmerCount = int(std::count(m_kmers.begin(), m_kmers.end(), -1));
+    m_maxEdits = getMaxEdits(adapterLength, minIdentity);
+    m_minSharedKmers = adapterLength - KMER_SIZE + 1 - KMER_SIZE * m_maxEdits;
+}
+
+
+// The read must be indexed with indexRead. diagonalCounts is working space, kept between calls.
+bool KmerScreen::passes(const ReadKmerIndex & read, std::vector<int> & diagonalCounts) const {
+    int needed = m_minSharedKmers - m_nKmerCount;
+    if (needed <= 0)
+        return true;
+
+    // Most reads don't share enough k-mers with the adapter anywhere, so that is checked before
+    // counting them by diagonal.
+    int sharedKmers = 0;
+    for (int kmer : m_kmers) {
+        if (kmer == -1)
+            continue;
+        for (int q = read.firstPositions[kmer]; q != -1; q = read.nextPositions[q])
+            ++sharedKmers;
+    }
+    if (sharedKmers < needed)
+        return false;
+
+    // Diagonals are offset by the adapter's k-mer count so they can't be negative.
+    int kmerCount = int(m_kmers.size());
+    diagonalCounts.assign(read.readLength + kmerCount, 0);
+    for (int p = 0; p < kmerCount; ++p) {
+        if (m_kmers[p] == -1)
+            continue;
+        for (int q = read.firstPositions[m_kmers[p]]; q != -1; q = read.nextPositions[q])
+            ++diagonalCounts[q - p + kmerCount];
+    }
+    int bandWidth = m_maxEdits + 1;
+    int bandCount = 0;
+    for (int d = 0; d < int(diagonalCounts.size()); ++d) {
+        bandCount += diagonalCounts[d];
+        if (d >= bandWidth)
+            bandCount -= diagonalCounts[d - bandWidth];
+        if (bandCount >= needed)
+            return true;
+    }
+    return false;
+}
+
+
+// Returns the most edits an alignment of the adapter can have and still reach the identity (see
+// the comment in kmer_screen.h). The identities are compared to the threshold after rounding to
+// six decimal places, so this allows for a little under it.
+int KmerScreen::getMaxEdits(int adapterLength, double minIdentity) {
+    double identity = (minIdentity - 0.000001) / 100.0;
+    if (identity <= 0.0)
+        return adapterLength;
+    return std::max(0, int(std::floor(adapterLength * (1.0 / identity - 1.0))));
+}
+
+
+// Makes the index of where each k-mer (without Ns) occurs in an encoded read sequence. The index
+// is reused from one read to the next.
+void KmerScreen::indexRead(const std::string & read, ReadKmerIndex & index) {
+    std::vector<int> kmers = getKmerIndices(read);
+    index.firstPositions.assign(size_t(1) << (2 * KMER_SIZE), -1);
+    index.nextPositions.assign(kmers.size(), -1);
+    index.readLength = int(read.size());
+    for (int q = int(kmers.size()) - 1; q >= 0; --q) {
+        if (kmers[q] == -1)
+            continue;
+        index.nextPositions[q] = index.firstPositions[kmers[q]];
+        index.firstPositions[kmers[q]] = q;
+    }
+}
+
+
+// Screens each read against each adapter. passes has an entry for each read and adapter (at
+// read * adapterCount + adapter), set to 1 if the adapter could reach the identity threshold in
+// the read or 0 if it can't.
+void kmerScreenPasses(char ** readSeqs, int readCount, char ** adapterSeqs,
+                      int adapterCount, double minIdentity, int * passes) {
+    std::vector<KmerScreen> screens;
+    for (int i = 0; i < adapterCount; ++i)
+        screens.emplace_back(adapterSeqs[i], minIdentity);
+    ReadKmerIndex read;
+    std::vector<int> diagonalCounts;
+    for (int i = 0; i < readCount; ++i) {
+        KmerScreen::indexRead(encodeBases(readSeqs[i]), read);
+        for (int j = 0; j < adapterCount; ++j)
+            passes[i * adapterCount + j] = screens[j].passes(read, diagonalCounts);
+    }
+}
@@ -0,0 +1,346 @@
+#include "lane_alignment.h"
+
+#include <algorithm>
+#include <numeric>
+
+
+// The x86-64 versions of the DP are compiled with target attributes, so the rest of the library
+// doesn't need the newer instructions and the CPU can be checked when the reads are aligned.
+#if defined(__GNUC__) && defined(__x86_64__)
+#define LANE_DISPATCH 1
+#endif
+
+
+// The same DP as PathAligner::findBestPath, one lane per read, with the reads' bases given column
+// by column in readColumns. It fills the rows' last row and last column, from which each lane's
+// best path is chosen. It is always inlined so it takes on the instruction set of its caller.
+template <typename Lanes>
+static inline __attribute__((always_inline))
+void fillLaneRows(const Lanes * readColumns, int readLength,
+                  const char * adapterSeq, int adapterLength,
+                  int matchScoreValue, int mismatchScoreValue,
+                  int gapOpenScoreValue, int gapExtensionScoreValue,
+                  LaneMatrixRows<Lanes> & rows) {
+    typedef LaneCounts<Lanes> Counts;
+    int columns = readLength + 1;
+    const Lanes zero = {};
+    const Lanes matchScore = zero + matchScoreValue;
+    const Lanes mismatchScore = zero + mismatchScoreValue;
+    const Lanes gapOpenScore = zero + gapOpenScoreValue;
+    const Lanes gapExtensionScore = zero + gapExtensionScoreValue;
+    const int linearGaps = (gapOpenScoreValue == gapExtensionScoreValue);
+    const Lanes diagonalMove = zero + int(DIAGONAL_MOVE);
+    const Lanes horizontalMove = zero + int(HORIZONTAL_MOVE);
+    const Lanes verticalMove = zero + int(VERTICAL_MOVE);
+
+    Lanes * diagonalScores = rows.diagonalScores.data();
+    Lanes * verticalScores = rows.verticalScores.data();
+    Counts * diagonalCounts = rows.diagonalCounts.data();
+    Counts * verticalCounts = rows.verticalCounts.data();
+
+    // The vector comparisons give -1 in each lane where they are true, which selects a.
+    auto select = [](const Lanes & mask, const Counts & a, const Counts & b) {
+        return Counts{mask ? a.matches : b.matches, mask ? a.diagonals : b.diagonals,
+                      mask ? a.readGaps : b.readGaps, mask ? a.adapterGaps : b.adapterGaps,
+                      mask ? a.startRead : b.startRead, mask ? a.startAdapter : b.startAdapter};
+    };
+
+    // The first row is free: the path can start at any read position.
+    for (int j = 0; j < columns; ++j) {
+        diagonalScores[j] = zero;
+        verticalScores[j] = zero + MIN_SCORE;
+        diagonalCounts[j] = Counts{zero, zero, zero, zero, zero + j, zero};
+        rows.lastRowMoves[j] = zero + int(NO_MOVE);
+    }
+    rows.lastColumnScores[0] = zero;
+    rows.lastColumnCounts[0] = diagonalCounts[readLength];
+    rows.lastColumnMoves[0] = zero + int(NO_MOVE);
+
+    for (int i = 1; i <= adapterLength; ++i) {
+        const Lanes adapterBase = zero + adapterSeq[i-1];
+        bool lastRow = (i == adapterLength);
+
+        // The first column is also free: the path can start at any adapter position.
+        Lanes upLeftScore = diagonalScores[0];
+        Counts upLeftCounts = diagonalCounts[0];
+        diagonalScores[0] = zero;
+        diagonalCounts[0] = Counts{zero, zero, zero, zero, zero, zero + i};
+
+        Lanes horizontalScore = zero + MIN_SCORE;
+        Counts horizontalCounts = diagonalCounts[0];
+        Lanes move = zero + int(NO_MOVE);
+
+        // The selections and tie-breaking are the same as in PathAligner::findBestPath.
+        auto computeCell = [&](int j, bool endCell) {
+            Lanes upScore = diagonalScores[j];
+            Counts upCounts = diagonalCounts[j];
+
+            Lanes openScore = diagonalScores[j-1] + gapOpenScore;
+            horizontalScore += gapExtensionScore;
+            Lanes open = horizontalScore < openScore + linearGaps;
+            horizontalScore = open ? openScore : horizontalScore;
+            horizontalCounts = select(open, diagonalCounts[j-1], horizontalCounts);
+            horizontalCounts.readGaps += 1;
+
+            openScore = upScore + gapOpenScore;
+            Lanes verticalScore = verticalScores[j] + gapExtensionScore;
+            open = verticalScore < openScore + linearGaps;
+            verticalScore = open ? openScore : verticalScore;
+            Counts verticalPathCounts = select(open, upCounts, verticalCounts[j]);
+            verticalPathCounts.adapterGaps += 1;
+            verticalScores[j] = verticalScore;
+            verticalCounts[j] = verticalPathCounts;
+
+            Lanes match = (readColumns[j-1] == adapterBase);
+            Lanes score = upLeftScore + (match ? matchScore : mismatchScore);
+            upLeftCounts.matches -= match;
+            upLeftCounts.diagonals += 1;
+            Lanes horizontal = verticalScore < horizontalScore;
+            Lanes gapScore = horizontal ? horizontalScore : verticalScore;
+            Lanes gap = score < gapScore;
+            score = gap ? gapScore : score;
+            Counts counts = select(gap, select(horizontal, horizontalCounts,
+                                                  verticalPathCounts), upLeftCounts);
+
+            if (endCell) {
+                move = gap ? (horizontal ? horizontalMove : verticalMove) : diagonalMove;
+                if (!linearGaps)
+                    move = (verticalScore == score) ? verticalMove :
+                           ((horizontalScore == score) ? horizontalMove : move);
+                counts = select(move == verticalMove, verticalPathCounts,
+                                select(move == horizontalMove, horizontalCounts, counts));
+                if (lastRow)
+                    rows.lastRowMoves[j] = move;
+            }
+
+            diagonalScores[j] = score;
+            diagonalCounts[j] = counts;
+            upLeftScore = upScore;
+            upLeftCounts = upCounts;
+        };
+
+        if (lastRow) {
+            for (int j = 1; j < columns; ++j)
+                computeCell(j, true);
+        }
+        else {
+            for (int j = 1; j < readLength; ++j)
+                computeCell(j, false);
+            computeCell(readLength, true);
+        }
+        rows.lastColumnScores[i] = diagonalScores[readLength];
+        rows.lastColumnCounts[i] = diagonalCounts[readLength];
+        rows.lastColumnMoves[i] = move;
+    }
+}
+
+
+// The DP compiled for each instruction set. The vectors only go through memory (by pointer or
+// reference), so these can be called from code compiled without the instructions.
+#ifdef LANE_DISPATCH
+__attribute__((target("avx2")))
+static void fillAvx2Rows(const EightLanes * readColumns, int readLength,
+                         const char * adapterSeq, int adapterLength,
+                         int matchScore, int mismatchScore, int gapOpenScore,
+                         int gapExtensionScore, LaneMatrixRows<EightLanes> & rows) {
+    fillLaneRows(readColumns, readLength, adapterSeq, adapterLength,
+                 matchScore, mismatchScore, gapOpenScore, gapExtensionScore, rows);
+}
+
+__attribute__((target("sse4.2")))
+static void fillSse4Rows(const FourLanes * readColumns, int readLength,
+                         const char * adapterSeq, int adapterLength,
+                         int matchScore, int mismatchScore, int gapOpenScore,
+                         int gapExtensionScore, LaneMatrixRows<FourLanes> & rows) {
+    fillLaneRows(readColumns, readLength, adapterSeq, adapterLength,
+                 matchScore, mismatchScore, gapOpenScore, gapExtensionScore, rows);
+}
+#endif
+
+static void fillDefaultRows(const FourLanes * readColumns, int readLength,
+                            const char * adapterSeq, int adapterLength,
+                            int matchScore, int mismatchScore, int gapOpenScore,
+                            int gapExtensionScore, LaneMatrixRows<FourLanes> & rows) {
+    fillLaneRows(readColumns, readLength, adapterSeq, adapterLength,
+                 matchScore, mismatchScore, gapOpenScore, gapExtensionScore, rows);
+}
+
+
+template <typename Lanes>
+static PathCounts getLaneCounts(const LaneCounts<Lanes> & counts, int lane) {
+    return PathCounts{counts.matches[lane], counts.diagonals[lane], counts.readGaps[lane],
+                      counts.adapterGaps[lane], counts.startRead[lane], counts.startAdapter[lane]};
+}
+
+
+template <typename Lanes>
+const int LaneAligner<Lanes>::LANES;
+
+
+template <typename Lanes>
+LaneAligner<Lanes>::LaneAligner(int matchScore, int mismatchScore, int gapOpenScore,
+                                int gapExtensionScore, FillFunction fillRows,
+                                LaneWorkspace<Lanes> & workspace):
+    m_matchScore(matchScore), m_mismatchScore(mismatchScore),
+    m_gapOpenScore(gapOpenScore), m_gapExtensionScore(gapExtensionScore), m_fillRows(fillRows),
+    m_pathAligner(matchScore, mismatchScore, gapOpenScore, gapExtensionScore),
+    m_rows(workspace.rows), m_readColumns(workspace.readColumns)
+{
+}
+
+
+// Aligns each read to the adapter (both already encoded with encodeBases), filling in the result
+// that each read's pointer in results points to. The reads are grouped by length and each group
+// is aligned up to LANES reads at a time.
+template <typename Lanes>
+void LaneAligner<Lanes>::alignReads(const std::string * const * reads, int readCount,
+                                    const std::string & adapter,
+                                    AlignmentResult * const * results) {
+    std::vector<int> order(readCount);
+    std::iota(order.begin(), order.end(), 0);
+    std::stable_sort(order.begin(), order.end(),
+                     [&](int a, int b) {return reads[a]->size() < reads[b]->size();});
+
+    const std::string * laneReads[LANES];
+    AlignmentResult * laneResults[LANES];
+    int groupStart = 0;
+    while (groupStart < readCount) {
+        size_t readLength = reads[order[groupStart]]->size();
+        int groupEnd = groupStart + 1;
+        while (groupEnd < readCount && reads[order[groupEnd]]->size() == readLength)
+            ++groupEnd;
+
+        for (int i = groupStart; i < groupEnd; i += LANES) {
+            int laneCount = std::min(LANES, groupEnd - i);
+
+            // There's no DP to do with an empty sequence, and PathAligner gives the failed result.
+            if (readLength == 0 || adapter.empty()) {
+                for (int k = i; k < i + laneCount; ++k) {
+                    const std::string & read = *reads[order[k]];
+                    m_pathAligner.align(read.c_str(), int(read.size()), adapter.c_str(),
+                                        int(adapter.size()), *results[order[k]]);
+                }
+                continue;
+            }
+            for (int lane = 0; lane < laneCount; ++lane) {
+                laneReads[lane] = reads[order[i + lane]];
+                laneResults[lane] = results[order[i + lane]];
+            }
+            alignLanes(laneReads, laneCount, adapter, laneResults);
+        }
+        groupStart = groupEnd;
+    }
+}
+
+
+// Aligns up to LANES non-empty reads of the same length to a non-empty adapter. Any unused lanes
+// repeat the first read and their results are ignored.
+template <typename Lanes>
+void LaneAligner<Lanes>::alignLanes(const std::string * const * reads, int laneCount,
+                                    const std::string & adapter, AlignmentResult ** results) {
+    int readLength = int(reads[0]->size());
+    int adapterLength = int(adapter.size());
+    int columns = readLength + 1;
+
+    m_readColumns.resize(readLength);
+    for (int j = 0; j < readLength; ++j) {
+        for (int lane = 0; lane < LANES; ++lane)
+            m_readColumns[j][lane] = (*reads[lane < laneCount ? lane : 0])[j];
+    }
+    m_rows.diagonalScores.resize(columns);
+    m_rows.verticalScores.resize(columns);
+    m_rows.diagonalCounts.resize(columns);
+    m_rows.verticalCounts.resize(columns);
+    m_rows.lastRowMoves.resize(columns);
+    m_rows.lastColumnScores.resize(adapterLength + 1);
+    m_rows.lastColumnCounts.resize(adapterLength + 1);
+    m_rows.lastColumnMoves.resize(adapterLength + 1);
+
+    m_fillRows(m_readColumns.data(), readLength, adapter.c_str(), adapterLength,
+               m_matchScore, m_mismatchScore, m_gapOpenScore, m_gapExtensionScore, m_rows);
+
+    // Each lane's best cell is chosen the same way as in PathAligner::findBestPath.
+    for (int lane = 0; lane < laneCount; ++lane) {
+        PathEnd<PathCounts> best{MIN_SCORE, 0, 0, PathCounts::atStart(0, 0), NO_MOVE};
+        for (int j = 0; j < readLength; ++j) {
+            if (m_rows.diagonalScores[j][lane] > best.score)
+                best = PathEnd<PathCounts>{m_rows.diagonalScores[j][lane], j, adapterLength,
+                                           getLaneCounts(m_rows.diagonalCounts[j], lane),
+                                           PathMove(m_rows.lastRowMoves[j][lane])};
+        }
+        for (int i = 0; i <= adapterLength; ++i) {
+            if (m_rows.lastColumnScores[i][lane] > best.score)
+                best = PathEnd<PathCounts>{m_rows.lastColumnScores[i][lane], readLength, i,
+                                           getLaneCounts(m_rows.lastColumnCounts[i], lane),
+                                           PathMove(m_rows.lastColumnMoves[i][lane])};
+        }
+        fillAlignmentResult(best, adapterLength, *results[lane]);
+    }
+}
+
+
+enum LaneKernel {NO_LANES, DEFAULT_KERNEL, SSE4_KERNEL, AVX2_KERNEL};
+
+
+// Returns the widest lane kernel that the CPU supports. The PORECHOP_LANE_KERNEL environment
+// variable (avx2, sse4.2, default or none) can choose a narrower one, so each kernel can be tested
+// on the same machine. With none, each read is aligned on its own by PathAligner. This is only
+// worked out once.
+static LaneKernel getLaneKernel() {
+    static const LaneKernel laneKernel = [] {
+        LaneKernel kernel = DEFAULT_KERNEL;
+#ifdef LANE_DISPATCH
+        if (__builtin_cpu_supports("avx2"))
+            kernel = AVX2_KERNEL;
+        else if (__builtin_cpu_supports("sse4.2"))
+            kernel = SSE4_KERNEL;
+#endif
+        const char * requested = std::getenv("PORECHOP_LANE_KERNEL");
+        if (requested != nullptr) {
+            std::string requestedKernel = requested;
+            if (requestedKernel == "none")
+                kernel = NO_LANES;
+            else if (requestedKernel == "default")
+                kernel = DEFAULT_KERNEL;
+            else if (requestedKernel == "sse4.2")
+                kernel = std::min(kernel, SSE4_KERNEL);
+        }
+        return kernel;
+    }();
+    return laneKernel;
+}
+
+
+// Aligns each read to the adapter (see LaneAligner::alignReads) with the widest lanes that the
+// CPU supports. Each thread keeps its own DP rows from one call to the next.
+void alignReadsInLanes(const std::string * const * reads, int readCount,
+                       const std::string & adapter, int matchScore, int mismatchScore,
+                       int gapOpenScore, int gapExtensionScore,
+                       AlignmentResult * const * results) {
+    LaneKernel kernel = getLaneKernel();
+    if (kernel == NO_LANES) {
+        PathAligner aligner(matchScore, mismatchScore, gapOpenScore, gapExtensionScore);
+        for (int i = 0; i < readCount; ++i)
+            aligner.align(reads[i]->c_str(), int(reads[i]->size()), adapter.c_str(),
+                          int(adapter.size()), *results[i]);
+        return;
+    }
+#ifdef LANE_DISPATCH
+    if (kernel == AVX2_KERNEL) {
+        static thread_local LaneWorkspace<EightLanes> workspace;
+        LaneAligner<EightLanes> aligner(matchScore, mismatchScore, gapOpenScore,
+                                        gapExtensionScore, fillAvx2Rows, workspace);
+        aligner.alignReads(reads, readCount, adapter, results);
+        return;
+    }
+#endif
+    static thread_local LaneWorkspace<FourLanes> workspace;
+    LaneAligner<FourLanes>::FillFunction fillRows = fillDefaultRows;
+#ifdef LANE_DISPATCH
+    if (kernel == SSE4_KERNEL)
+        fillRows = fillSse4Rows;
+#endif
+    LaneAligner<FourLanes> aligner(matchScore, mismatchScore, gapOpenScore, gapExtensionScore,
+                                   fillRows, workspace);
+    aligner.alignReads(reads, readCount, adapter, results);
+}
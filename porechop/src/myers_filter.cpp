@@ -0,0 +1,124 @@
+#include "myers_filter.h"
+#include "path_alignment.h"
+
+#include <algorithm>
+#include <cstdint>
+
+
+MyersFilter::MyersFilter(const char * adapterSeq) :
+    m_forwardPeq{0, 0, 0, 0, 0}, m_reversePeq{0, 0, 0, 0, 0}
+{
+    std::string adapter = encodeBases(adapterSeq);
+    m_adapterLength = int(adapter.size());
+    if (m_adapterLength > MAX_ADAPTER_LENGTH)
+        return;
+    for (int i = 0; i < m_adapterLength; ++i) {
+        m_forwardPeq[int(adapter[i])] |= uint64_t(1) << i;
+        m_reversePeq[int(adapter[m_adapterLength - i - 1])] |= uint64_t(1) << i;
+    }
+}
+
+
+// Returns false only if no alignment of the adapter to the read can have an aligned region with
+// more than minIdentity percent identity and at least minReadBases read bases in it. The read must
+// already be encoded with encodeBases and also given reversed. Adapters which are too long for a
+// single machine word always pass.
+bool MyersFilter::canReachIdentity(const std::string & read, const std::string & reverseRead,
+                                   double minIdentity, int minReadBases) const {
+    int adapterLength = m_adapterLength;
+    int readLength = int(read.size());
+    if (adapterLength == 0 || adapterLength > MAX_ADAPTER_LENGTH || readLength == 0)
+        return true;
+
+    // A small allowance is taken off the threshold, as the identities are compared after rounding.
+    double identityFraction = (minIdentity - 0.0001) / 100.0;
+    if (identityFraction <= 0.0)
+        return true;
+
+    // The whole read against part of the adapter: the read bases the adapter doesn't cover all
+    // cost an edit.
+    if (possibleIdentity(adapterLength, std::max(readLength - adapterLength, 0),
+                         identityFraction))
+        return true;
+
+    MyersDistances forward = getDistances(m_forwardPeq, read);
+
+    // The whole adapter against part of the read.
+    if (possibleIdentity(adapterLength, forward.bestFullAdapterDistance, identityFraction))
+        return true;
+
+    // An adapter prefix against a read suffix, then (by reversing both sequences) an adapter
+    // suffix against a read prefix. A region with fewer adapter bases than minReadBases has at
+    // least that difference in read gaps.
+    MyersDistances reverse = getDistances(m_reversePeq, reverseRead);
+    for (int i = 1; i <= adapterLength; ++i) {
+        int minGaps = minReadBases - i;
+        if (possibleIdentity(i, std::max(forward.prefixEndDistances[i-1], minGaps),
+                             identityFraction) ||
+            possibleIdentity(i, std::max(reverse.prefixEndDistances[i-1], minGaps),
+                             identityFraction))
+            return true;
+    }
+    return false;
+}
+
+
+// Returns an upper bound on the full adapter identity (as a percentage) of any alignment of the
+// adapter to the read, which must already be encoded with encodeBases. An alignment with e edits
+// (including unaligned adapter bases) and i read bases inserted in the adapter has an identity of
+// (length + i - e) / (length + i), and i can't be more than e, so it's at most
+// length / (length + the adapter's edit distance in the read).
+double MyersFilter::maxFullAdapterIdentity(const std::string & read) const {
+    int adapterLength = m_adapterLength;
+    if (adapterLength == 0 || adapterLength > MAX_ADAPTER_LENGTH)
+        return 100.0;
+    int distance = getDistances(m_forwardPeq, read).bestFullAdapterDistance;
+    return 100.0 * adapterLength / (adapterLength + distance);
+}
+
+
+// An aligned region with this many adapter bases (an upper bound on its matches) and this edit
+// distance has an identity of at most adapterBases / (adapterBases + editDistance).
+bool MyersFilter::possibleIdentity(int adapterBases, int editDistance, double identityFraction) {
+    return adapterBases * (1.0 - identityFraction) > editDistance * identityFraction;
+}
+
+
+// Myers' bit-parallel algorithm, as described by Hyyrö, with the pattern (adapter) allowed to start
+// at any read position, using the adapter's bit masks in peq (forwards or reversed, to match the
+// read). Bit i of the vertical delta vectors describes row i+1 of the DP column.
+MyersDistances MyersFilter::getDistances(const uint64_t * peq, const std::string & read) const {
+    int adapterLength = m_adapterLength;
+    uint64_t lastRowBit = uint64_t(1) << (adapterLength - 1);
+    uint64_t pv = ~uint64_t(0), mv = 0;
+    int score = adapterLength;
+    int bestScore = adapterLength;
+    for (char base : read) {
+        uint64_t eq = peq[int(base)];
+        uint64_t xv = eq | mv;
+        uint64_t xh = (((eq & pv) + pv) ^ pv) | eq;
+        uint64_t ph = mv | ~(xh | pv);
+        uint64_t mh = pv & xh;
+        if (ph & lastRowBit)
+            ++score;
+        else if (mh & lastRowBit)
+            --score;
+        bestScore = std::min(bestScore, score);
+
+        // The top row is all zeros (the adapter can start anywhere), so no 1 is shifted in.
+        ph <<= 1;
+        mh <<= 1;
+        pv = mh | ~(xv | ph);
+        mv = ph & xv;
+    }
+
+    MyersDistances distances;
+    distances.bestFullAdapterDistance = bestScore;
+    distances.prefixEndDistances.resize(adapterLength);
+    int distance = 0;
+    for (int i = 0; i < adapterLength; ++i) {
+        distance += int((pv >> i) & 1) - int((mv >> i) & 1);
+        distances.prefixEndDistances[i] = distance;
+    }
+    return distances;
+}
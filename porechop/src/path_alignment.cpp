@@ -0,0 +1,471 @@
+#include "path_alignment.h"
+
+#include <algorithm>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+
+
+// Masked read bases get the same value as the '-' characters Porechop used to mask hits with.
+static const char MASKED_BASE = 4;
+
+
+PathAligner::PathAligner(int matchScore, int mismatchScore, int gapOpenScore,
+                         int gapExtensionScore):
+    m_matchScore(matchScore), m_mismatchScore(mismatchScore),
+    m_gapOpenScore(gapOpenScore), m_gapExtensionScore(gapExtensionScore)
+{
+}
+
+
+// Both sequences must already be encoded with encodeBases and be non-empty. The DP is filled one
+// adapter base (row) at a time, keeping only the current row. The best cell in the last row or
+// last column is chosen in the same order that SeqAn scans its matrix (column by column), with the
+// first of any equal scores winning.
+template <typename Counts>
+PathEnd<Counts> PathAligner::findBestPath(const char * readSeq, int readLength,
+                                          const char * adapterSeq, int adapterLength,
+                                          PathMatrixRows<Counts> & rows) {
+    int columns = readLength + 1;
+    const int matchScore = m_matchScore, mismatchScore = m_mismatchScore;
+    const int gapOpenScore = m_gapOpenScore, gapExtensionScore = m_gapExtensionScore;
+    const int linearGaps = (gapOpenScore == gapExtensionScore);
+    rows.diagonalScores.assign(columns, 0);
+    rows.verticalScores.assign(columns, MIN_SCORE);
+    rows.diagonalCounts.resize(columns);
+    rows.verticalCounts.resize(columns);
+    rows.lastRowMoves.assign(columns, NO_MOVE);
+    rows.lastColumnScores.resize(adapterLength + 1);
+    rows.lastColumnCounts.resize(adapterLength + 1);
+    rows.lastColumnMoves.resize(adapterLength + 1);
+
+    int * diagonalScores = rows.diagonalScores.data();
+    int * verticalScores = rows.verticalScores.data();
+    Counts * diagonalCounts = rows.diagonalCounts.data();
+    Counts * verticalCounts = rows.verticalCounts.data();
+
+    // The first row is free: the path can start at any read position.
+    for (int j = 0; j < columns; ++j)
+        diagonalCounts[j] = Counts::atStart(j, 0);
+    rows.lastColumnScores[0] = 0;
+    rows.lastColumnCounts[0] = diagonalCounts[readLength];
+    rows.lastColumnMoves[0] = NO_MOVE;
+
+    for (int i = 1; i <= adapterLength; ++i) {
+        char adapterBase = adapterSeq[i-1];
+        bool lastRow = (i == adapterLength);
+
+        // The first column is also free: the path can start at any adapter position.
+        int upLeftScore = diagonalScores[0];
+        Counts upLeftCounts = diagonalCounts[0];
+        diagonalScores[0] = 0;
+        diagonalCounts[0] = Counts::atStart(0, i);
+
+        int horizontalScore = MIN_SCORE;
+        Counts horizontalCounts = diagonalCounts[0];
+        PathMove move = NO_MOVE;
+
+        // Computes one cell. endCell is only true for the last row and column, so it's a constant
+        // for each call and the compiler can drop that part for the other cells.
+        auto computeCell = [&](int j, bool endCell) {
+            int upScore = diagonalScores[j];
+            Counts upCounts = diagonalCounts[j];
+
+            // Gap in the adapter (moving along the read). Like SeqAn, an extension is preferred
+            // to an opening when they score the same, except with linear gaps where SeqAn has no
+            // separate gap matrices. The selections are written as conditional expressions so
+            // they can compile without branches.
+            int openScore = diagonalScores[j-1] + gapOpenScore;
+            horizontalScore += gapExtensionScore;
+            bool open = horizontalScore < openScore + linearGaps;
+            horizontalScore = open ? openScore : horizontalScore;
+            horizontalCounts = open ? diagonalCounts[j-1] : horizontalCounts;
+            horizontalCounts.addReadGap();
+
+            // Gap in the read (moving along the adapter).
+            openScore = upScore + gapOpenScore;
+            int verticalScore = verticalScores[j] + gapExtensionScore;
+            open = verticalScore < openScore + linearGaps;
+            verticalScore = open ? openScore : verticalScore;
+            Counts verticalPathCounts = open ? upCounts : verticalCounts[j];
+            verticalPathCounts.addAdapterGap();
+            verticalScores[j] = verticalScore;
+            verticalCounts[j] = verticalPathCounts;
+
+            // SeqAn prefers vertical to horizontal and diagonal to either gap.
+            bool match = (adapterBase == readSeq[j-1]);
+            int score = upLeftScore + (match ? matchScore : mismatchScore);
+            upLeftCounts.addDiagonal(match);
+            bool horizontal = verticalScore < horizontalScore;
+            int gapScore = horizontal ? horizontalScore : verticalScore;
+            bool gap = score < gapScore;
+            score = gap ? gapScore : score;
+            Counts counts = gap ? (horizontal ? horizontalCounts : verticalPathCounts) :
+                                  upLeftCounts;
+
+            // Where the alignment can end, the move into the cell is needed for the result.
+            // SeqAn's affine traceback starts with a gap instead of the diagonal when they tie
+            // there. Changing these cells doesn't affect any other optimal path, as a path never
+            // continues on from them.
+            if (endCell) {
+                move = gap ? (horizontal ? HORIZONTAL_MOVE : VERTICAL_MOVE) : DIAGONAL_MOVE;
+                if (!linearGaps && verticalScore == score)
+                    move = VERTICAL_MOVE;
+                else if (!linearGaps && horizontalScore == score)
+                    move = HORIZONTAL_MOVE;
+                if (move == VERTICAL_MOVE)
+                    counts = verticalPathCounts;
+                else if (move == HORIZONTAL_MOVE)
+                    counts = horizontalCounts;
+                if (lastRow)
+                    rows.lastRowMoves[j] = move;
+            }
+
+            diagonalScores[j] = score;
+            diagonalCounts[j] = counts;
+            upLeftScore = upScore;
+            upLeftCounts = upCounts;
+        };
+
+        if (lastRow) {
+            for (int j = 1; j < columns; ++j)
+                computeCell(j, true);
+        }
+        else {
+            for (int j = 1; j < readLength; ++j)
+                computeCell(j, false);
+            computeCell(readLength, true);
+        }
+        rows.lastColumnScores[i] = diagonalScores[readLength];
+        rows.lastColumnCounts[i] = diagonalCounts[readLength];
+        rows.lastColumnMoves[i] = move;
+    }
+
+    // Find the best cell in the last row (excluding the last column) and then the last column.
+    PathEnd<Counts> best{MIN_SCORE, 0, 0, Counts::atStart(0, 0), NO_MOVE};
+    for (int j = 0; j < readLength; ++j) {
+        if (diagonalScores[j] > best.score)
+            best = PathEnd<Counts>{diagonalScores[j], j, adapterLength, diagonalCounts[j],
+                                   rows.lastRowMoves[j]};
+    }
+    for (int i = 0; i <= adapterLength; ++i) {
+        if (rows.lastColumnScores[i] > best.score)
+            best = PathEnd<Counts>{rows.lastColumnScores[i], readLength, i,
+                                   rows.lastColumnCounts[i], rows.lastColumnMoves[i]};
+    }
+    return best;
+}
+
+
+// Gets the read start and end positions (inclusive) of the best path, the same as ScoredAlignment
+// gets them from the alignment strings.
+template <typename Counts>
+static void getReadRange(const PathEnd<Counts> & best, int & readStart, int & readEnd) {
+    readStart = best.counts.startRead;
+
+    // The alignment ends at the last position where both sequences have had a base. Ending with a
+    // gap is only possible when the other sequence continues past the end cell.
+    if (best.lastMove == DIAGONAL_MOVE || best.lastMove == HORIZONTAL_MOVE)
+        readEnd = best.readPos - 1;
+    else if (best.lastMove == VERTICAL_MOVE)
+        readEnd = best.readPos;
+
+    // If the path never left the first row or column, the two sequences don't overlap at all.
+    else if (best.adapterPos == 0) {
+        readStart = best.readPos;
+        readEnd = best.readPos - 1;
+    }
+    else
+        readEnd = 0;
+}
+
+
+// Fills in the result with the same values that ScoredAlignment gets from the alignment strings.
+void PathAligner::align(const char * readSeq, int readLength,
+                        const char * adapterSeq, int adapterLength, AlignmentResult & result) {
+    result.readStartPos = -1;
+    result.readEndPos = -1;
+    result.adapterStartPos = -1;
+    result.adapterEndPos = -1;
+    result.rawScore = 0;
+    result.alignedRegionPercentIdentity = 0.0;
+    result.fullAdapterPercentIdentity = 0.0;
+    if (readLength == 0 || adapterLength == 0)
+        return;
+
+    PathEnd<PathCounts> best = findBestPath(readSeq, readLength, adapterSeq, adapterLength,
+                                            m_pathRows);
+    fillAlignmentResult(best, adapterLength, result);
+}
+
+
+// Fills in the result for the best path of a non-empty alignment, with the same values that
+// ScoredAlignment gets from the alignment strings.
+void fillAlignmentResult(const PathEnd<PathCounts> & best, int adapterLength,
+                         AlignmentResult & result) {
+    const PathCounts & counts = best.counts;
+    result.rawScore = best.score;
+    result.adapterStartPos = counts.startAdapter;
+    getReadRange(best, result.readStartPos, result.readEndPos);
+
+    // The adapter end follows the same rules as the read end in getReadRange.
+    if (best.lastMove == DIAGONAL_MOVE || best.lastMove == VERTICAL_MOVE)
+        result.adapterEndPos = best.adapterPos - 1;
+    else if (best.lastMove == HORIZONTAL_MOVE)
+        result.adapterEndPos = best.adapterPos;
+    else if (best.adapterPos == 0)
+        result.adapterEndPos = 0;
+    else {
+        result.adapterStartPos = best.adapterPos;
+        result.adapterEndPos = best.adapterPos - 1;
+    }
+
+    int alignedRegionLength = counts.diagonals + counts.readGaps + counts.adapterGaps;
+    result.alignedRegionPercentIdentity = 100.0 * counts.matches / alignedRegionLength;
+    int fullAdapterLength = adapterLength + counts.readGaps;
+    result.fullAdapterPercentIdentity = 100.0 * counts.matches / fullAdapterLength;
+}
+
+
+// The same as the fullAdapterPercentIdentity from align, but quicker as fewer counts are needed.
+double PathAligner::fullAdapterIdentity(const char * readSeq, int readLength,
+                                        const char * adapterSeq, int adapterLength) {
+    if (readLength == 0 || adapterLength == 0)
+        return 0.0;
+    PathEnd<IdentityCounts> best = findBestPath(readSeq, readLength, adapterSeq, adapterLength,
+                                                m_identityRows);
+    const IdentityCounts & counts = best.counts;
+    return 100.0 * counts.matches() / (adapterLength + counts.readGaps());
+}
+
+
+MiddleAdapterFinder::MiddleAdapterFinder(int matchScore, int mismatchScore, int gapOpenScore,
+                                         int gapExtensionScore):
+    m_matchScore(matchScore), m_mismatchScore(mismatchScore),
+    m_gapOpenScore(gapOpenScore), m_gapExtensionScore(gapExtensionScore)
+{
+}
+
+
+// Finds up to maxHits hits with a full adapter identity of at least the threshold, best first,
+// and returns how many were found. Each hit is masked out of the read before finding the next.
+int MiddleAdapterFinder::findHits(const char * readSeq, const char * adapterSeq, double threshold,
+                                  int maxHits, MiddleAdapterHit * hits) {
+    m_read = encodeBases(readSeq);
+    m_adapter = encodeBases(adapterSeq);
+    int readLength = int(m_read.size());
+    int adapterLength = int(m_adapter.size());
+    if (readLength == 0 || adapterLength == 0)
+        return 0;
+
+    int rows = adapterLength + 1;
+    ColumnCell firstColumnCell{0, MIN_SCORE, HitCounts::atStart(0, 0), HitCounts::atStart(0, 0)};
+    m_column.assign(rows, firstColumnCell);
+    m_checkpoints.resize((readLength / CHECKPOINT_INTERVAL + 1) * rows);
+    std::copy(m_column.begin(), m_column.end(), m_checkpoints.begin());
+    m_lastRowScores.assign(readLength + 1, 0);
+    m_lastRowCounts.assign(readLength + 1, HitCounts::atStart(0, adapterLength));
+    m_lastRowMoves.assign(readLength + 1, NO_MOVE);
+    m_lastColumnScores.assign(rows, 0);
+    m_lastColumnCounts.assign(rows, HitCounts::atStart(readLength, 0));
+    m_lastColumnMoves.assign(rows, NO_MOVE);
+    fillColumns(1, readLength + 1);
+
+    int hitCount = 0;
+    while (hitCount < maxHits) {
+        PathEnd<HitCounts> best = findBestHit();
+        int readStart, readEnd;
+        getReadRange(best, readStart, readEnd);
+        double identity = 100.0 * best.counts.matches / (adapterLength + best.counts.readGaps);
+        identity = roundLikeString(identity);
+        if (identity < threshold)
+            break;
+
+        // A hit which covers no unmasked read bases (only possible with a threshold of 0, as
+        // masked bases never match) isn't a new hit, and masking it wouldn't change the read, so
+        // it would just be found again.
+        if (std::count(m_read.begin() + readStart, m_read.begin() + readEnd + 1, MASKED_BASE) ==
+                readEnd - readStart + 1)
+            break;
+        hits[hitCount++] = MiddleAdapterHit{readStart, readEnd, identity};
+        for (int i = readStart; i <= readEnd; ++i)
+            m_read[i] = MASKED_BASE;
+        fillColumns(readStart + 1, readEnd + 1);
+    }
+    return hitCount;
+}
+
+
+// Computes the columns from firstChangedColumn onwards, starting from the last checkpoint before
+// it. Once past lastChangedColumn, it stops at the first checkpoint which hasn't changed.
+void MiddleAdapterFinder::fillColumns(int firstChangedColumn, int lastChangedColumn) {
+    int readLength = int(m_read.size());
+    int rows = int(m_adapter.size()) + 1;
+    int checkpoint = (firstChangedColumn - 1) / CHECKPOINT_INTERVAL;
+    auto checkpointCells = m_checkpoints.begin() + checkpoint * rows;
+    std::copy(checkpointCells, checkpointCells + rows, m_column.begin());
+
+    for (int j = checkpoint * CHECKPOINT_INTERVAL + 1; j <= readLength; ++j) {
+        computeColumn(j);
+        if (j % CHECKPOINT_INTERVAL == 0) {
+            checkpointCells = m_checkpoints.begin() + (j / CHECKPOINT_INTERVAL) * rows;
+            if (j >= lastChangedColumn && std::equal(m_column.begin(), m_column.end(),
+                                                     checkpointCells))
+                return;
+            std::copy(m_column.begin(), m_column.end(), checkpointCells);
+        }
+    }
+}
+
+
+// Replaces column j-1 with column j. This does the same per-cell work as findBestPath, just in the
+// other direction, so the paths and their ties come out the same.
+void MiddleAdapterFinder::computeColumn(int j) {
+    const int matchScore = m_matchScore, mismatchScore = m_mismatchScore;
+    const int gapOpenScore = m_gapOpenScore, gapExtensionScore = m_gapExtensionScore;
+    const int linearGaps = (gapOpenScore == gapExtensionScore);
+    int adapterLength = int(m_adapter.size());
+    bool lastColumn = (j == int(m_read.size()));
+    char readBase = m_read[j-1];
+    const char * adapterSeq = m_adapter.data();
+    ColumnCell * column = m_column.data();
+
+    // The first row is free: the path can start at any read position.
+    int upLeftScore = column[0].diagonalScore;
+    HitCounts upLeftCounts = column[0].diagonalCounts;
+    column[0].diagonalCounts = HitCounts::atStart(j, 0);
+    int verticalScore = MIN_SCORE;
+    HitCounts verticalCounts = column[0].diagonalCounts;
+    if (lastColumn) {
+        m_lastColumnScores[0] = 0;
+        m_lastColumnCounts[0] = column[0].diagonalCounts;
+        m_lastColumnMoves[0] = NO_MOVE;
+    }
+
+    for (int i = 1; i <= adapterLength; ++i) {
+        ColumnCell & cell = column[i];
+
+        // Gap in the adapter (moving along the read).
+        int openScore = cell.diagonalScore + gapOpenScore;
+        int horizontalScore = cell.horizontalScore + gapExtensionScore;
+        bool open = horizontalScore < openScore + linearGaps;
+        horizontalScore = open ? openScore : horizontalScore;
+        HitCounts horizontalCounts = open ? cell.diagonalCounts : cell.horizontalCounts;
+        horizontalCounts.addReadGap();
+
+        // Gap in the read (moving along the adapter).
+        openScore = column[i-1].diagonalScore + gapOpenScore;
+        verticalScore += gapExtensionScore;
+        open = verticalScore < openScore + linearGaps;
+        verticalScore = open ? openScore : verticalScore;
+        verticalCounts = open ? column[i-1].diagonalCounts : verticalCounts;
+        verticalCounts.addAdapterGap();
+
+        bool match = (adapterSeq[i-1] == readBase);
+        int score = upLeftScore + (match ? matchScore : mismatchScore);
+        HitCounts counts = upLeftCounts;
+        counts.addDiagonal(match);
+        upLeftScore = cell.diagonalScore;
+        upLeftCounts = cell.diagonalCounts;
+        bool horizontal = verticalScore < horizontalScore;
+        int gapScore = horizontal ? horizontalScore : verticalScore;
+        bool gap = score < gapScore;
+        score = gap ? gapScore : score;
+        counts = gap ? (horizontal ? horizontalCounts : verticalCounts) : counts;
+
+        bool lastRow = (i == adapterLength);
+        if (lastRow || lastColumn) {
+            PathMove move = gap ? (horizontal ? HORIZONTAL_MOVE : VERTICAL_MOVE) : DIAGONAL_MOVE;
+            if (!linearGaps && verticalScore == score)
+                move = VERTICAL_MOVE;
+            else if (!linearGaps && horizontalScore == score)
+                move = HORIZONTAL_MOVE;
+            if (move == VERTICAL_MOVE)
+                counts = verticalCounts;
+            else if (move == HORIZONTAL_MOVE)
+                counts = horizontalCounts;
+            if (lastRow) {
+                m_lastRowScores[j] = score;
+                m_lastRowCounts[j] = counts;
+                m_lastRowMoves[j] = move;
+            }
+            if (lastColumn) {
+                m_lastColumnScores[i] = score;
+                m_lastColumnCounts[i] = counts;
+                m_lastColumnMoves[i] = move;
+            }
+        }
+
+        cell.diagonalScore = score;
+        cell.horizontalScore = horizontalScore;
+        cell.diagonalCounts = counts;
+        cell.horizontalCounts = horizontalCounts;
+    }
+}
+
+
+// Scans the last row and column in the same order as findBestPath.
+PathEnd<HitCounts> MiddleAdapterFinder::findBestHit() const {
+    int readLength = int(m_read.size());
+    int adapterLength = int(m_adapter.size());
+    PathEnd<HitCounts> best{MIN_SCORE, 0, 0, HitCounts::atStart(0, 0), NO_MOVE};
+    for (int j = 0; j < readLength; ++j) {
+        if (m_lastRowScores[j] > best.score)
+            best = PathEnd<HitCounts>{m_lastRowScores[j], j, adapterLength, m_lastRowCounts[j],
+                                      m_lastRowMoves[j]};
+    }
+    for (int i = 0; i <= adapterLength; ++i) {
+        if (m_lastColumnScores[i] > best.score)
+            best = PathEnd<HitCounts>{m_lastColumnScores[i], readLength, i, m_lastColumnCounts[i],
+                                      m_lastColumnMoves[i]};
+    }
+    return best;
+}
+
+
+// Converts a sequence to SeqAn's Dna5 values (0 to 4), so bases compare the same way as they do in
+// the SeqAn alignments (e.g. lowercase and U are handled, and N matches N).
+std::string encodeBases(const char * seq) {
+    return encodeBases(seq, int(strlen(seq)));
+}
+
+std::string encodeBases(const char * seq, int length) {
+    std::string encoded(seq, length);
+    for (auto & base : encoded)
+        base = char(ordValue(Dna5(base)));
+    return encoded;
+}
+
+
+// Gets the full adapter identity of one read sequence against many adapters. This is all that
+// adapter discovery needs, so it skips the traceback which alignAdapter does.
+void adapterIdentityBatch(char * readSeq, char ** adapterSeqs, int adapterCount,
+                          int matchScore, int mismatchScore, int gapOpenScore,
+                          int gapExtensionScore, double * identities) {
+    PathAligner aligner(matchScore, mismatchScore, gapOpenScore, gapExtensionScore);
+    std::string read = encodeBases(readSeq);
+    for (int i = 0; i < adapterCount; ++i) {
+        std::string adapter = encodeBases(adapterSeqs[i]);
+        identities[i] = aligner.fullAdapterIdentity(read.c_str(), int(read.size()),
+                                                    adapter.c_str(), int(adapter.size()));
+    }
+}
+
+
+// Rounds an identity the same way as it is when it goes through ScoredAlignment::getString (which
+// uses std::to_string), so it compares to thresholds the same way in Python.
+double roundLikeString(double value) {
+    char buffer[512];
+    snprintf(buffer, sizeof(buffer), "%f", value);
+    return strtod(buffer, nullptr);
+}
+
+
+// Finds all hits for an adapter in a read (see MiddleAdapterFinder). The hits array must have room
+// for maxHits hits.
+int middleAdapterHits(char * readSeq, char * adapterSeq, int matchScore, int mismatchScore,
+                      int gapOpenScore, int gapExtensionScore, double threshold, int maxHits,
+                      MiddleAdapterHit * hits) {
+    MiddleAdapterFinder finder(matchScore, mismatchScore, gapOpenScore, gapExtensionScore);
+    return finder.findHits(readSeq, adapterSeq, threshold, maxHits, hits);
+}
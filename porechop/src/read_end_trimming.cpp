@@ -0,0 +1,84 @@
+#include "read_end_trimming.h"
+
+#include <algorithm>
+#include <vector>
+#include "path_alignment.h"
+
+
+// Finds the adapters at both ends of a batch of reads. Read i is seqs[seqOffsets[i]] up to
+// seqOffsets[i+1]. The calls and results arrays have an entry for each read and adapter, at
+// read * adapter count + adapter. The read ends are taken the same way as Python slices them
+// (seq[:end_size] and seq[-end_size:]), so a long read can be given as just its two ends.
+void trimReadEnds(AdapterProfileSet * startProfiles, AdapterProfileSet * endProfiles,
+                  char * seqs, int64_t * seqOffsets, int readCount, int endSize,
+                  int extraTrimSize, double endThreshold, int minTrimSize,
+                  ReadEndTrims * trims, int * startCalls, AlignmentResult * startResults,
+                  int * endCalls, AlignmentResult * endResults) {
+    EndTrimSettings settings{endSize, extraTrimSize, endThreshold, minTrimSize};
+    std::vector<std::string> readStarts(readCount), readEnds(readCount);
+    for (int i = 0; i < readCount; ++i) {
+        const char * seq = seqs + seqOffsets[i];
+        int seqLength = int(seqOffsets[i + 1] - seqOffsets[i]);
+        int startLength = std::min(endSize, seqLength);
+        int endLength = (endSize > 0) ? std::min(endSize, seqLength) : seqLength;
+        readStarts[i] = encodeBases(seq, startLength);
+        readEnds[i] = encodeBases(seq + seqLength - endLength, endLength);
+    }
+
+    int startCount = startProfiles->adapterCount();
+    int endCount = endProfiles->adapterCount();
+    startProfiles->alignReadEnds(readStarts.data(), readCount, startCalls, startResults);
+    endProfiles->alignReadEnds(readEnds.data(), readCount, endCalls, endResults);
+
+    // The prefilter set each call to NOT_ALIGNED (0) or ALIGNED (1), so now the aligned ones are
+    // checked for whether they trim the read.
+    for (int i = 0; i < readCount; ++i) {
+        ReadEndTrims & readTrims = trims[i];
+        readTrims.startTrimAmount = 0;
+        readTrims.endTrimAmount = 0;
+        for (int j = i * startCount; j < (i + 1) * startCount; ++j) {
+            int trimAmount = startCalls[j] ? getTrimAmount(startResults[j], true, settings)
+                                           : -1;
+            if (trimAmount >= 0) {
+                startCalls[j] = TRIMMED;
+                readTrims.startTrimAmount = std::max(readTrims.startTrimAmount, trimAmount);
+            }
+        }
+        for (int j = i * endCount; j < (i + 1) * endCount; ++j) {
+            int trimAmount = endCalls[j] ? getTrimAmount(endResults[j], false, settings)
+                                         : -1;
+            if (trimAmount >= 0) {
+                endCalls[j] = TRIMMED;
+                readTrims.endTrimAmount = std::max(readTrims.endTrimAmount, trimAmount);
+            }
+        }
+    }
+}
+
+
+// Returns how much an adapter alignment at the start or end of a read trims from it, or -1 if it
+// doesn't. This uses the alignment values that Python gets from get_alignment_values (rounded
+// identities and an exclusive read end), so the decisions are the same as they would be there.
+int getTrimAmount(const AlignmentResult & result, bool readStart,
+                  const EndTrimSettings & settings) {
+    int alignmentStart = result.readStartPos;
+    int alignmentEnd = 0;
+    double partialIdentity = 0.0;
+    if (alignmentStart != -1) {
+        alignmentEnd = result.readEndPos + 1;
+        partialIdentity = roundLikeString(result.alignedRegionPercentIdentity);
+    }
+    if (!(partialIdentity > settings.endThreshold) ||
+            alignmentEnd - alignmentStart < settings.minTrimSize)
+        return -1;
+
+    // An alignment which reaches the inner edge of the read end doesn't trim it.
+    if (readStart) {
+        if (alignmentEnd == settings.endSize)
+            return -1;
+        return alignmentEnd + settings.extraTrimSize;
+    }
+    if (alignmentStart == 0)
+        return -1;
+    return (settings.endSize - alignmentStart) + settings.extraTrimSize;
+}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This script measures how much memory each NanoporeRead takes. It builds many random reads in one
+go (as Porechop does when it loads its input) and uses tracemalloc to count the memory allocated
+per read: the read object along with its upper-cased sequence and qualities. The input strings are
+made before measuring starts, so they aren't counted. To compare versions of Porechop, run it from
+the root Porechop directory of each.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from porechop.nanopore_read import NanoporeRead  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory used per NanoporeRead')
+    parser.add_argument('--read_count', type=int, default=20000,
+                        help='Number of reads to build')
+    parser.add_argument('--read_length', type=int, default=1000,
+                        help='Length of each read')
+    args = parser.parse_args()
+
+    for read_type in ['FASTQ', 'FASTA']:
+        bytes_per_read = measure_read_memory(read_type, args.read_count, args.read_length)
+        print(read_type + ': ' + '{:,}'.format(round(bytes_per_read)) + ' bytes/read')
+
+
+def measure_read_memory(read_type, read_count, read_length):
+    """
+    Returns the mean number of bytes allocated for each read. The sequences are made in lowercase
+    so the upper-cased copy each read keeps is a new string, as it is for real input.
+    """
+    rng = random.Random(0)
+    seqs = [''.join(rng.choice('acgt') for _ in range(read_length)) for _ in range(read_count)]
+    if read_type == 'FASTQ':
+        quals = [''.join(rng.choice('+,-./0123456789') for _ in range(read_length))
+                 for _ in range(read_count)]
+    else:
+        quals = [''] * read_count
+    names = ['read_' + str(i + 1) for i in range(read_count)]
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    reads = [NanoporeRead(name, seq, qual) for name, seq, qual in zip(names, seqs, quals)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The list holding the reads is counted too, but that is only 8 bytes per read.
+    assert len(reads) == read_count
+    return (after - before) / read_count
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This script measures how long Porechop takes to load FASTA and FASTQ files, and the peak memory
+it allocates while doing so (with tracemalloc, in a separate pass so it doesn't slow the timing).
+The files are written to a temporary directory first: many short reads, many wrapped long reads
+and one very long read (which spans many of the blocks the files are read in). To compare
+versions of Porechop, run it from the root Porechop directory of each.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from porechop.misc import load_fasta_or_fastq  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the time and memory to load reads')
+    parser.add_argument('--long_read_length', type=int, default=120000000,
+                        help='Length of the single very long read')
+    parser.add_argument('--line_length', type=int, default=80,
+                        help='Line length for wrapped FASTA')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    read_sets = [('short reads', [random_seq(1000, rng) for _ in range(50000)]),
+                 ('long reads', [random_seq(8000000, rng) for _ in range(20)]),
+                 ('one very long read', [random_seq(args.long_read_length, rng)])]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, seqs in read_sets:
+            paths = [(os.path.join(temp_dir, 'reads.fastq'), 'FASTQ'),
+                     (os.path.join(temp_dir, 'reads.fasta'), 'FASTA (unwrapped)'),
+                     (os.path.join(temp_dir, 'reads_wrapped.fasta'), 'FASTA (wrapped)')]
+            write_fastq(paths[0][0], seqs)
+            write_fasta(paths[1][0], seqs, None)
+            write_fasta(paths[2][0], seqs, args.line_length)
+            for path, file_type in paths:
+                seconds, peak_bytes = measure_loading(path)
+                print(name + ', ' + file_type + ': ' + '{:.2f}'.format(seconds) + ' s, ' +
+                      '{:,}'.format(round(peak_bytes / 1000000)) + ' MB peak')
+                os.remove(path)
+
+
+def random_seq(length, rng):
+    return ''.join(rng.choices('ACGT', k=length))
+
+
+def write_fastq(path, seqs):
+    with open(path, 'wt') as fastq:
+        for i, seq in enumerate(seqs):
+            fastq.write('@read_' + str(i + 1) + '\n' + seq + '\n+\n' + 'I' * len(seq) + '\n')
+
+
+def write_fasta(path, seqs, line_length):
+    with open(path, 'wt') as fasta:
+        for i, seq in enumerate(seqs):
+            fasta.write('>read_' + str(i + 1) + '\n')
+            if line_length is None:
+                fasta.write(seq + '\n')
+            else:
+                for j in range(0, len(seq), line_length):
+                    fasta.write(seq[j:j + line_length] + '\n')
+
+
+def measure_loading(path):
+    """
+    Returns the time taken to load the file and the peak memory allocated while loading it.
+    """
+    start_time = time.time()
+    reads, _ = load_fasta_or_fastq(path)
+    seconds = time.time() - start_time
+    del reads
+
+    tracemalloc.start()
+    reads, _ = load_fasta_or_fastq(path)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del reads
+    return seconds, peak_bytes
+
+
+if __name__ == '__main__':
+    main()
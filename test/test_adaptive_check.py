@@ -0,0 +1,82 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from porechop.adapters import Adapter
+from porechop.porechop import adapter_set_search_is_settled, count_near_threshold_scores
+
+
+THRESHOLD = 90.0
+
+
+def make_adapter_set(name, best_start_score=0.0, best_end_score=0.0):
+    adapter_set = Adapter(name, start_sequence=(name + '_start', 'ACGTACGTACGT'),
+                          end_sequence=(name + '_end', 'TGCATGCATGCA'))
+    adapter_set.best_start_score, adapter_set.best_end_score = best_start_score, best_end_score
+    return adapter_set
+
+
+class TestAdaptiveCheck(unittest.TestCase):
+    """
+    Tests the rule for stopping --adaptive_check early. With the default settings, an adapter set
+    in 0.1% of reads has a less than 5% chance of being missed in all of 2995 or more reads.
+    """
+    def setUp(self):
+        self.found = make_adapter_set('found', best_start_score=95.0)
+        self.not_found = make_adapter_set('not found', best_start_score=60.0, best_end_score=70.0)
+
+    def test_stop(self):
+        """
+        No set near the threshold and enough reads checked: the search stops.
+        """
+        self.assertTrue(adapter_set_search_is_settled([self.found, self.not_found], [500, 2],
+                                                      2995, THRESHOLD))
+        self.assertTrue(adapter_set_search_is_settled([self.found, self.not_found], [500, 0],
+                                                      10000, THRESHOLD))
+
+    def test_too_few_reads(self):
+        """
+        Not enough reads checked to rule out a rare set, even when every set has been found.
+        """
+        self.assertFalse(adapter_set_search_is_settled([self.found, self.not_found], [500, 0],
+                                                       2994, THRESHOLD))
+        self.assertFalse(adapter_set_search_is_settled([self.found], [500], 1000, THRESHOLD))
+        self.assertTrue(adapter_set_search_is_settled([self.found], [500], 2995, THRESHOLD))
+
+    def test_near_threshold(self):
+        """
+        A set which hasn't reached the threshold but has come close in at least 0.1% of the
+        checked reads might still be there, so the search continues.
+        """
+        self.assertFalse(adapter_set_search_is_settled([self.found, self.not_found], [500, 3],
+                                                       2995, THRESHOLD))
+        self.assertFalse(adapter_set_search_is_settled([self.found, self.not_found], [500, 10],
+                                                       10000, THRESHOLD))
+        self.assertTrue(adapter_set_search_is_settled([self.found, self.not_found], [500, 9],
+                                                      10000, THRESHOLD))
+
+        # Near threshold counts don't matter for sets which have already reached it.
+        self.assertTrue(adapter_set_search_is_settled([self.found], [10000], 10000, THRESHOLD))
+
+        # Reaching the threshold in only the start or end is enough.
+        end_found = make_adapter_set('end found', best_end_score=THRESHOLD)
+        self.assertTrue(adapter_set_search_is_settled([end_found], [10000], 10000, THRESHOLD))
+
+    def test_count_near_threshold_scores(self):
+        counts = [0, 0, 0]
+        count_near_threshold_scores(counts, ([85.0, 84.9, 50.0], [0.0, 0.0, 99.0]), THRESHOLD)
+        count_near_threshold_scores(counts, ([0.0, 0.0, 0.0], [0.0, 86.0, 0.0]), THRESHOLD)
+        self.assertEqual(counts, [1, 1, 1])
@@ -16,9 +16,15 @@ not, see <http://www.gnu.org/licenses/>.
 
 import unittest
 import os
+import random
 import shutil
 import subprocess
 import porechop.misc
+from porechop.adapters import make_full_native_barcode_adapter
+
+
+def random_seq(length, rng):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
 
 
 class TestBarcodes(unittest.TestCase):
@@ -205,3 +211,100 @@ class TestBarcodes(unittest.TestCase):
         self.assertTrue('BC03         1  6,996' in out)
 
         self.assertTrue('Saving trimmed reads' in out)
+
+    def test_barcodes_gzipped(self):
+        """
+        Tests gzipped barcode bins, which should hold the same reads as the plain bins.
+        """
+        self.run_command('porechop -i INPUT -b BARCODE_DIR')
+        plain_reads = {x: self.load_trimmed_reads(x + '.fastq')
+                       for x in ['BC01', 'BC02', 'BC03', 'none']}
+        shutil.rmtree(self.output_dir)
+
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --format fastq.gz')
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        for barcode_name, reads in plain_reads.items():
+            self.assertEqual(self.load_trimmed_reads(barcode_name + '.fastq.gz'), reads)
+            self.assertTrue(barcode_name + '.fastq.gz' in out)
+
+    def test_barcodes_anchored(self):
+        """
+        Tests --anchor_barcodes, which should put the reads in the same bins as the default.
+        """
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --anchor_barcodes')
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC01.fastq')), ['1', '4'])
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC02.fastq')), ['2', '5'])
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC03.fastq')), ['3'])
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('none.fastq')), ['6', '8'])
+
+    def test_barcodes_anchored_junction_indels(self):
+        """
+        Tests --anchor_barcodes on native barcoded reads with an insertion between the flank and
+        the barcode, which puts part of the barcode outside the window next to the flank. Those
+        reads should have their barcodes found in the whole read end, so they go in the same bins
+        as the default.
+        """
+        rng = random.Random(0)
+        input_path = 'TEMP_' + str(os.getpid()) + '.fastq'
+        self.addCleanup(os.remove, input_path)
+        with open(input_path, 'wt') as fastq:
+            for i in range(40):
+                adapter = make_full_native_barcode_adapter(i % 12 + 1)
+                before_barcode, after_barcode = adapter.start_barcode_flanks
+                start_seq = adapter.start_sequence[1]
+                barcode = start_seq[len(before_barcode):len(start_seq) - len(after_barcode)]
+                seq = (before_barcode + random_seq(rng.randint(12, 16), rng) + barcode +
+                       after_barcode + random_seq(rng.randint(500, 1000), rng))
+                fastq.write('@' + str(i + 1) + '\n' + seq + '\n+\n' + 'I' * len(seq) + '\n')
+
+        self.run_command('porechop -i ' + input_path + ' -b BARCODE_DIR')
+        default_bins = {x: sorted(y[0] for y in self.load_trimmed_reads(x))
+                        for x in os.listdir(self.output_dir)}
+        shutil.rmtree(self.output_dir)
+        self.run_command('porechop -i ' + input_path + ' -b BARCODE_DIR --anchor_barcodes')
+        anchored_bins = {x: sorted(y[0] for y in self.load_trimmed_reads(x))
+                         for x in os.listdir(self.output_dir)}
+        self.assertEqual(anchored_bins, default_bins)
+        self.assertNotIn('none.fastq', anchored_bins)
+
+    def test_barcodes_adapter_profile(self):
+        """
+        Tests saving the adapter search results with --save_adapter_profile and then loading them
+        with --load_adapter_profile, which should skip the search and put the reads in the same
+        bins.
+        """
+        profile = 'TEMP_' + str(os.getpid()) + '_profile.json'
+        try:
+            self.run_command('porechop -i INPUT -b BARCODE_DIR --save_adapter_profile ' + profile)
+            self.assertTrue(os.path.isfile(profile))
+            shutil.rmtree(self.output_dir)
+
+            out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR '
+                                      '--load_adapter_profile ' + profile)
+            self.assertTrue('Loading adapter profile' in out)
+            self.assertFalse('Looking for known adapter sets' in out)
+            self.assertTrue('Barcodes determined to be in reverse orientation' in out)
+            self.assertEqual(self.count_output_fastq_files(), 4)
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC01.fastq')),
+                             ['1', '4'])
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC02.fastq')),
+                             ['2', '5'])
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC03.fastq')), ['3'])
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('none.fastq')),
+                             ['6', '8'])
+        finally:
+            if os.path.isfile(profile):
+                os.remove(profile)
+
+    def test_barcodes_full_scoring(self):
+        """
+        At verbosity 3, every barcode is aligned to every read end (no early exit), which should
+        put the reads in the same bins as the default.
+        """
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR -v 3')
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC01.fastq')), ['1', '4'])
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC02.fastq')), ['2', '5'])
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC03.fastq')), ['3'])
+        self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('none.fastq')), ['6', '8'])
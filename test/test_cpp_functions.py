@@ -0,0 +1,395 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import random
+import os
+import sys
+import json
+import subprocess
+from porechop.cpp_function_wrappers import adapter_alignment, adapter_identity_batch, \
+    kmer_screen_passes, trim_read_ends, AdapterProfileSet, NOT_ALIGNED
+
+
+SCORING_SCHEME = [3, -6, -5, -2]
+
+
+def random_seq(length, rng, alphabet='ACGT'):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def add_errors(seq, error_count, rng):
+    """
+    Adds random substitutions, insertions and deletions to a sequence.
+    """
+    for _ in range(error_count):
+        pos = rng.randrange(len(seq))
+        error_type = rng.choice(['substitution', 'insertion', 'deletion'])
+        if error_type == 'substitution':
+            seq = seq[:pos] + rng.choice([x for x in 'ACGT' if x != seq[pos]]) + seq[pos + 1:]
+        elif error_type == 'insertion':
+            seq = seq[:pos] + rng.choice('ACGT') + seq[pos:]
+        elif len(seq) > 1:
+            seq = seq[:pos] + seq[pos + 1:]
+    return seq
+
+
+def random_read_end(adapter, error_count, rng, length=150):
+    """
+    Makes a random read end with a copy of the adapter (with errors) somewhere in it, sometimes
+    running off either end.
+    """
+    adapter_copy = add_errors(adapter, error_count, rng)
+    pos = rng.randint(-len(adapter_copy) // 4, length - 3 * len(adapter_copy) // 4)
+    read = random_seq(length, rng)
+    if pos < 0:
+        return adapter_copy[-pos:] + read[len(adapter_copy) + pos:]
+    return (read[:pos] + adapter_copy + read[pos + len(adapter_copy):])[:length]
+
+
+# Aligns every adapter to every read with the lane aligner and prints the results as JSON. This is
+# run in a separate process for each lane kernel, as the kernel is chosen once per process (see
+# getLaneKernel in lane_alignment.cpp). The end size is longer than the reads and every adapter is
+# always aligned, so the read start results are the lane alignments of the whole reads.
+LANE_ALIGNMENT_SCRIPT = """
+import json, sys
+from porechop.cpp_function_wrappers import AdapterProfileSet, trim_read_ends
+reads, adapters, scoring_scheme = json.load(sys.stdin)
+profiles = AdapterProfileSet(adapters, [1] * len(adapters), scoring_scheme, 75.0, 0)
+results = trim_read_ends(profiles, profiles, reads, 1000, 0, 75.0, 4)[2]
+print(json.dumps([[getattr(x, f[0]) for f in x._fields_] for x in results]))
+"""
+
+
+def get_reference_alignments(reads, adapters, scoring_scheme):
+    """
+    Returns the adapter_alignment (SeqAn) results for every read and adapter, in the same order and
+    form as get_lane_alignments.
+    """
+    alignments = []
+    for read in reads:
+        for adapter in adapters:
+            parts = adapter_alignment(read, adapter, scoring_scheme).split(',')
+            alignments.append([int(x) for x in parts[:5]] +
+                              [round_identity(float(x)) for x in parts[5:]])
+    return alignments
+
+
+def make_tricky_reads(adapters, rng):
+    """
+    Makes reads for comparing alignments: reads which are mostly a copy of an adapter (with errors,
+    cut off at either end so the alignment has end gaps, or longer or shorter than the adapter) and
+    low complexity reads, which give many equally good alignments.
+    """
+    reads = []
+    for _ in range(100):
+        adapter = add_errors(rng.choice(adapters), rng.randint(0, 4), rng)
+        choice = rng.randrange(4)
+        if choice == 0:
+            reads.append(adapter[rng.randrange(len(adapter)):])
+        elif choice == 1:
+            reads.append(adapter[:rng.randint(1, len(adapter))])
+        elif choice == 2:
+            reads.append(random_seq(rng.randint(0, 20), rng) + adapter +
+                         random_seq(rng.randint(0, 20), rng))
+        else:
+            reads.append(random_seq(rng.randint(1, 60), rng, rng.choice(['A', 'AC', 'ACGTN'])))
+    return reads
+
+
+def get_lane_alignments(reads, adapters, scoring_scheme, lane_kernel):
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PORECHOP_LANE_KERNEL=lane_kernel)
+    p = subprocess.Popen([sys.executable, '-c', LANE_ALIGNMENT_SCRIPT], cwd=repo_dir, env=env,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = p.communicate(json.dumps([reads, adapters, scoring_scheme]).encode())
+    return json.loads(out.decode())
+
+
+def round_identity(identity):
+    """
+    Rounds an identity like the string results from adapter_alignment. Alignments with no bases in
+    the aligned region have an identity of NaN, which is returned as a string so it can be
+    compared.
+    """
+    return round(identity, 6) if identity == identity else 'nan'
+
+
+def get_reference_trim(read_end, adapter, scoring_scheme, threshold, min_trim_size, end_size,
+                       read_start):
+    """
+    Returns how much of the read end the adapter would trim (without extra trimming) from a full
+    alignment with adapter_alignment, or None if it doesn't trim.
+    """
+    parts = adapter_alignment(read_end, adapter, scoring_scheme).split(',')
+    alignment_start, alignment_end = int(parts[0]), int(parts[1]) + 1
+    if alignment_start == -1:
+        return None
+    partial_identity = float(parts[5])
+    if not partial_identity > threshold or alignment_end - alignment_start < min_trim_size:
+        return None
+    if read_start:
+        return None if alignment_end == end_size else alignment_end
+    return None if alignment_start == 0 else end_size - alignment_start
+
+
+class TestKmerScreen(unittest.TestCase):
+    """
+    The k-mer screen must never rule out a read end where the adapter would reach the identity
+    threshold.
+    """
+    def test_screen_is_lossless(self):
+        rng = random.Random(0)
+        reaching_threshold, screened_out = 0, 0
+        for _ in range(3000):
+            adapter = random_seq(rng.randint(12, 60), rng)
+            threshold = rng.choice([70.0, 75.0, 80.0, 85.0, 90.0, 95.0])
+
+            # The number of errors goes up to about twice what the threshold allows, so many of
+            # the read ends are just over or under it.
+            max_errors = int(len(adapter) * (100.0 - threshold) / 100.0)
+            reads = [random_read_end(adapter, rng.randint(0, 2 * max_errors + 3), rng)
+                     for _ in range(4)]
+            if rng.random() < 0.2:
+                reads[0] = ''.join(x if rng.random() > 0.05 else 'N' for x in reads[0])
+            passes = kmer_screen_passes(reads, [adapter], threshold)
+            for read, read_passes in zip(reads, passes):
+                identity = round(adapter_identity_batch(read, [adapter], SCORING_SCHEME)[0], 6)
+                if identity >= threshold:
+                    reaching_threshold += 1
+                    self.assertTrue(read_passes, (read, adapter, threshold, identity))
+                elif not read_passes:
+                    screened_out += 1
+        self.assertTrue(reaching_threshold > 1000)
+        self.assertTrue(screened_out > 1000)
+
+    def test_short_reads(self):
+        """
+        Read ends shorter than the adapter (or than a k-mer) are still screened correctly.
+        """
+        adapter = 'AATGTACTTCGTTCAGTTACGTATTGCT'
+        reads = ['', 'A', 'AATGT', adapter[:20], adapter]
+        passes = kmer_screen_passes(reads, [adapter], 70.0)
+        for read, read_passes in zip(reads, passes):
+            identity = round(adapter_identity_batch(read, [adapter], SCORING_SCHEME)[0], 6)
+            if identity >= 70.0:
+                self.assertTrue(read_passes)
+        self.assertTrue(passes[4])
+
+
+class TestMyersPrefilter(unittest.TestCase):
+    """
+    Adapters are only aligned to read ends where the Myers prefilter shows they could trim, so the
+    prefilter must pass every read end which a full alignment would trim.
+    """
+    def test_no_false_negatives(self):
+        rng = random.Random(0)
+        end_size = 100
+        trimmed, skipped = 0, 0
+        for _ in range(1000):
+            scoring_scheme = rng.choice([SCORING_SCHEME, [1, -1, -1, -1], [2, -3, -4, -1]])
+            adapter = random_seq(rng.randint(8, 45), rng)
+            threshold = rng.choice([60.0, 70.0, 75.0, 80.0, 85.0, 90.0, 95.0])
+            min_trim_size = rng.choice([1, 2, 4, 8])
+
+            # Each read has a copy of the adapter (cut short on one side, with up to about twice
+            # as many errors as the threshold allows) near both ends, or is only that copy.
+            max_errors = int(len(adapter) * (100.0 - threshold) / 100.0)
+            reads = []
+            for _ in range(4):
+                adapter_copy = add_errors(adapter, rng.randint(0, 2 * max_errors + 2), rng)
+                if rng.random() < 0.5:
+                    adapter_copy = adapter_copy[rng.randrange(len(adapter_copy)):]
+                else:
+                    adapter_copy = adapter_copy[:rng.randint(1, len(adapter_copy))]
+                if rng.random() < 0.1:
+                    reads.append(adapter_copy)
+                else:
+                    reads.append(random_seq(rng.randint(0, 60), rng) + adapter_copy +
+                                 random_seq(rng.randint(50, 300), rng) + adapter_copy +
+                                 random_seq(rng.randint(0, 60), rng))
+
+            start_profiles = AdapterProfileSet([adapter], [0], scoring_scheme, threshold,
+                                               min_trim_size - 1)
+            end_profiles = AdapterProfileSet([adapter], [0], scoring_scheme, threshold,
+                                             min_trim_size - 1)
+            trims, start_calls, _, end_calls, _ = trim_read_ends(start_profiles, end_profiles,
+                                                                 reads, end_size, 0, threshold,
+                                                                 min_trim_size)
+            for i, read in enumerate(reads):
+                for read_start in [True, False]:
+                    if read_start:
+                        read_end, call = read[:end_size], start_calls[i]
+                        trim_amount = trims[i].start_trim_amount
+                    else:
+                        read_end, call = read[-end_size:], end_calls[i]
+                        trim_amount = trims[i].end_trim_amount
+                    reference_trim = get_reference_trim(read_end, adapter, scoring_scheme,
+                                                        threshold, min_trim_size, end_size,
+                                                        read_start)
+                    self.assertEqual(trim_amount, reference_trim or 0)
+                    if reference_trim is not None:
+                        trimmed += 1
+                        self.assertNotEqual(call, NOT_ALIGNED,
+                                            (read_end, adapter, threshold, min_trim_size))
+                    elif call == NOT_ALIGNED:
+                        skipped += 1
+        self.assertTrue(trimmed > 1000)
+        self.assertTrue(skipped > 1000)
+
+
+class TestLaneAlignment(unittest.TestCase):
+    """
+    The lane aligner must give the same alignments as SeqAn (adapter_alignment) with each of its
+    kernels: eight lanes with AVX2, four with SSE4.2 and four without either. Kernels which the CPU
+    doesn't support fall back to the next one down.
+    """
+    def test_lanes_match_seqan(self):
+        rng = random.Random(0)
+        for scoring_scheme in [SCORING_SCHEME, [1, -1, -1, -1], [2, -3, -4, -1], [5, -4, -8, -3]]:
+            adapters = [random_seq(rng.randint(1, 40), rng) for _ in range(4)]
+
+            # Many reads of a few lengths fill up the lanes, while the others leave some empty.
+            # Some are mostly adapter, to give alignments with gaps and ties.
+            reads = []
+            for length in [0, 1, 5, 30, 57, 100]:
+                for _ in range(rng.randint(1, 20)):
+                    if length and rng.random() < 0.3:
+                        adapter = add_errors(rng.choice(adapters), rng.randint(0, 5), rng)
+                        read = random_seq(length, rng) + adapter + random_seq(length, rng)
+                        start = rng.randint(0, len(read) - length)
+                        reads.append(read[start:start + length])
+                    else:
+                        reads.append(random_seq(length, rng, rng.choice(['ACGT', 'AC', 'ACGTN'])))
+            rng.shuffle(reads)
+
+            expected = get_reference_alignments(reads, adapters, scoring_scheme)
+            for lane_kernel in ['avx2', 'sse4.2', 'default']:
+                results = get_lane_alignments(reads, adapters, scoring_scheme, lane_kernel)
+                self.assertEqual(len(results), len(expected))
+                for result, expected_result in zip(results, expected):
+                    if expected_result[0] == -1:
+                        self.assertEqual(result[0], -1)
+                        continue
+                    self.assertEqual(result[:5] + [round_identity(x) for x in result[5:]],
+                                     expected_result, lane_kernel)
+
+
+class TestPathAligner(unittest.TestCase):
+    """
+    PathAligner must choose the same alignment as SeqAn (adapter_alignment), including between
+    equally scoring alignments, so its identities and coordinates match.
+    """
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.scoring_schemes = [SCORING_SCHEME, [1, -1, -1, -1], [2, -3, -4, -1], [5, -4, -8, -3],
+                                [1, 0, 0, 0]]
+
+    def test_identities_match_seqan(self):
+        for scoring_scheme in self.scoring_schemes:
+            adapters = [random_seq(self.rng.randint(1, 40), self.rng, alphabet)
+                        for alphabet in ['ACGT', 'ACGT', 'AC', 'A']]
+            for read in make_tricky_reads(adapters, self.rng) + ['', 'N']:
+                identities = adapter_identity_batch(read, adapters, scoring_scheme)
+                for adapter, identity in zip(adapters, identities):
+                    parts = adapter_alignment(read, adapter, scoring_scheme).split(',')
+                    self.assertEqual(round(identity, 6), round(float(parts[6]), 6),
+                                     (read, adapter, scoring_scheme))
+
+    def test_coordinates_match_seqan(self):
+        """
+        With the lanes turned off, the read end aligner uses PathAligner for every read.
+        """
+        for scoring_scheme in self.scoring_schemes:
+            adapters = [random_seq(self.rng.randint(1, 40), self.rng, alphabet)
+                        for alphabet in ['ACGT', 'ACGT', 'AC', 'A']]
+            reads = make_tricky_reads(adapters, self.rng) + ['']
+            expected = get_reference_alignments(reads, adapters, scoring_scheme)
+            results = get_lane_alignments(reads, adapters, scoring_scheme, 'none')
+            self.assertEqual(len(results), len(expected))
+            for result, expected_result in zip(results, expected):
+                if expected_result[0] == -1:
+                    self.assertEqual(result[0], -1)
+                    continue
+                self.assertEqual(result[:5] + [round_identity(x) for x in result[5:]],
+                                 expected_result, scoring_scheme)
+
+
+class TestScoredAlignment(unittest.TestCase):
+    """
+    Tests the coordinates and identities which ScoredAlignment gets from SeqAn alignments, on
+    alignments where they can be worked out by hand. The results are: read start, read end,
+    adapter start, adapter end (all inclusive), raw score, aligned region identity and full
+    adapter identity.
+    """
+    adapter = 'AATGTACTTCGTTCAGTTACGTATTGCT'
+
+    def get_alignment(self, read, adapter, scoring_scheme=SCORING_SCHEME):
+        parts = adapter_alignment(read, adapter, scoring_scheme).split(',')
+        return [int(x) for x in parts[:5]] + [round_identity(float(x)) for x in parts[5:]]
+
+    def test_read_gaps_at_both_ends(self):
+        """
+        The read runs past the adapter on both sides, so the alignment only covers the adapter.
+        """
+        self.assertEqual(self.get_alignment('GGGGG' + self.adapter + 'TTTTT', self.adapter),
+                         [5, 32, 0, 27, 84, 100.0, 100.0])
+
+    def test_adapter_gaps_at_both_ends(self):
+        """
+        The adapter is longer than the read at both ends: only the adapter's middle 15 bases are in
+        the aligned region, but its whole length counts for the full adapter identity.
+        """
+        self.assertEqual(self.get_alignment(self.adapter[5:20], self.adapter),
+                         [0, 14, 5, 19, 45, 100.0, 53.571429])
+
+    def test_adapter_off_read_start(self):
+        """
+        The adapter's first 10 bases are off the start of the read, like an adapter which is
+        longer than the read end it's found in.
+        """
+        self.assertEqual(self.get_alignment(self.adapter[10:] + 'GGGGGGGG', self.adapter),
+                         [0, 17, 10, 27, 54, 100.0, 64.285714])
+
+    def test_adapter_off_read_end(self):
+        self.assertEqual(self.get_alignment('CCCCCCCC' + self.adapter[:18], self.adapter),
+                         [8, 25, 0, 17, 54, 100.0, 64.285714])
+
+    def test_read_insertion(self):
+        """
+        Two inserted read bases count against both identities.
+        """
+        read = self.adapter[:10] + 'GG' + self.adapter[10:]
+        self.assertEqual(self.get_alignment(read, self.adapter),
+                         [0, 29, 0, 27, 77, 93.333333, 93.333333])
+
+    def test_all_mismatches(self):
+        """
+        When mismatches score better than gaps, the sequences overlap completely with no matches.
+        With the default scoring, they don't overlap at all (end gaps are free), so the aligned
+        region is empty and its identity is NaN.
+        """
+        self.assertEqual(self.get_alignment('AAAA', 'CCCC', [3, 1, -5, -2]),
+                         [0, 3, 0, 3, 4, 0.0, 0.0])
+        self.assertEqual(self.get_alignment('AAAA', 'CCCC'), [0, 0, 4, 3, 0, 'nan', 0.0])
+
+    def test_failed_alignment(self):
+        """
+        With an empty read or adapter, there's no alignment. All of the fields are set (the same
+        as PathAligner's failed result), not only the read start.
+        """
+        for read, adapter in [('', self.adapter), ('ACGT', ''), ('', '')]:
+            self.assertEqual(self.get_alignment(read, adapter), [-1, -1, -1, -1, 0, 0.0, 0.0])
@@ -65,6 +65,14 @@ class TestOutputFormat(unittest.TestCase):
         self.run_command('porechop -i IN -o OUT.fastq.gz', 'test_format.fastq')
         self.assertEqual(get_read_type(self.output_file), 'fastq.gz')
 
+    def test_gzipped_output_same_reads(self):
+        self.run_command('porechop -i IN -o OUT.fastq', 'test_format.fastq')
+        plain_reads, _ = porechop.misc.load_fasta_or_fastq(self.output_file)
+        os.remove(self.output_file)
+        self.run_command('porechop -i IN -o OUT.fastq.gz', 'test_format.fastq')
+        gzipped_reads, _ = porechop.misc.load_fasta_or_fastq(self.output_file)
+        self.assertEqual(plain_reads, gzipped_reads)
+
     def test_auto_format_fastq_to_fasta(self):
         self.run_command('porechop -i IN -o OUT.fasta', 'test_format.fastq')
         self.assertEqual(get_read_type(self.output_file), 'fasta')
@@ -0,0 +1,112 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import gzip
+import shutil
+import porechop.misc
+
+
+class TestLoadReads(unittest.TestCase):
+    """
+    Tests the FASTA/FASTQ parsing, including records which span the blocks the file is read in.
+    """
+    def setUp(self):
+        self.output_dir = 'TEMP_' + str(os.getpid())
+        os.makedirs(self.output_dir)
+        self.default_block_size = porechop.misc.READ_BLOCK_SIZE
+
+    def tearDown(self):
+        porechop.misc.READ_BLOCK_SIZE = self.default_block_size
+        if os.path.isdir(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def write_file(self, filename, contents):
+        path = os.path.join(self.output_dir, filename)
+        open_func = gzip.open if filename.endswith('.gz') else open
+        with open_func(path, 'wb') as f:
+            f.write(contents.encode())
+        return path
+
+    def load_with_block_sizes(self, path):
+        """
+        Loads the file with a range of block sizes and checks they all give the same records.
+        """
+        all_records = []
+        for block_size in [1, 2, 5, 1000, self.default_block_size]:
+            porechop.misc.READ_BLOCK_SIZE = block_size
+            records, read_type = porechop.misc.load_fasta_or_fastq(path)
+            all_records.append(records)
+            self.assertEqual(records, list(porechop.misc.iterate_fasta_or_fastq(path)[0]))
+        for records in all_records[1:]:
+            self.assertEqual(records, all_records[0])
+        return all_records[0], read_type
+
+    def test_fastq(self):
+        path = self.write_file('reads.fastq', '@read_1 info\nACGT\n+\nABCD\n'
+                                              '@read_2\nGGAAC\n+\n@@@@@\n')
+        records, read_type = self.load_with_block_sizes(path)
+        self.assertEqual(read_type, 'FASTQ')
+        self.assertEqual(records, [('read_1', 'ACGT', '+', 'ABCD', 'read_1 info'),
+                                   ('read_2', 'GGAAC', '+', '@@@@@', 'read_2')])
+
+    def test_fastq_gz_windows_line_endings(self):
+        path = self.write_file('reads.fastq.gz', '@read_1 info\r\nACGT\r\n+\r\nABCD\r\n'
+                                                 '@read_2\r\nGGAAC\r\n+\r\n@@@@@')
+        records, _ = self.load_with_block_sizes(path)
+        self.assertEqual(records, [('read_1', 'ACGT', '+', 'ABCD', 'read_1 info'),
+                                   ('read_2', 'GGAAC', '+', '@@@@@', 'read_2')])
+
+    def test_wrapped_fasta(self):
+        path = self.write_file('reads.fasta', '>read_1 info\nACGTA\nCGTAC\nGT\n'
+                                              '>read_2\n\n>read_3\nTTTTT\n\nGGG')
+        records, read_type = self.load_with_block_sizes(path)
+        self.assertEqual(read_type, 'FASTA')
+        self.assertEqual(records, [('read_1', 'ACGTACGTACGT', 'read_1 info'),
+                                   ('read_2', '', 'read_2'),
+                                   ('read_3', 'TTTTTGGG', 'read_3')])
+
+    def test_fasta_whitespace(self):
+        """
+        Whitespace at the ends of FASTA sequence lines is stripped, but whitespace within a line is
+        kept.
+        """
+        path = self.write_file('reads.fasta', '>read_1\r\nACGT ACGT \r\n\tAC\tGT\r\n'
+                                              '>read_2\nTTTT  \nGGGG\n')
+        records, _ = self.load_with_block_sizes(path)
+        self.assertEqual(records, [('read_1', 'ACGT ACGTAC\tGT', 'read_1'),
+                                   ('read_2', 'TTTTGGGG', 'read_2')])
+
+    def test_truncated_fastq(self):
+        path = self.write_file('reads.fastq', '@read_1\nACGT\n+\nABCD\n@read_2\nGGAAC\n')
+        with self.assertRaises(SystemExit):
+            porechop.misc.load_fasta_or_fastq(path)
+
+    def test_fasta_without_header(self):
+        """
+        A FASTA file whose first line isn't a header gives the same error as a truncated FASTQ
+        file. (Files loaded with load_fasta_or_fastq are checked for a '>' first, so this is only
+        seen when loading FASTA directly.)
+        """
+        for contents in ['ACGT\n>read_1\nACGT\n', '\n\nACGT\n>read_1\nACGT\n', 'ACGT']:
+            path = self.write_file('reads.fasta', contents)
+            for block_size in [1, 2, 5, 1000, self.default_block_size]:
+                porechop.misc.READ_BLOCK_SIZE = block_size
+                with self.assertRaises(IndexError):
+                    porechop.misc.load_fasta(path)
+        with self.assertRaises(IndexError):
+            porechop.misc.load_fastq(self.write_file('reads.fastq', '@read_1\nACGT\n+\n'))
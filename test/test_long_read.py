@@ -0,0 +1,109 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import random
+import shutil
+import subprocess
+import porechop.misc
+
+
+TOP_ADAPTER = 'AATGTACTTCGTTCAGTTACGTATTGCT'     # SQK-NSK007_Y_Top
+BOTTOM_ADAPTER = 'GCAATACGTAACTGAACGAAGT'        # SQK-NSK007_Y_Bottom
+HALF_LENGTH = 1500000
+
+
+class TestLongRead(unittest.TestCase):
+    """
+    This test set has one 3 Mb read, with adapters at its start and end and one in the middle, to
+    check that very long reads are trimmed and split correctly (and without holding up the tests).
+    """
+    def setUp(self):
+        self.output_dir = 'TEMP_' + str(os.getpid())
+        os.makedirs(self.output_dir)
+        rng = random.Random(0)
+
+        def random_seq(length, alphabet='ACGT'):
+            return ''.join(rng.choices(alphabet, k=length))
+
+        self.first_half, self.second_half = random_seq(HALF_LENGTH), random_seq(HALF_LENGTH)
+        seq = random_seq(20) + TOP_ADAPTER + self.first_half + TOP_ADAPTER + self.second_half + \
+            BOTTOM_ADAPTER + random_seq(20)
+        self.quals = random_seq(len(seq), '+,-./0123456789')
+        self.input_file = os.path.join(self.output_dir, 'long_read.fastq')
+        with open(self.input_file, 'wt') as f:
+            f.write('@long_read\n' + seq + '\n+\n' + self.quals + '\n')
+
+        # The start and end trims take off the adapters with 2 extra bases. The middle adapter is
+        # a start adapter, so 100 bases are trimmed before it and 10 after it.
+        start_trim = 20 + len(TOP_ADAPTER) + 2
+        self.expected_parts = [self.first_half[2:-100], self.second_half[10:-2]]
+        first_part_start = start_trim
+        second_part_start = start_trim - 2 + HALF_LENGTH + len(TOP_ADAPTER) + 10
+        self.expected_quals = [
+            self.quals[first_part_start:first_part_start + len(self.expected_parts[0])],
+            self.quals[second_part_start:second_part_start + len(self.expected_parts[1])]]
+
+    def tearDown(self):
+        if os.path.isdir(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def run_command(self, command):
+        runner_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'porechop-runner.py')
+        command = command.replace('porechop', runner_path)
+        command = command.replace('INPUT', self.input_file)
+        command = command.replace('OUTPUT', os.path.join(self.output_dir, 'trimmed'))
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        out, err = p.communicate()
+        return out.decode(), err.decode()
+
+    def test_long_read_fastq(self):
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq')
+        self.assertTrue('1 / 1 reads had adapters trimmed from their start (50 bp removed)' in out)
+        self.assertTrue('1 / 1 reads had adapters trimmed from their end (44 bp removed)' in out)
+        self.assertTrue('1 / 1 reads were split based on middle adapters' in out)
+        reads, _ = porechop.misc.load_fasta_or_fastq(os.path.join(self.output_dir,
+                                                                  'trimmed.fastq'))
+        self.assertEqual([x[0] for x in reads], ['long_read_1', 'long_read_2'])
+        self.assertEqual([x[1] for x in reads], self.expected_parts)
+        self.assertEqual([x[3] for x in reads], self.expected_quals)
+
+    def test_long_read_fasta(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fasta')
+        output_file = os.path.join(self.output_dir, 'trimmed.fasta')
+        reads, _ = porechop.misc.load_fasta_or_fastq(output_file)
+        self.assertEqual([x[0] for x in reads], ['long_read_1', 'long_read_2'])
+        self.assertEqual([x[1] for x in reads], self.expected_parts)
+
+        # The sequences are wrapped at 70 bases per line.
+        with open(output_file, 'rt') as f:
+            line_lengths = [len(x) for x in f.read().splitlines() if not x.startswith('>')]
+        self.assertEqual(max(line_lengths), 70)
+        self.assertEqual(len(line_lengths), sum((len(x) + 69) // 70 for x in self.expected_parts))
+
+    def test_long_read_verbose(self):
+        """
+        The verbose output shows only the part of the read around the middle adapter.
+        """
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --verbosity 2')
+        self.assertTrue('SQK-NSK007_Y_Top (read coords: ' in out)
+        self.assertTrue(len(out) < 100000)
+
+    def test_long_read_discard_middle(self):
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --discard_middle')
+        self.assertTrue('1 / 1 reads were discarded based on middle adapters' in out)
+        self.assertEqual(os.path.getsize(os.path.join(self.output_dir, 'trimmed.fastq')), 0)
@@ -0,0 +1,296 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import random
+from porechop.nanopore_read import NanoporeRead, get_middle_adapter_seeds, \
+    get_middle_adapter_max_errors, get_middle_adapter_windows, merge_intervals
+from porechop.cpp_function_wrappers import middle_adapter_hits
+
+
+SCORING_SCHEME = [3, -6, -5, -2]
+ADAPTER_NAME = 'SQK-NSK007_Y_Top'
+ADAPTER = 'AATGTACTTCGTTCAGTTACGTATTGCT'
+
+
+def random_seq(length, rng):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def add_error(seq, pos, error_type, rng):
+    """
+    Adds a substitution, insertion or deletion at the given position.
+    """
+    if error_type == 'substitution':
+        return seq[:pos] + rng.choice([x for x in 'ACGT' if x != seq[pos]]) + seq[pos + 1:]
+    if error_type == 'insertion':
+        return seq[:pos] + rng.choice('ACGT') + seq[pos:]
+    return seq[:pos] + seq[pos + 1:]
+
+
+class TestMiddleAdapters(unittest.TestCase):
+    """
+    Tests finding adapters in the middle of reads, directly on NanoporeRead objects.
+    """
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def find_middle_adapters(self, seq, threshold=90.0, adapter=ADAPTER, use_seeds=True):
+        read = NanoporeRead('read', seq, '')
+        seeds = {}
+        if use_seeds:
+            seeds[adapter] = get_middle_adapter_seeds(adapter, threshold, SCORING_SCHEME)
+        read.find_middle_adapters([(ADAPTER_NAME, adapter)], seeds, threshold, 10, 100,
+                                  SCORING_SCHEME, {ADAPTER_NAME}, set())
+        return read
+
+    def test_adapter_in_middle(self):
+        seq = random_seq(1000, self.rng) + ADAPTER + random_seq(1000, self.rng)
+        read = self.find_middle_adapters(seq)
+        self.assertEqual(read.middle_adapter_intervals, [(1000, 1028)])
+        self.assertEqual(read.middle_trim_intervals, [(900, 1038)])
+
+    def test_adapter_at_read_start(self):
+        read = self.find_middle_adapters(ADAPTER + random_seq(1000, self.rng))
+        self.assertEqual(read.middle_adapter_intervals, [(0, 28)])
+
+    def test_adapter_at_read_end(self):
+        read = self.find_middle_adapters(random_seq(1000, self.rng) + ADAPTER)
+        self.assertEqual(read.middle_adapter_intervals, [(1000, 1028)])
+
+    def test_adapter_clipped_at_read_start(self):
+        """
+        Overhanging adapter bases count against the full adapter identity, so an adapter with
+        a quarter of it off the edge of the read doesn't reach the threshold.
+        """
+        read = self.find_middle_adapters(ADAPTER[7:] + random_seq(1000, self.rng))
+        self.assertIsNone(read.middle_adapter_intervals)
+        read = self.find_middle_adapters(ADAPTER[7:] + random_seq(1000, self.rng), 70.0)
+        self.assertEqual(read.middle_adapter_intervals, [(0, 21)])
+
+    def test_adapter_fully_clipped(self):
+        """
+        Only the adapter's last few bases are at the start of the read, which isn't a hit. Even
+        at a low threshold, hits must stay within the read.
+        """
+        seq = ADAPTER[-3:] + random_seq(100, self.rng)
+        read = self.find_middle_adapters(seq)
+        self.assertIsNone(read.middle_adapter_intervals)
+        read = self.find_middle_adapters(seq, 1.0)
+        for start, end in read.middle_adapter_intervals:
+            self.assertTrue(0 <= start < end <= len(seq))
+
+    def test_zero_threshold_stops(self):
+        """
+        With a threshold of 0, every alignment is a hit, including ones that only cover bases
+        masked by earlier hits. The search must stop there, not find the same hit again.
+        """
+        for seq in ['', 'ACGT', 'GGGG' + ADAPTER[:10], 'CCCC' + ADAPTER + 'GGGGGG' + ADAPTER]:
+            hits = middle_adapter_hits(seq, ADAPTER, SCORING_SCHEME, 0.0)
+            hit_ranges = [(x.read_start, x.read_end) for x in hits]
+            self.assertEqual(len(hit_ranges), len(set(hit_ranges)))
+            self.assertTrue(len(hits) <= 3)
+            for hit in hits:
+                self.assertTrue(hit.read_start <= hit.read_end)
+
+    def test_seeds_with_max_errors(self):
+        """
+        Adapters with as many substitutions as the threshold allows, each in a different seed
+        piece, must give the same hits when only the windows around seed hits are aligned as when
+        the whole read is. (The whole read search can occasionally miss them too, when the best
+        scoring alignment isn't the one with the best identity.)
+        """
+        tested, found = 0, 0
+        for _ in range(300):
+            adapter_length = self.rng.randint(20, 60)
+            threshold = self.rng.choice([75.0, 80.0, 85.0, 90.0, 95.0])
+            adapter = random_seq(adapter_length, self.rng)
+            seeds = get_middle_adapter_seeds(adapter, threshold, SCORING_SCHEME)
+            if seeds is None:
+                continue
+            seed_size = len(seeds[0][1])
+            error_count = int(adapter_length * (100.0 - threshold) / 100.0)
+            self.assertTrue(error_count < len(seeds))
+            mutated = adapter
+            for piece in self.rng.sample(range(len(seeds)), error_count):
+                pos = piece * seed_size + self.rng.randrange(seed_size)
+                mutated = add_error(mutated, pos, 'substitution', self.rng)
+            seq = random_seq(300, self.rng) + mutated + random_seq(300, self.rng)
+            seeded = self.find_middle_adapters(seq, threshold, adapter)
+            unseeded = self.find_middle_adapters(seq, threshold, adapter, use_seeds=False)
+            self.assertEqual(seeded.middle_adapter_intervals, unseeded.middle_adapter_intervals)
+            tested += 1
+            if any(start < 300 + adapter_length and end > 300
+                   for start, end in seeded.middle_adapter_intervals or []):
+                found += 1
+        self.assertTrue(tested > 100)
+        self.assertTrue(found > 0.9 * tested)
+
+    def test_seeds_match_whole_read(self):
+        """
+        With any mix of errors (up to the maximum the seeds allow for, spread over different
+        pieces), aligning only the seed windows must find the same hits as aligning the whole
+        read.
+        """
+        for _ in range(200):
+            adapter_length = self.rng.randint(20, 60)
+            threshold = self.rng.choice([75.0, 80.0, 85.0, 90.0, 95.0])
+            adapter = random_seq(adapter_length, self.rng)
+            seeds = get_middle_adapter_seeds(adapter, threshold, SCORING_SCHEME)
+            if seeds is None:
+                continue
+            seed_size = len(seeds[0][1])
+            max_errors = get_middle_adapter_max_errors(adapter_length, threshold)
+            mutated = adapter
+
+            # Errors are added from the end of the adapter backwards, so indels don't shift the
+            # positions of the pieces still to come.
+            pieces = self.rng.sample(range(len(seeds)), self.rng.randint(0, max_errors))
+            for piece in sorted(pieces, reverse=True):
+                pos = piece * seed_size + self.rng.randrange(seed_size)
+                mutated = add_error(mutated, pos, self.rng.choice(['substitution', 'insertion',
+                                                                   'deletion']), self.rng)
+            seq = random_seq(300, self.rng) + mutated + random_seq(300, self.rng)
+            seeded = self.find_middle_adapters(seq, threshold, adapter)
+            unseeded = self.find_middle_adapters(seq, threshold, adapter, use_seeds=False)
+            self.assertEqual(seeded.middle_adapter_intervals, unseeded.middle_adapter_intervals)
+
+    def test_seeds_turned_off(self):
+        self.assertIsNotNone(get_middle_adapter_seeds(ADAPTER, 90.0, SCORING_SCHEME))
+
+        # The pieces would be too short (or there's no threshold at all).
+        self.assertIsNone(get_middle_adapter_seeds(ADAPTER, 0.0, SCORING_SCHEME))
+        self.assertIsNone(get_middle_adapter_seeds(ADAPTER, 50.0, SCORING_SCHEME))
+        self.assertIsNone(get_middle_adapter_seeds(ADAPTER[:10], 90.0, SCORING_SCHEME))
+
+        # The scoring scheme doesn't penalise mismatches and gaps (or reward matches).
+        for scoring_scheme in [[0, -6, -5, -2], [3, 0, -5, -2], [3, 2, -5, -2], [3, -6, 0, -2],
+                               [3, -6, -5, 0], [3, -6, -5, 1]]:
+            self.assertIsNone(get_middle_adapter_seeds(ADAPTER, 90.0, scoring_scheme))
+
+    def test_seed_pieces(self):
+        """
+        The adapter is cut into one more piece than the number of errors allowed.
+        """
+        self.assertEqual(get_middle_adapter_max_errors(len(ADAPTER), 90.0), 3)
+        seeds = get_middle_adapter_seeds(ADAPTER, 90.0, SCORING_SCHEME)
+        self.assertEqual(seeds, [(0, 'AATGTAC'), (7, 'TTCGTTC'), (14, 'AGTTACG'),
+                                 (21, 'TATTGCT')])
+
+    def test_windows_clamped(self):
+        seeds = get_middle_adapter_seeds(ADAPTER, 90.0, SCORING_SCHEME)
+
+        # The adapter's start is off the start of the read, so its window would start before 0.
+        seq = ADAPTER[7:] + random_seq(200, self.rng)
+        self.assertEqual(get_middle_adapter_windows(seq, ADAPTER, seeds), [(0, 49)])
+
+        # The adapter's end is off the end of the read, so its window would end past the read.
+        seq = random_seq(200, self.rng) + ADAPTER[:21]
+        self.assertEqual(get_middle_adapter_windows(seq, ADAPTER, seeds), [(172, 221)])
+
+        # In the middle, the window is an adapter length either side of the adapter.
+        seq = random_seq(200, self.rng) + ADAPTER + random_seq(200, self.rng)
+        self.assertEqual(get_middle_adapter_windows(seq, ADAPTER, seeds), [(172, 256)])
+
+        # Without seeds, the whole read is one window (unless it's empty).
+        self.assertEqual(get_middle_adapter_windows(seq, ADAPTER, None), [(0, len(seq))])
+        self.assertEqual(get_middle_adapter_windows('', ADAPTER, None), [])
+
+
+class TestSplitReadParts(unittest.TestCase):
+    """
+    Tests merging middle adapter intervals and splitting reads around them.
+    """
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def make_read(self, seq, start_trim_amount=0, end_trim_amount=0, middle_trim_intervals=None):
+        quals = ''.join(self.rng.choice('+,-./0123456789') for _ in range(len(seq)))
+        read = NanoporeRead('read', seq, quals)
+        read.start_trim_amount, read.end_trim_amount = start_trim_amount, end_trim_amount
+        read.middle_trim_intervals = middle_trim_intervals
+        return read
+
+    def test_merge_overlapping(self):
+        self.assertEqual(merge_intervals([(50, 100), (20, 60)]), [(20, 100)])
+        self.assertEqual(merge_intervals([(20, 100), (30, 40)]), [(20, 100)])
+        self.assertEqual(merge_intervals([(70, 90), (0, 10), (5, 30), (80, 120)]),
+                         [(0, 30), (70, 120)])
+
+    def test_merge_adjacent(self):
+        self.assertEqual(merge_intervals([(50, 100), (20, 50)]), [(20, 100)])
+        self.assertEqual(merge_intervals([(20, 49), (50, 100)]), [(20, 49), (50, 100)])
+
+    def test_merge_empty(self):
+        self.assertEqual(merge_intervals([]), [])
+        self.assertEqual(merge_intervals([(10, 10), (30, 20), (40, 50)]), [(40, 50)])
+
+    def test_overlapping_middle_hits(self):
+        """
+        Two adapters whose trimmed intervals overlap split the read into two parts, not three.
+        """
+        seq = random_seq(1000, self.rng) + ADAPTER + random_seq(50, self.rng) + ADAPTER + \
+            random_seq(1000, self.rng)
+        read = NanoporeRead('read', seq, '')
+        seeds = {ADAPTER: get_middle_adapter_seeds(ADAPTER, 90.0, SCORING_SCHEME)}
+        read.find_middle_adapters([(ADAPTER_NAME, ADAPTER)], seeds, 90.0, 10, 100,
+                                  SCORING_SCHEME, {ADAPTER_NAME}, set())
+        self.assertEqual(read.middle_adapter_intervals, [(1000, 1028), (1078, 1106)])
+        self.assertEqual(read.middle_trim_intervals, [(900, 1116)])
+        parts = read.get_split_read_parts(1)
+        self.assertEqual([x[0] for x in parts], [seq[:900], seq[1116:]])
+
+    def test_adjacent_middle_hits(self):
+        """
+        Two adapters back to back are merged into one interval.
+        """
+        seq = random_seq(1000, self.rng) + ADAPTER + ADAPTER + random_seq(1000, self.rng)
+        read = NanoporeRead('read', seq, '')
+        read.find_middle_adapters([(ADAPTER_NAME, ADAPTER)], {}, 90.0, 10, 100,
+                                  SCORING_SCHEME, {ADAPTER_NAME}, set())
+        self.assertEqual(read.middle_adapter_intervals, [(1000, 1056)])
+        self.assertEqual(read.middle_trim_intervals, [(900, 1066)])
+
+    def test_hit_overlapping_start_trim(self):
+        """
+        A middle adapter near the start of the trimmed read has a trim interval which would
+        reach back past the start trim. It is clipped to the read, and only the part after it is
+        kept.
+        """
+        seq = random_seq(50, self.rng) + ADAPTER + random_seq(1000, self.rng)
+        read = self.make_read(seq, start_trim_amount=40)
+        read.find_middle_adapters([(ADAPTER_NAME, ADAPTER)], {}, 90.0, 10, 100,
+                                  SCORING_SCHEME, {ADAPTER_NAME}, set())
+        self.assertEqual(read.middle_adapter_intervals, [(10, 38)])
+        self.assertEqual(read.middle_trim_intervals, [(0, 48)])
+        parts = read.get_split_read_parts(1)
+        self.assertEqual(parts, [(seq[88:], read.quals[88:])])
+
+    def test_hit_overlapping_end_trim(self):
+        seq = random_seq(1000, self.rng) + ADAPTER + random_seq(50, self.rng)
+        read = self.make_read(seq, end_trim_amount=40)
+        read.find_middle_adapters([(ADAPTER_NAME, ADAPTER)], {}, 90.0, 10, 100,
+                                  SCORING_SCHEME, {ADAPTER_NAME}, set())
+        self.assertEqual(read.middle_adapter_intervals, [(1000, 1028)])
+        self.assertEqual(read.middle_trim_intervals, [(900, 1038)])
+        parts = read.get_split_read_parts(1)
+        self.assertEqual(parts, [(seq[:900], read.quals[:900])])
+
+    def test_min_split_read_size(self):
+        seq = random_seq(2000, self.rng)
+        read = self.make_read(seq, middle_trim_intervals=[(100, 200), (1000, 1100)])
+        self.assertEqual([len(x[0]) for x in read.get_split_read_parts(1)], [100, 800, 900])
+        self.assertEqual([len(x[0]) for x in read.get_split_read_parts(101)], [800, 900])
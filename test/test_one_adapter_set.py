@@ -498,3 +498,16 @@ class TestOneAdapterSet(unittest.TestCase):
         self.assertEqual(len(read_9_1[1]), 1500)
         self.assertEqual(len(read_9_2[1]), 178)
         self.assertEqual(len(read_9_3[1]), 4272)
+
+    def test_adaptive_check(self):
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --adaptive_check')
+        self.assertTrue('Adapter sets settled after 9 / 9 check reads' in out)
+        self.assertTrue('SQK-NSK007_Y_Top:' in out)
+        self.assertTrue('4 / 9 reads' in out)
+        self.assertTrue('3 / 9 reads' in out)
+
+    def test_kmer_screen(self):
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq')
+        self.assertTrue('adapter sets passed the k-mer screen for at least one check read end'
+                        in out)
+        self.assertTrue('SQK-NSK007_Y_Top:' in out)
@@ -0,0 +1,138 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import shutil
+import subprocess
+import porechop.misc
+
+
+class TestStream(unittest.TestCase):
+    """
+    Tests that streaming mode, the process engine and other chunk sizes give the same results as
+    the normal mode (load everything and use the thread engine).
+    """
+    def run_command(self, command, input_filename):
+        runner_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'porechop-runner.py')
+        input_path = os.path.join(os.path.dirname(__file__), input_filename)
+        command = command.replace('porechop', runner_path)
+        command = command.replace('INPUT', input_path)
+        self.output_dir = 'TEMP_' + str(os.getpid())
+        command = command.replace('OUTPUT', self.output_dir)
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        out, err = p.communicate()
+        return out.decode(), err.decode()
+
+    def setUp(self):
+        self.output_dir = 'TEMP_' + str(os.getpid())
+        os.makedirs(self.output_dir)
+
+    def tearDown(self):
+        if os.path.isdir(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def load_output_reads(self, filename):
+        reads, _ = porechop.misc.load_fasta_or_fastq(os.path.join(self.output_dir, filename))
+        return reads
+
+    def check_same_barcode_bins(self, dir_1, dir_2):
+        files_1 = sorted(os.listdir(os.path.join(self.output_dir, dir_1)))
+        files_2 = sorted(os.listdir(os.path.join(self.output_dir, dir_2)))
+        self.assertEqual(files_1, files_2)
+        for filename in files_1:
+            self.assertEqual(self.load_output_reads(os.path.join(dir_1, filename)),
+                             self.load_output_reads(os.path.join(dir_2, filename)))
+
+    def test_stream_same_as_normal(self):
+        self.run_command('porechop -i INPUT -o OUTPUT/normal.fastq', 'test_one_adapter_set.fastq')
+        self.run_command('porechop -i INPUT -o OUTPUT/stream.fastq --stream --stream_buffer 2',
+                         'test_one_adapter_set.fastq')
+        normal_reads = self.load_output_reads('normal.fastq')
+        stream_reads = self.load_output_reads('stream.fastq')
+        self.assertEqual(len(normal_reads), 12)
+        self.assertEqual(normal_reads, stream_reads)
+
+    def test_stream_verbosity_1_output(self):
+        out, err = self.run_command('porechop -i INPUT -o OUTPUT/stream.fastq --stream '
+                                    '--stream_buffer 4', 'test_one_adapter_set.fastq')
+        self.assertTrue('9 check reads loaded' in out)
+        self.assertTrue('9 reads processed' in out)
+        self.assertTrue('4 / 9 reads had adapters trimmed from their start' in out)
+        self.assertTrue('3 / 9 reads had adapters trimmed from their end' in out)
+        self.assertTrue('4 / 9 reads were split based on middle adapters' in out)
+        self.assertEqual(err, '')
+
+    def test_stream_barcodes(self):
+        self.run_command('porechop -i INPUT -b OUTPUT/normal', 'test_barcodes.fastq')
+        self.run_command('porechop -i INPUT -b OUTPUT/stream --stream --stream_buffer 3',
+                         'test_barcodes.fastq')
+        self.check_same_barcode_bins('normal', 'stream')
+
+    def test_process_same_as_thread(self):
+        thread_out, _ = self.run_command('porechop -i INPUT -o OUTPUT/thread.fastq -t 3 -v 2',
+                                         'test_one_adapter_set.fastq')
+        process_out, _ = self.run_command('porechop -i INPUT -o OUTPUT/process.fastq -t 3 -v 2 '
+                                          '--engine process', 'test_one_adapter_set.fastq')
+        thread_reads = self.load_output_reads('thread.fastq')
+        process_reads = self.load_output_reads('process.fastq')
+        self.assertEqual(len(thread_reads), 12)
+        self.assertEqual(thread_reads, process_reads)
+        self.assertEqual(thread_out.replace('thread.fastq', ''),
+                         process_out.replace('process.fastq', ''))
+
+    def test_threads_same_as_single(self):
+        single_out, _ = self.run_command('porechop -i INPUT -o OUTPUT/single.fastq -t 1 -v 2',
+                                         'test_two_adapter_sets.fastq')
+        thread_out, _ = self.run_command('porechop -i INPUT -o OUTPUT/thread.fastq -t 3 -v 2 '
+                                         '--chunk_size 2', 'test_two_adapter_sets.fastq')
+        self.assertEqual(self.load_output_reads('single.fastq'),
+                         self.load_output_reads('thread.fastq'))
+
+        # The progress lines update once per chunk, so they're left out of the comparison.
+        self.assertEqual([x for x in single_out.replace('single.fastq', '').split('\n')
+                          if '\r' not in x],
+                         [x for x in thread_out.replace('thread.fastq', '').split('\n')
+                          if '\r' not in x])
+
+    def test_process_barcodes(self):
+        self.run_command('porechop -i INPUT -b OUTPUT/thread -t 3', 'test_barcodes.fastq')
+        self.run_command('porechop -i INPUT -b OUTPUT/process -t 3 --engine process',
+                         'test_barcodes.fastq')
+        self.check_same_barcode_bins('thread', 'process')
+
+    def test_process_stream(self):
+        self.run_command('porechop -i INPUT -o OUTPUT/thread.fastq -t 2',
+                         'test_two_adapter_sets.fastq')
+        self.run_command('porechop -i INPUT -o OUTPUT/process.fastq -t 2 --engine process '
+                         '--stream --stream_buffer 3', 'test_two_adapter_sets.fastq')
+        self.assertEqual(self.load_output_reads('thread.fastq'),
+                         self.load_output_reads('process.fastq'))
+
+    def test_chunk_size(self):
+        self.run_command('porechop -i INPUT -o OUTPUT/thread.fastq -t 3',
+                         'test_two_adapter_sets.fastq')
+        for engine in ['thread', 'process']:
+            self.run_command('porechop -i INPUT -o OUTPUT/' + engine + '_chunk.fastq -t 3 '
+                             '--engine ' + engine + ' --chunk_size 2',
+                             'test_two_adapter_sets.fastq')
+            self.assertEqual(self.load_output_reads('thread.fastq'),
+                             self.load_output_reads(engine + '_chunk.fastq'))
+
+    def test_bad_chunk_size(self):
+        _, err = self.run_command('porechop -i INPUT -o OUTPUT/out.fastq --chunk_size 0',
+                                  'test_one_adapter_set.fastq')
+        self.assertTrue('--chunk_size must be at least 1' in err)
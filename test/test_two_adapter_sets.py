@@ -184,3 +184,15 @@ class TestTwoAdapterSets(unittest.TestCase):
         self.assertEqual(len(read_2[1]), 10970)
         read_3 = [x for x in trimmed_reads if x[0] == '3'][0]
         self.assertEqual(len(read_3[1]), 7970)
+
+    def test_partial_best_identities_marked(self):
+        """
+        Sets which aren't found, but were screened out of some read ends, have their best
+        identities marked, as those only come from the read ends which passed the screen.
+        """
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq')
+        rbk_line = [x for x in out.splitlines() if 'RBK004_upstream ' in x][0]
+        nsk_line = [x for x in out.splitlines() if 'SQK-NSK007 ' in x][0]
+        self.assertTrue('73.7*' in rbk_line)
+        self.assertFalse('*' in nsk_line)
+        self.assertTrue('* best identity from only the read ends which passed' in out)